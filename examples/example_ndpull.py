@@ -1,5 +1,4 @@
 from ndex.ndpull import ndpull
-from ndex.ndpull import boss_resources
 
 collection = 'kharris15'
 experiment = 'apical'
@@ -13,16 +12,22 @@ x = [4096, 4608]
 y = [4608, 5120]
 z = [90, 100]
 
-# print metadata
-meta = boss_resources.BossMeta(collection, experiment, channel)
-token, boss_url = ndpull.get_boss_config(config_file)
 args = ndpull.collect_input_args(
     collection, experiment, channel, config_file, x=x, y=y, z=z, res=0, outdir='./')
 # returns a namespace as a way of passing arguments
+# metadata is cached on disk (see metadata_ttl/cache_dir), so repeated calls skip the Boss round trips
 result, rmt = ndpull.validate_args(args)
 
-rmt = boss_resources.BossRemote(boss_url, token, meta)
-print(rmt)  # prints metadata
+# print metadata
+print(rmt)
 
 # downloads the data
 ndpull.download_slices(result, rmt)
+
+# or read the data straight into numpy arrays (zyx), without writing TIFF files
+# indices start at the start of the coordinate frame (vol.offset, xyz)
+from ndex.ndpull.volume import BossVolume
+
+vol = BossVolume(collection, experiment, channel, res=0, config_file=config_file)
+print(vol)
+data = vol[z[0]:z[1], y[0]:y[1], x[0]:x[1]]
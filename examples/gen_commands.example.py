@@ -282,6 +282,8 @@ if zrange:
         end_z = min(zrange[1], next_z)
 
         cmd = gen_comm(start_z, end_z)
+        # the workers share their progress (view it with: ndprogress FILE)
+        cmd += ' --status_file ingest_status_{}_{}.json'.format(collection, experiment)
         if os.name != 'nt':
             cmd += ' &'
         print(cmd + '\n')
@@ -0,0 +1,250 @@
+'''
+End-to-end throughput benchmarks of ndpush (ingest) and ndpull (pull)
+Synthetic image stacks are ingested with each datatype, thread count and block shape, then pulled back
+Reports MB/s, p50/p99 request latency and peak RSS, by default against a local mock Boss
+'''
+
+import argparse
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+from argparse import Namespace
+
+import numpy as np
+import tifffile
+
+from ndex.benchmarks.mock_boss import start_mock_boss_process
+from ndex.ndpull import ndpull
+from ndex.request_planner import get_request_shape
+from ndex.ndpush.event_log import read_events
+from ndex.ndpush.ingest_large_vol import per_channel_ingest, setup_channel_ingest
+
+try:
+    import resource
+except ImportError:
+    # not available on Windows
+    resource = None
+
+COLLECTION = 'ndex_benchmark'
+DATATYPES = ['uint8', 'uint16', 'uint64']
+
+RESULT_FIELDS = ['mode', 'datatype', 'threads', 'block', 'MB/s', 'p50_ms', 'p99_ms', 'peak_rss_mb',
+                 'seconds']
+
+
+def get_rss():
+    # resident set size (bytes) of this process
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, AttributeError):
+        pass
+    if resource is None:
+        return 0
+    # no /proc, the peak so far is the best we have (KB on linux, bytes on macOS)
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return maxrss if sys.platform == 'darwin' else maxrss * 1024
+
+
+class RSSMonitor:
+    # samples the RSS in the background while a benchmark runs, peak is in bytes
+    def __init__(self, interval=0.01):
+        self.interval = interval
+        self.peak = 0
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.sample, daemon=True)
+
+    def sample(self):
+        while True:
+            self.peak = max(self.peak, get_rss())
+            if self.stopped.wait(self.interval):
+                break
+
+    def __enter__(self):
+        self.peak = get_rss()
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stopped.set()
+        self.thread.join()
+        self.peak = max(self.peak, get_rss())
+
+
+def get_result(mode, datatype, threads, block, nbytes, seconds, latencies, peak_rss):
+    p50, p99 = np.percentile(latencies, [50, 99]) * 1000 if latencies else (0, 0)
+    return {'mode': mode, 'datatype': datatype, 'threads': threads, 'block': [int(b) for b in block],
+            'MB/s': float(nbytes / 1024**2 / seconds), 'p50_ms': float(p50), 'p99_ms': float(p99),
+            'peak_rss_mb': peak_rss / 1024**2, 'seconds': seconds}
+
+
+def gen_images(image_dir, datatype, size, seed=0):
+    # z slices (TIFF) of smooth data with some noise, compressing somewhat like EM images
+    # annotations (uint64) are blocks of labels
+    os.makedirs(image_dir, exist_ok=True)
+    rng = np.random.RandomState(seed)
+    y, x = np.mgrid[0:size[1], 0:size[0]]
+    for z in range(size[2]):
+        if datatype == 'uint64':
+            img = ((y // 64) * (size[0] // 64 + 1) + (x + 8 * z) // 64 + 1).astype(datatype)
+        else:
+            max_val = np.iinfo(datatype).max
+            img = ((x + y + 4 * z) % (max_val // 2) + rng.randint(1, max_val // 16, size=x.shape))
+            img = img.astype(datatype)
+        tifffile.imsave(os.path.join(image_dir, 'img_{:04d}.tif'.format(z)), img)
+    return image_dir
+
+
+def get_ingest_args(config_file, image_dir, datatype, size, channel, block_shape,
+                    collection=COLLECTION):
+    # ndpush arguments for ingesting the images from gen_images
+    experiment = 'benchmark_{}x{}x{}'.format(*size)
+    return Namespace(
+        datasource='local', base_path=image_dir, base_filename='img_<p:4>', extension='tif',
+        collection=collection, experiment=experiment, channel=channel, datatype=datatype,
+        source_channel='image' if datatype == 'uint64' else None,
+        voxel_size=[1, 1, 1], voxel_unit='nanometers', res=0, z_step=1,
+        x_extent=[0, size[0]], y_extent=[0, size[1]], z_extent=[0, size[2]],
+        z_range=[0, size[2]], boss_config_file=config_file, block_shape=block_shape,
+        verify_samples=0, create_resources=False, warn_missing_files=False,
+        no_progress=True)
+
+
+def benchmark_ingest(config_file, image_dir, datatype, size, threads, block_shape):
+    # ingests the images to a new channel, latencies are those of the POSTs in the event log
+    channel = '{}_t{}_{}x{}'.format(datatype, threads, *block_shape)
+    args = get_ingest_args(config_file, image_dir, datatype, size, channel, block_shape)
+
+    # resources first, like an ingest run with --create_resources
+    args.create_resources = True
+    setup_channel_ingest(args, channel)
+    args.create_resources = False
+
+    with RSSMonitor() as rss:
+        start_time = time.time()
+        per_channel_ingest(args, channel, threads=threads)
+        seconds = time.time() - start_time
+
+    event_log_fname = '_'.join(('ingest_events', args.collection, args.experiment, channel)) + '.jsonl'
+    events = list(read_events(event_log_fname, 'post'))
+    latencies = [event['seconds'] for event in events if event['status'] == 'ok']
+    nbytes = sum(event['nbytes'] for event in events if event['status'] == 'ok')
+    return get_result('ingest', datatype, threads, (*block_shape, 16), nbytes, seconds,
+                      latencies, rss.peak), args
+
+
+def benchmark_pull(config_file, ingest_args, threads, block_shape, outdir):
+    # pulls the full extent of an ingested channel, latencies are those of the cutout requests
+    datatype = ingest_args.datatype
+    request_mb = (block_shape[0] * block_shape[1] * 16 * np.dtype(datatype).itemsize / 1024**2)
+    result = ndpull.collect_input_args(
+        ingest_args.collection, ingest_args.experiment, ingest_args.channel,
+        config_file=config_file, outdir=outdir, full_extent=True,
+        cache_dir=os.path.join(outdir, 'cache'), metadata_ttl=0, request_size_mb=request_mb)
+    result, rmt = ndpull.validate_args(result)
+
+    latencies = []
+    fetch_cutout = rmt.fetch_cutout
+
+    def timed_fetch_cutout(*args, **kwargs):
+        start_time = time.time()
+        data = fetch_cutout(*args, **kwargs)
+        latencies.append(time.time() - start_time)
+        return data
+    rmt.fetch_cutout = timed_fetch_cutout
+
+    with RSSMonitor() as rss:
+        start_time = time.time()
+        ndpull.download_slices(result, rmt, threads=threads)
+        seconds = time.time() - start_time
+
+    nbytes = np.prod([rng[1] - rng[0] for rng in (result.x, result.y, result.z)]) * \
+        np.dtype(datatype).itemsize
+    return get_result('pull', datatype, threads, get_request_shape(datatype, request_mb), nbytes,
+                      seconds, latencies, rss.peak)
+
+
+def run_benchmarks(config_file, workdir, datatypes, threads_list, shapes, size, pull=True):
+    # every combination of datatype, thread count and block shape, results in the order they ran
+    # ingest logs, images and pulled slices are kept in workdir
+    config_file = os.path.abspath(config_file)
+    cwd = os.getcwd()
+    os.chdir(workdir)
+    results = []
+    try:
+        for datatype in datatypes:
+            image_dir = gen_images(os.path.join(workdir, 'images_{}'.format(datatype)),
+                                   datatype, size)
+            for threads in threads_list:
+                for shape in shapes:
+                    result, ingest_args = benchmark_ingest(config_file, image_dir, datatype, size,
+                                                           threads, shape)
+                    results.append(result)
+                    if pull:
+                        outdir = os.path.join(workdir, 'pull_{}'.format(ingest_args.channel))
+                        results.append(benchmark_pull(config_file, ingest_args, threads, shape,
+                                                      outdir))
+    finally:
+        os.chdir(cwd)
+    return results
+
+
+def print_results(results):
+    print('{:>7} {:>7} {:>8} {:>18} {:>9} {:>9} {:>9} {:>12} {:>8}'.format(*RESULT_FIELDS))
+    for result in results:
+        print('{mode:>7} {datatype:>7} {threads:>8} {block!s:>18} {MB/s:>9.1f} {p50_ms:>9.1f} {p99_ms:>9.1f} {peak_rss_mb:>12.1f} {seconds:>8.2f}'.format(
+            **dict(result, block=tuple(result['block']))))
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Benchmark ingest (ndpush) and pull (ndpull) throughput against a local mock Boss')
+    parser.add_argument('--boss_config_file', type=str,
+                        help='Benchmark a real Boss instead of the mock (creates collection {})'.format(COLLECTION))
+    parser.add_argument('--datatypes', type=str, nargs='+', default=['uint8', 'uint16'],
+                        choices=DATATYPES, help='Datatypes (uint64 is an annotation channel)')
+    parser.add_argument('--threads', type=int, nargs='+', default=[1, 4, 8],
+                        help='Numbers of threads')
+    parser.add_argument('--shapes', type=int, nargs='+', default=[512, 512, 1024, 1024, 2048, 2048],
+                        help='Block shapes as x y pairs (multiples of 512)')
+    parser.add_argument('--size', type=int, nargs=3, default=[2048, 2048, 32],
+                        help='x y z size of the synthetic volume')
+    parser.add_argument('--no_pull', action='store_true', help='Only benchmark ingests')
+    parser.add_argument('--latency', type=float, default=0,
+                        help='Seconds the mock Boss adds to each request')
+    parser.add_argument('--bandwidth_mb', type=float,
+                        help='MB/s limit of each mock Boss cutout request')
+    parser.add_argument('--workdir', type=str,
+                        help='Directory for the images and logs (a temporary directory by default)')
+    parser.add_argument('--output', type=str, help='Write the results to this JSON file')
+    args = parser.parse_args()
+
+    shapes = list(zip(args.shapes[::2], args.shapes[1::2]))
+    with tempfile.TemporaryDirectory() as tmpdir:
+        workdir = os.path.abspath(args.workdir or tmpdir)
+        os.makedirs(workdir, exist_ok=True)
+
+        mock_process = None
+        config_file = args.boss_config_file
+        if config_file is None:
+            config_file = os.path.join(workdir, 'mock_boss.cfg')
+            mock_process = start_mock_boss_process(config_file, latency=args.latency,
+                                                   bandwidth_mb=args.bandwidth_mb)
+        try:
+            results = run_benchmarks(config_file, workdir, args.datatypes, args.threads, shapes,
+                                     args.size, pull=not args.no_pull)
+        finally:
+            if mock_process is not None:
+                mock_process.terminate()
+
+    print_results(results)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,394 @@
+'''
+In-process stand-in for the Boss API
+Serves the project (collection, coordinate frame, experiment, channel), metadata, downsample
+and blosc cutout endpoints used by intern and ndpull, with the data kept in memory as cuboids
+Used to test and benchmark ingests and pulls without a live Boss
+'''
+
+import argparse
+import json
+import multiprocessing
+import random
+import socketserver
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+import blosc
+import numpy as np
+
+from ndex.common import CUBOID_SIZE, get_aligned_ranges
+
+BOSS_VERSION = 'v1'
+
+DEFAULT_TOKEN = 'mock_token'
+
+
+class ThreadingHTTPServer(socketserver.ThreadingMixIn, HTTPServer):
+    # http.server.ThreadingHTTPServer is only in python 3.7+
+    pass
+
+
+class MockBossError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+class MockBoss:
+    # latency: seconds added to every request
+    # bandwidth_mb: MB/s a cutout request body is limited to (None for unlimited)
+    # error_rate: fraction of cutout requests that fail with a 503
+    def __init__(self, token=DEFAULT_TOKEN, latency=0, bandwidth_mb=None, error_rate=0, seed=None):
+        self.token = token
+        self.latency = latency
+        self.bandwidth_mb = bandwidth_mb
+        self.error_rate = error_rate
+        self.random = random.Random(seed)
+
+        self.collections = {}
+        self.coords = {}
+        self.experiments = {}
+        self.channels = {}
+        self.metadata = {}
+        # zyx cuboids keyed by (coll, exp, ch, res, cuboid x, cuboid y, cuboid z)
+        self.cuboids = {}
+        self.lock = threading.Lock()
+
+        # number of requests per (method, endpoint)
+        self.num_requests = {}
+
+        self.server = None
+        self.thread = None
+
+    @property
+    def url(self):
+        host, port = self.server.server_address[:2]
+        return 'http://{}:{}'.format(host, port)
+
+    def start(self, host='127.0.0.1', port=0):
+        # port 0 picks a free port, see url
+        self.server = ThreadingHTTPServer((host, port), MockBossHandler)
+        self.server.daemon_threads = True
+        self.server.boss = self
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.thread.join()
+            self.server = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def write_config(self, fname):
+        # Boss config file (same format as neurodata.cfg) pointing at this server
+        protocol, host = self.url.split('://')
+        with open(fname, 'w') as f:
+            f.write('[Default]\nprotocol = {}\nhost = {}\ntoken = {}\n'.format(
+                protocol, host, self.token))
+        return fname
+
+    def add_channel(self, coll, exp, ch, datatype='uint8', x_extent=(0, 1024), y_extent=(0, 1024),
+                    z_extent=(0, 16), voxel_size=(1, 1, 1), voxel_unit='nanometers', ch_type='image'):
+        # creates the resources for a channel (and its collection, coordinate frame and experiment)
+        coord_frame = '_'.join((coll, exp))
+        with self.lock:
+            self.collections.setdefault(coll, {'name': coll, 'description': '', 'creator': 'mock'})
+            self.coords.setdefault(coord_frame, {
+                'name': coord_frame, 'description': '',
+                'x_start': x_extent[0], 'x_stop': x_extent[1],
+                'y_start': y_extent[0], 'y_stop': y_extent[1],
+                'z_start': z_extent[0], 'z_stop': z_extent[1],
+                'x_voxel_size': voxel_size[0], 'y_voxel_size': voxel_size[1],
+                'z_voxel_size': voxel_size[2], 'voxel_unit': voxel_unit})
+            self.experiments.setdefault((coll, exp), get_experiment_dict({
+                'name': exp, 'collection': coll, 'coord_frame': coord_frame}))
+            self.channels[(coll, exp, ch)] = get_channel_dict({
+                'name': ch, 'datatype': datatype, 'type': ch_type})
+
+    def write(self, coll, exp, ch, res, x_rng, y_rng, z_rng, data):
+        # stores zyx data in the cuboids it overlaps
+        for cx_rng, cy_rng, cz_rng in get_cuboid_ranges(x_rng, y_rng, z_rng):
+            key = (coll, exp, ch, res, cx_rng[0] // CUBOID_SIZE[0],
+                   cy_rng[0] // CUBOID_SIZE[1], cz_rng[0] // CUBOID_SIZE[2])
+            src = data[cz_rng[0] - z_rng[0]:cz_rng[1] - z_rng[0],
+                       cy_rng[0] - y_rng[0]:cy_rng[1] - y_rng[0],
+                       cx_rng[0] - x_rng[0]:cx_rng[1] - x_rng[0]]
+            with self.lock:
+                cuboid = self.cuboids.get(key)
+                if cuboid is None:
+                    cuboid = np.zeros(CUBOID_SIZE[::-1], dtype=data.dtype)
+                    self.cuboids[key] = cuboid
+                cuboid[get_cuboid_slices(cx_rng, cy_rng, cz_rng)] = src
+
+    def read(self, coll, exp, ch, res, x_rng, y_rng, z_rng, datatype):
+        # zyx data, zero where nothing was written
+        data = np.zeros((z_rng[1] - z_rng[0], y_rng[1] - y_rng[0], x_rng[1] - x_rng[0]),
+                        dtype=datatype)
+        for cx_rng, cy_rng, cz_rng in get_cuboid_ranges(x_rng, y_rng, z_rng):
+            key = (coll, exp, ch, res, cx_rng[0] // CUBOID_SIZE[0],
+                   cy_rng[0] // CUBOID_SIZE[1], cz_rng[0] // CUBOID_SIZE[2])
+            with self.lock:
+                cuboid = self.cuboids.get(key)
+                if cuboid is not None:
+                    data[cz_rng[0] - z_rng[0]:cz_rng[1] - z_rng[0],
+                         cy_rng[0] - y_rng[0]:cy_rng[1] - y_rng[0],
+                         cx_rng[0] - x_rng[0]:cx_rng[1] - x_rng[0]] = \
+                        cuboid[get_cuboid_slices(cx_rng, cy_rng, cz_rng)]
+        return data
+
+    def count_request(self, method, endpoint):
+        with self.lock:
+            self.num_requests[(method, endpoint)] = self.num_requests.get((method, endpoint), 0) + 1
+
+    def handle(self, method, path, query, body):
+        # returns (status, content) for a request, content is a dict (JSON), bytes (blosc) or None
+        parts = [part for part in path.split('/') if part]
+        if not parts or parts[0] != BOSS_VERSION or len(parts) < 2:
+            raise MockBossError(404, 'Unknown endpoint {}'.format(path))
+        endpoint, parts = parts[1], parts[2:]
+        self.count_request(method, endpoint)
+
+        if endpoint == 'collection':
+            return self.handle_project(method, parts, body)
+        if endpoint == 'coord' and len(parts) == 1:
+            return self.handle_resource(method, self.coords, parts[0], body, dict)
+        if endpoint == 'meta':
+            return self.handle_metadata(method, tuple(parts), query)
+        if endpoint == 'downsample' and len(parts) == 3 and method == 'GET':
+            return self.handle_downsample(*parts)
+        if endpoint == 'cutout' and len(parts) >= 7:
+            return self.handle_cutout(method, parts, body)
+        raise MockBossError(404, 'Unknown endpoint {}'.format(path))
+
+    def handle_project(self, method, parts, body):
+        # collection/<coll>[/experiment/<exp>[/channel/<ch>]]
+        if len(parts) == 1:
+            return self.handle_resource(method, self.collections, parts[0], body, get_collection_dict)
+        if len(parts) == 3 and parts[1] == 'experiment':
+            if parts[0] not in self.collections:
+                raise MockBossError(404, 'Collection {} not found'.format(parts[0]))
+            return self.handle_resource(method, self.experiments, (parts[0], parts[2]), body,
+                                        get_experiment_dict)
+        if len(parts) == 5 and parts[1] == 'experiment' and parts[3] == 'channel':
+            if (parts[0], parts[2]) not in self.experiments:
+                raise MockBossError(404, 'Experiment {} not found'.format(parts[2]))
+            return self.handle_resource(method, self.channels, (parts[0], parts[2], parts[4]), body,
+                                        get_channel_dict)
+        raise MockBossError(404, 'Unknown resource {}'.format('/'.join(parts)))
+
+    def handle_resource(self, method, resources, key, body, make_dict):
+        with self.lock:
+            if method == 'GET':
+                if key not in resources:
+                    raise MockBossError(404, '{} not found'.format(key))
+                return 200, resources[key]
+            if method == 'POST':
+                if key in resources:
+                    raise MockBossError(400, '{} already exists'.format(key))
+                resources[key] = make_dict(json.loads(body.decode()))
+                return 201, resources[key]
+            if method == 'DELETE':
+                if resources.pop(key, None) is None:
+                    raise MockBossError(404, '{} not found'.format(key))
+                return 204, None
+        raise MockBossError(405, 'Method {} not allowed'.format(method))
+
+    def handle_metadata(self, method, resource, query):
+        key = query.get('key', [None])[0]
+        value = query.get('value', [None])[0]
+        with self.lock:
+            keys = self.metadata.setdefault(resource, {})
+            if key is None and method == 'GET':
+                return 200, {'keys': sorted(keys)}
+            if method == 'GET' and key in keys:
+                return 200, {'key': key, 'value': keys[key]}
+            if method == 'POST' and key not in keys:
+                keys[key] = value
+                return 201, None
+            if method == 'PUT' and key in keys:
+                keys[key] = value
+                return 200, None
+            if method == 'DELETE' and key in keys:
+                del keys[key]
+                return 204, None
+        raise MockBossError(404, 'Metadata key {} not found'.format(key))
+
+    def handle_downsample(self, coll, exp, ch):
+        with self.lock:
+            channel = self.channels.get((coll, exp, ch))
+            experiment = self.experiments.get((coll, exp))
+        if channel is None or experiment is None:
+            raise MockBossError(404, 'Channel {} not found'.format(ch))
+        return 200, {'status': channel['downsample_status'],
+                     'num_hierarchy_levels': experiment['num_hierarchy_levels'],
+                     'cuboid_size': {str(res): list(CUBOID_SIZE)
+                                     for res in range(experiment['num_hierarchy_levels'])}}
+
+    def handle_cutout(self, method, parts, body):
+        # cutout/<coll>/<exp>/<ch>/<res>/<x0:x1>/<y0:y1>/<z0:z1>[/<t0:t1>]
+        coll, exp, ch, res = parts[0], parts[1], parts[2], int(parts[3])
+        x_rng, y_rng, z_rng = [[int(bnd) for bnd in rng.split(':')] for rng in parts[4:7]]
+        with self.lock:
+            channel = self.channels.get((coll, exp, ch))
+        if channel is None:
+            raise MockBossError(404, 'Channel {} not found'.format(ch))
+        datatype = channel['datatype']
+        shape = (z_rng[1] - z_rng[0], y_rng[1] - y_rng[0], x_rng[1] - x_rng[0])
+
+        if self.error_rate and self.random.random() < self.error_rate:
+            raise MockBossError(503, 'Simulated failure')
+
+        if method == 'POST':
+            self.throttle(len(body))
+            try:
+                data = np.frombuffer(blosc.decompress(body), dtype=datatype).reshape(shape)
+            except Exception as e:
+                raise MockBossError(400, 'Could not decode cutout: {}'.format(e))
+            self.write(coll, exp, ch, res, x_rng, y_rng, z_rng, data)
+            return 201, None
+        if method == 'GET':
+            data = self.read(coll, exp, ch, res, x_rng, y_rng, z_rng, datatype)
+            compressed = blosc.compress(data.tobytes(), typesize=data.dtype.itemsize)
+            self.throttle(len(compressed))
+            return 200, compressed
+        raise MockBossError(405, 'Method {} not allowed'.format(method))
+
+    def throttle(self, nbytes):
+        if self.bandwidth_mb:
+            time.sleep(nbytes / 1024**2 / self.bandwidth_mb)
+
+
+class MockBossHandler(BaseHTTPRequestHandler):
+    # keep-alive, so clients reuse connections like they do with the Boss
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        self.respond('GET')
+
+    def do_POST(self):
+        self.respond('POST')
+
+    def do_PUT(self):
+        self.respond('PUT')
+
+    def do_DELETE(self):
+        self.respond('DELETE')
+
+    def respond(self, method):
+        boss = self.server.boss
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        if boss.latency:
+            time.sleep(boss.latency)
+
+        url = urlsplit(self.path)
+        try:
+            if self.headers.get('Authorization') != 'Token {}'.format(boss.token):
+                raise MockBossError(401, 'Invalid token')
+            status, content = boss.handle(method, url.path, parse_qs(url.query), body)
+        except MockBossError as e:
+            status, content = e.status, {'status': e.status, 'message': str(e)}
+
+        if isinstance(content, bytes):
+            content_type = 'application/blosc'
+        elif content is None:
+            content, content_type = b'', None
+        else:
+            content, content_type = json.dumps(content).encode(), 'application/json'
+
+        self.send_response(status)
+        if content_type is not None:
+            self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, format, *args):
+        # requests aren't logged, there are too many of them
+        pass
+
+
+def get_collection_dict(params):
+    return dict({'description': '', 'experiments': []}, **params, creator='mock')
+
+
+def get_experiment_dict(params):
+    return dict({'description': '', 'num_hierarchy_levels': 1, 'hierarchy_method': 'anisotropic',
+                 'num_time_samples': 1, 'time_step': None, 'time_step_unit': None,
+                 'channels': []}, **params, creator='mock')
+
+
+def get_channel_dict(params):
+    return dict({'description': '', 'default_time_sample': 0, 'datatype': 'uint8',
+                 'base_resolution': 0, 'type': 'image', 'sources': [], 'related': [],
+                 'downsample_status': 'NOT_DOWNSAMPLED'}, **params, creator='mock')
+
+
+def get_cuboid_ranges(x_rng, y_rng, z_rng):
+    # parts of the ranges in each cuboid they overlap
+    return [(cx_rng, cy_rng, cz_rng)
+            for cz_rng in get_aligned_ranges(z_rng, CUBOID_SIZE[2])
+            for cy_rng in get_aligned_ranges(y_rng, CUBOID_SIZE[1])
+            for cx_rng in get_aligned_ranges(x_rng, CUBOID_SIZE[0])]
+
+
+def get_cuboid_slices(x_rng, y_rng, z_rng):
+    # zyx slices of ranges (inside a single cuboid) relative to the start of the cuboid
+    return tuple(slice(rng[0] % size, rng[0] % size + rng[1] - rng[0])
+                 for rng, size in zip((z_rng, y_rng, x_rng), CUBOID_SIZE[::-1]))
+
+
+def run_mock_boss(config_file, ready, **kwargs):
+    # target of a mock Boss process, ready is set once the config file is written
+    boss = MockBoss(**kwargs).start()
+    boss.write_config(config_file)
+    ready.set()
+    boss.thread.join()
+
+
+def start_mock_boss_process(config_file, timeout=30, **kwargs):
+    # mock Boss in its own process, so it doesn't compete with the client for the GIL or add to its memory
+    # returns the process (terminate it when done), the config file points at the server
+    ready = multiprocessing.Event()
+    process = multiprocessing.Process(target=run_mock_boss, args=(config_file, ready),
+                                      kwargs=kwargs, daemon=True)
+    process.start()
+    if not ready.wait(timeout):
+        process.terminate()
+        raise RuntimeError('Mock Boss did not start')
+    return process
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Run a local mock Boss (data is kept in memory and lost when it stops)')
+    parser.add_argument('--port', type=int, default=8000, help='Port to listen on')
+    parser.add_argument('--config_file', type=str, default='mock_boss.cfg',
+                        help='Boss config file written for ndpush/ndpull (--boss_config_file/--config_file)')
+    parser.add_argument('--latency', type=float, default=0, help='Seconds added to each request')
+    parser.add_argument('--bandwidth_mb', type=float, help='MB/s limit of each cutout request')
+    parser.add_argument('--error_rate', type=float, default=0,
+                        help='Fraction of cutout requests that fail (503)')
+    args = parser.parse_args()
+
+    boss = MockBoss(latency=args.latency, bandwidth_mb=args.bandwidth_mb,
+                    error_rate=args.error_rate).start(port=args.port)
+    boss.write_config(args.config_file)
+    print('Mock Boss at {}, config written to {}'.format(boss.url, args.config_file))
+    try:
+        boss.thread.join()
+    except KeyboardInterrupt:
+        boss.stop()
+
+
+if __name__ == '__main__':
+    main()
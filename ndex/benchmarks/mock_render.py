@@ -0,0 +1,250 @@
+'''
+In-process stand-in for a render-ws server
+Serves stack metadata and box images (png-image and tiff16-image) of synthetic data
+computed from the world coordinates, so tiled reads can be checked and benchmarked without a render server
+'''
+
+import argparse
+import io
+import json
+import multiprocessing
+import socketserver
+import threading
+import time
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from urllib.parse import parse_qs, unquote, urlsplit
+
+import numpy as np
+from PIL import Image
+
+RENDER_PATH = '/render-ws/v1/'
+
+
+class ThreadingHTTPServer(socketserver.ThreadingMixIn, HTTPServer):
+    # http.server.ThreadingHTTPServer is only in python 3.7+
+    pass
+
+
+class MockRender:
+    # latency: seconds added to every request
+    # mpixels_per_sec: rate images are rendered at (None for instant), like render-ws it scales with the box size
+    # cache_mb: encoded images are kept (least recently used are dropped), so repeated benchmark
+    # runs measure the client rather than the mock's PNG encoding
+    def __init__(self, latency=0, mpixels_per_sec=None, cache_mb=512):
+        self.latency = latency
+        self.mpixels_per_sec = mpixels_per_sec
+        self.cache_bytes = cache_mb * 1024**2
+        self.cache = OrderedDict()
+        self.cache_nbytes = 0
+
+        # stack bounds ([start, stop) in x, y and z) and channel names by (owner, project, stack)
+        self.stacks = {}
+        self.lock = threading.Lock()
+        self.num_requests = 0
+
+        self.server = None
+        self.thread = None
+
+    @property
+    def url(self):
+        # base URL of the render web service (ingest --render_baseURL)
+        host, port = self.server.server_address[:2]
+        return 'http://{}:{}{}'.format(host, port, RENDER_PATH)
+
+    def start(self, host='127.0.0.1', port=0):
+        self.server = ThreadingHTTPServer((host, port), MockRenderHandler)
+        self.server.daemon_threads = True
+        self.server.render = self
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.thread.join()
+            self.server = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def add_stack(self, owner, project, stack, x_rng=(0, 4096), y_rng=(0, 4096), z_rng=(0, 16),
+                  channels=None):
+        with self.lock:
+            self.stacks[(owner, project, stack)] = {
+                'x_rng': x_rng, 'y_rng': y_rng, 'z_rng': z_rng, 'channels': channels or []}
+
+    def get_metadata(self, stack):
+        # render stack metadata, max bounds are inclusive
+        return {'stats': {
+            'stackBounds': {'minX': float(stack['x_rng'][0]), 'maxX': float(stack['x_rng'][1] - 1),
+                            'minY': float(stack['y_rng'][0]), 'maxY': float(stack['y_rng'][1] - 1),
+                            'minZ': float(stack['z_rng'][0]), 'maxZ': float(stack['z_rng'][1] - 1)},
+            'maxTileWidth': 2048.0, 'maxTileHeight': 2048.0,
+            'channelNames': stack['channels']}}
+
+    def handle(self, path, query):
+        # returns (status, content type, body)
+        parts = [unquote(part) for part in path[len(RENDER_PATH):].split('/') if part]
+        if (not path.startswith(RENDER_PATH) or len(parts) < 6
+                or parts[0:5:2] != ['owner', 'project', 'stack']):
+            return 404, 'text/plain', b'Unknown endpoint'
+        with self.lock:
+            self.num_requests += 1
+            stack = self.stacks.get((parts[1], parts[3], parts[5]))
+        if stack is None:
+            return 404, 'text/plain', b'Stack not found'
+
+        if len(parts) == 6:
+            return 200, 'application/json', json.dumps(self.get_metadata(stack)).encode()
+
+        # z/<z>/box/<x>,<y>,<width>,<height>,<scale>/<png|tiff16>-image
+        if len(parts) != 11 or parts[6] != 'z' or parts[8] != 'box':
+            return 404, 'text/plain', b'Unknown endpoint'
+        channel = query.get('channels', [None])[0]
+        if channel is not None and channel not in stack['channels']:
+            return 400, 'text/plain', b'Unknown channel'
+        x, y, width, height = [int(float(val)) for val in parts[9].split(',')[:4]]
+        scale = float(parts[9].split(',')[4])
+        window = None
+        if 'minIntensity' in query and 'maxIntensity' in query:
+            window = [float(query['minIntensity'][0]), float(query['maxIntensity'][0])]
+
+        img_type = parts[10][:-len('-image')]
+        content_type = 'image/{}'.format('png' if img_type == 'png' else 'tiff')
+        if self.mpixels_per_sec:
+            time.sleep(round(width * scale) * round(height * scale) / 1e6 / self.mpixels_per_sec)
+
+        key = (path, channel, str(window))
+        body = self.get_cached(key)
+        if body is None:
+            img = render_box(stack, int(float(parts[7])), x, y, width, height, scale, img_type, window)
+            body = encode_img(img, img_type)
+            self.put_cached(key, body)
+        return 200, content_type, body
+
+    def get_cached(self, key):
+        with self.lock:
+            body = self.cache.get(key)
+            if body is not None:
+                self.cache.move_to_end(key)
+            return body
+
+    def put_cached(self, key, body):
+        with self.lock:
+            if key not in self.cache and len(body) <= self.cache_bytes:
+                self.cache[key] = body
+                self.cache_nbytes += len(body)
+                while self.cache_nbytes > self.cache_bytes:
+                    self.cache_nbytes -= len(self.cache.popitem(last=False)[1])
+
+
+class MockRenderHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        render = self.server.render
+        if render.latency:
+            time.sleep(render.latency)
+        url = urlsplit(self.path)
+        status, content_type, body = render.handle(url.path, parse_qs(url.query))
+
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def get_source(stack, z, x, y):
+    # 16 bit synthetic data at world coordinates x, y (arrays), zero outside of the stack
+    data = (x + 2 * y + 3 * z).astype('int32') % 2**16
+    inside = ((x >= stack['x_rng'][0]) & (x < stack['x_rng'][1])
+              & (y >= stack['y_rng'][0]) & (y < stack['y_rng'][1])
+              & (stack['z_rng'][0] <= z < stack['z_rng'][1]))
+    return np.where(inside, data, 0)
+
+
+def render_box(stack, z, x, y, width, height, scale, img_type='png', window=None):
+    # the image render-ws returns for a box at (unscaled) world coordinates
+    # png images are 8 bit, with the intensity window (default: full 16 bit range) mapped to 0-255
+    out_width, out_height = round(width * scale), round(height * scale)
+    xs = x + (np.arange(out_width) / scale).astype(int)
+    ys = y + (np.arange(out_height) / scale).astype(int)
+    data = get_source(stack, z, xs[np.newaxis, :], ys[:, np.newaxis])
+
+    if img_type == 'tiff16':
+        return data.astype('uint16')
+    if window is None:
+        window = [0, 2**16 - 1]
+    data = (data - window[0]) * 255 / (window[1] - window[0])
+    return np.clip(data, 0, 255).astype('uint8')
+
+
+def encode_img(img, img_type):
+    out = io.BytesIO()
+    if img_type == 'tiff16':
+        Image.fromarray(img).save(out, format='TIFF')
+    else:
+        # render-ws PNGs are RGBA, gray values in R, G and B
+        rgba = np.dstack([img, img, img, np.full_like(img, 255)])
+        Image.fromarray(rgba, 'RGBA').save(out, format='PNG', compress_level=1)
+    return out.getvalue()
+
+
+def run_mock_render(conn, stacks, **kwargs):
+    # target of a mock render process, sends the base URL once it's serving the stacks
+    render = MockRender(**kwargs).start()
+    for stack_args in stacks:
+        render.add_stack(*stack_args)
+    conn.send(render.url)
+    render.thread.join()
+
+
+def start_mock_render_process(stacks, timeout=30, **kwargs):
+    # mock render in its own process (PNG encoding would otherwise compete with the client for the GIL)
+    # stacks is a list of add_stack arguments, returns the process (terminate it when done) and base URL
+    conn, child_conn = multiprocessing.Pipe()
+    process = multiprocessing.Process(target=run_mock_render, args=(child_conn, stacks),
+                                      kwargs=kwargs, daemon=True)
+    process.start()
+    if not conn.poll(timeout):
+        process.terminate()
+        raise RuntimeError('Mock render did not start')
+    return process, conn.recv()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run a local mock render-ws server')
+    parser.add_argument('--port', type=int, default=8080, help='Port to listen on')
+    parser.add_argument('--owner', type=str, default='mock', help='Owner of the stack')
+    parser.add_argument('--project', type=str, default='mock', help='Project of the stack')
+    parser.add_argument('--stack', type=str, default='mock', help='Name of the stack')
+    parser.add_argument('--size', type=int, nargs=3, default=[8192, 8192, 16],
+                        help='x y z size of the stack')
+    parser.add_argument('--latency', type=float, default=0, help='Seconds added to each request')
+    parser.add_argument('--mpixels_per_sec', type=float,
+                        help='Rate images are rendered at (megapixels per second per request)')
+    args = parser.parse_args()
+
+    render = MockRender(latency=args.latency, mpixels_per_sec=args.mpixels_per_sec).start(port=args.port)
+    render.add_stack(args.owner, args.project, args.stack, (0, args.size[0]), (0, args.size[1]),
+                     (0, args.size[2]))
+    print('Mock render at {} (owner {}, project {}, stack {})'.format(
+        render.url, args.owner, args.project, args.stack))
+    try:
+        render.thread.join()
+    except KeyboardInterrupt:
+        render.stop()
+
+
+if __name__ == '__main__':
+    main()
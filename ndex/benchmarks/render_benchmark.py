@@ -0,0 +1,119 @@
+'''
+Throughput benchmarks of full slice reads from render (renderResource.get_render_img)
+Sweeps scale, tile size and thread count to tune the render datasource of ndpush
+Reports MB/s and p50/p99 tile latency, by default against a local mock render-ws
+'''
+
+import argparse
+import json
+import time
+
+import numpy as np
+
+from ndex.benchmarks.mock_render import start_mock_render_process
+from ndex.ndpush.render_resource import renderResource
+
+RESULT_FIELDS = ['scale', 'tile_size', 'threads', 'tiles', 'MB/s', 'seconds', 'p50_ms', 'p99_ms']
+
+
+def benchmark_get_render_img(render_obj, tile_size, threads, num_runs=3, window=None):
+    # reads num_runs slices, latencies are those of the tile requests
+    latencies = []
+    get_render_tile = render_obj.get_render_tile
+
+    def timed_get_render_tile(*args, **kwargs):
+        start_time = time.time()
+        data = get_render_tile(*args, **kwargs)
+        latencies.append(time.time() - start_time)
+        return data
+    render_obj.get_render_tile = timed_get_render_tile
+
+    nbytes = 0
+    start_time = time.time()
+    for run in range(num_runs):
+        z = render_obj.z_rng[0] + run % (render_obj.z_rng[1] - render_obj.z_rng[0])
+        nbytes += render_obj.get_render_img(z, window=window, threads=threads,
+                                            tile_size=tile_size).nbytes
+    seconds = time.time() - start_time
+    del render_obj.get_render_tile
+
+    p50, p99 = np.percentile(latencies, [50, 99]) * 1000
+    return {'scale': render_obj.scale, 'tile_size': tile_size, 'threads': threads,
+            'tiles': len(latencies) // num_runs, 'MB/s': nbytes / 1024**2 / seconds,
+            'seconds': seconds / num_runs, 'p50_ms': float(p50), 'p99_ms': float(p99)}
+
+
+def benchmark_render(baseURL, owner, project, stack, datatype, scales, tile_sizes, threads_list,
+                     num_runs=3, channel=None, window=None):
+    # every combination of scale, tile size and thread count
+    results = []
+    for scale in scales:
+        render_obj = renderResource(owner, project, stack, baseURL, datatype,
+                                    channel=channel, scale=scale)
+        for tile_size in tile_sizes:
+            for threads in threads_list:
+                results.append(benchmark_get_render_img(render_obj, tile_size, threads,
+                                                        num_runs=num_runs, window=window))
+    return results
+
+
+def print_results(results):
+    print('{:>6} {:>10} {:>8} {:>6} {:>8} {:>8} {:>8} {:>8}'.format(*RESULT_FIELDS))
+    for result in results:
+        print('{scale:>6} {tile_size:>10} {threads:>8} {tiles:>6} {MB/s:>8.1f} {seconds:>8.2f} {p50_ms:>8.1f} {p99_ms:>8.1f}'.format(
+            **result))
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Benchmark reading slices from render (get_render_img) by scale, tile size and threads')
+    parser.add_argument('--render_baseURL', type=str,
+                        help='Base URL of a render instance, a local mock is used if not set')
+    parser.add_argument('--render_owner', type=str, default='mock', help='Name of owner in render')
+    parser.add_argument('--render_project', type=str, default='mock', help='Name of project in render')
+    parser.add_argument('--render_stack', type=str, default='mock', help='Name of stack in render')
+    parser.add_argument('--render_channel', type=str, help='Name of channel in render')
+    parser.add_argument('--render_window', type=int, nargs=2,
+                        help='Window used on 16bit -> 8 bit data conversion')
+    parser.add_argument('--datatype', type=str, default='uint8', help='uint8 (png) or uint16 (tiff16)')
+    parser.add_argument('--scales', type=float, nargs='+', default=[1, 0.5],
+                        help='Scales to read the slices at')
+    parser.add_argument('--tile_sizes', type=int, nargs='+', default=[1024, 2048, 4096, 8192],
+                        help='Sizes (scaled) of the tiles requested from render')
+    parser.add_argument('--threads', type=int, nargs='+', default=[1, 4, 8, 16],
+                        help='Numbers of tiles requested at the same time')
+    parser.add_argument('--runs', type=int, default=3, help='Slices read for each combination')
+    parser.add_argument('--size', type=int, nargs=3, default=[8192, 8192, 4],
+                        help='x y z size of the mock stack')
+    parser.add_argument('--latency', type=float, default=0,
+                        help='Seconds the mock render adds to each request')
+    parser.add_argument('--mpixels_per_sec', type=float,
+                        help='Rate the mock renders images at (megapixels per second per request)')
+    parser.add_argument('--output', type=str, help='Write the results to this JSON file')
+    args = parser.parse_args()
+
+    mock_process = None
+    baseURL = args.render_baseURL
+    if baseURL is None:
+        stack = (args.render_owner, args.render_project, args.render_stack, (0, args.size[0]),
+                 (0, args.size[1]), (0, args.size[2]),
+                 [args.render_channel] if args.render_channel else None)
+        mock_process, baseURL = start_mock_render_process(
+            [stack], latency=args.latency, mpixels_per_sec=args.mpixels_per_sec)
+    try:
+        results = benchmark_render(baseURL, args.render_owner, args.render_project,
+                                   args.render_stack, args.datatype, args.scales, args.tile_sizes,
+                                   args.threads, num_runs=args.runs, channel=args.render_channel,
+                                   window=args.render_window)
+    finally:
+        if mock_process is not None:
+            mock_process.terminate()
+
+    print_results(results)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,58 @@
+'''
+Helpers shared by ndpull and ndpush: the Boss config, its cuboids and copying blocks between
+regions (xyz ranges) of zyx arrays
+'''
+
+import configparser
+import os
+
+# the Boss stores data in cuboids of this size (xyz)
+CUBOID_SIZE = (512, 512, 16)
+
+
+def get_boss_config(boss_config_file=None):
+    # token and url of the Boss from an intern config file, or BOSS_TOKEN for the public Boss
+    config = configparser.ConfigParser()
+
+    if boss_config_file:
+        config.read(boss_config_file)
+        token = config['Default']['token']
+        protocol = config['Default']['protocol']
+        host = config['Default']['host']
+    else:
+        token = os.environ['BOSS_TOKEN']
+        protocol = 'https'
+        host = 'api.boss.neurodata.io'
+
+    boss_url = ''.join((protocol, '://', host))
+    return token, boss_url
+
+
+def get_aligned_ranges(rng, stride, extent=None):
+    # splits rng into [start, stop] ranges on multiples of stride, clipped to rng and extent
+    first, last = rng
+    if extent is not None:
+        first, last = max(first, extent[0]), min(last, extent[1])
+
+    ranges = []
+    start = first
+    while start < last:
+        stop = min((start // stride + 1) * stride, last)
+        ranges.append([start, stop])
+        start = stop
+    return ranges
+
+
+def get_zyx_shape(x_rng, y_rng, z_rng):
+    return (z_rng[1] - z_rng[0], y_rng[1] - y_rng[0], x_rng[1] - x_rng[0])
+
+
+def insert_block(data, data_rngs, block_data, block_rngs):
+    # copies the overlap of a block (with xyz ranges block_rngs) into data (with xyz ranges data_rngs)
+    overlap = [[max(d[0], b[0]), min(d[1], b[1])]
+               for d, b in zip(data_rngs, block_rngs)]
+    dst = tuple(slice(o[0] - d[0], o[1] - d[0])
+                for o, d in zip(reversed(overlap), reversed(data_rngs)))
+    src = tuple(slice(o[0] - b[0], o[1] - b[0])
+                for o, b in zip(reversed(overlap), reversed(block_rngs)))
+    data[dst] = block_data[src]
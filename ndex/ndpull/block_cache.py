@@ -0,0 +1,116 @@
+'''
+Local on-disk cache of Boss cuboids for ndpull
+Blocks are stored blosc compressed under a hash of (url, coll, exp, ch, res, iso, block index)
+'''
+
+import hashlib
+import os
+import tempfile
+import threading
+from pathlib import Path
+
+import blosc
+import numpy as np
+
+from ndex.ndpull.boss_resources import get_default_cache_dir
+
+# default upper bound on the size of the block cache on disk (GB)
+DEFAULT_BLOCK_CACHE_GB = 10
+
+
+class BlockCache:
+    def __init__(self, cache_dir=None, max_bytes=DEFAULT_BLOCK_CACHE_GB * 1024**3):
+        if cache_dir is None:
+            cache_dir = get_default_cache_dir()
+        self.cache_path = Path(cache_dir, 'blocks')
+        self.max_bytes = max_bytes
+
+        self.lock = threading.Lock()
+        # total size of the cache, computed on first write
+        self.total_bytes = None
+
+    def get_fname(self, key):
+        digest = hashlib.sha256(repr(key).encode()).hexdigest()
+        return self.cache_path / digest[:2] / (digest + '.blosc')
+
+    def get(self, key, shape, datatype):
+        # returns the cached block as an array of shape (zyx) or None if it isn't cached
+        fname = self.get_fname(key)
+        try:
+            with fname.open('rb') as f:
+                compressed = f.read()
+        except OSError:
+            return None
+
+        data = np.empty(shape, dtype=datatype)
+        if blosc.get_cbuffer_sizes(compressed)[0] != data.nbytes:
+            # not the block we expect (different extents or datatype), treat it as a miss
+            return None
+        blosc.decompress_ptr(compressed, data.__array_interface__['data'][0])
+
+        # the modification time is used for the LRU ordering
+        try:
+            os.utime(str(fname))
+        except OSError:
+            pass
+        return data
+
+    def put(self, key, data):
+        data = np.ascontiguousarray(data)
+        compressed = blosc.compress(data.tobytes(), typesize=data.dtype.itemsize)
+
+        fname = self.get_fname(key)
+        fname.parent.mkdir(parents=True, exist_ok=True)
+
+        fd, tmp_fname = tempfile.mkstemp(dir=str(fname.parent), suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(compressed)
+            try:
+                old_size = fname.stat().st_size
+            except OSError:
+                old_size = 0
+            os.replace(tmp_fname, str(fname))
+        except OSError:
+            try:
+                os.remove(tmp_fname)
+            except OSError:
+                pass
+            return
+
+        with self.lock:
+            if self.total_bytes is None:
+                self.total_bytes = self.get_cache_size()
+            else:
+                self.total_bytes += len(compressed) - old_size
+            if self.total_bytes > self.max_bytes:
+                self.evict()
+
+    def list_blocks(self):
+        blocks = []
+        if self.cache_path.is_dir():
+            for fname in self.cache_path.glob('*/*.blosc'):
+                try:
+                    stat = fname.stat()
+                except OSError:
+                    continue
+                blocks.append((stat.st_mtime, stat.st_size, fname))
+        return blocks
+
+    def get_cache_size(self):
+        return sum(size for _, size, _ in self.list_blocks())
+
+    def evict(self):
+        # removes least recently used blocks until the cache is back under 90% of its limit
+        blocks = sorted(self.list_blocks())
+        total_bytes = sum(size for _, size, _ in blocks)
+        target = self.max_bytes * 0.9
+        for _, size, fname in blocks:
+            if total_bytes <= target:
+                break
+            try:
+                fname.unlink()
+            except OSError:
+                continue
+            total_bytes -= size
+        self.total_bytes = total_bytes
@@ -1,12 +1,78 @@
+import hashlib
 import json
+import os
+import tempfile
 import time
+from multiprocessing.dummy import Pool as ThreadPool
+from pathlib import Path
 
 import blosc
 import numpy as np
 import requests
 
+from ndex.common import (CUBOID_SIZE, get_aligned_ranges, get_boss_config, get_zyx_shape,
+                         insert_block)
+
 BOSS_VERSION = "v1"
 
+# metadata responses are reused for this many seconds (0 disables the cache)
+DEFAULT_METADATA_TTL = 3600
+
+
+def get_default_cache_dir():
+    # cache lives under NDEX_CACHE_DIR if set, otherwise in the user's home directory
+    cache_dir = os.environ.get('NDEX_CACHE_DIR')
+    if cache_dir is None:
+        cache_dir = os.path.join(os.path.expanduser('~'), '.cache', 'ndex')
+    return cache_dir
+
+
+class MetadataCache:
+    # on-disk cache of Boss metadata (JSON) responses, entries expire after ttl seconds
+    def __init__(self, cache_dir=None, ttl=DEFAULT_METADATA_TTL):
+        if cache_dir is None:
+            cache_dir = get_default_cache_dir()
+        self.cache_path = Path(cache_dir, 'metadata')
+        self.ttl = ttl
+
+    def get_fname(self, key):
+        return self.cache_path / (hashlib.sha256(key.encode()).hexdigest() + '.json')
+
+    def get(self, key):
+        if self.ttl <= 0:
+            return None
+        try:
+            with self.get_fname(key).open() as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+
+        if time.time() - entry['time'] > self.ttl:
+            return None
+        return entry['data']
+
+    def set(self, key, data):
+        if self.ttl <= 0:
+            return
+        self.cache_path.mkdir(parents=True, exist_ok=True)
+
+        # write to a temporary file and swap it in so readers never see a partial entry
+        fd, tmp_fname = tempfile.mkstemp(dir=str(self.cache_path), suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w') as f:
+                json.dump({'time': time.time(), 'data': data}, f)
+            os.replace(tmp_fname, str(self.get_fname(key)))
+        except OSError:
+            try:
+                os.remove(tmp_fname)
+            except OSError:
+                pass
+
+    def clear(self):
+        if self.cache_path.is_dir():
+            for fname in self.cache_path.glob('*.json'):
+                fname.unlink()
+
 
 class BossMeta:
     def __init__(self, collection, experiment, channel, res=0, iso=False):
@@ -33,7 +99,7 @@ class BossMeta:
 
 
 class BossRemote:
-    def __init__(self, boss_url, token, meta):
+    def __init__(self, boss_url, token, meta, metadata_cache=None, block_cache=None):
         self.boss_url = boss_url
         if self.boss_url[-1] != '/':
             self.boss_url += '/'
@@ -42,13 +108,29 @@ class BossRemote:
         # BossMeta contains col, exp, chn info
         self.meta = meta
 
+        # optional MetadataCache, None always goes to the server
+        self.metadata_cache = metadata_cache
+        # optional BlockCache for cutout data
+        self.block_cache = block_cache
+
         self.session = requests.Session()
         self.session.headers = {'Authorization': 'Token {}'.format(self.token)}
 
-        self.boss_coll_metadata = self.get_coll_metadata()
-        self.boss_exp_metadata = self.get_exp_metadata()
-        self.boss_ch_metadata = self.get_channel_metdata()
-        self.downsample_status = self.get_downsample_status()
+        self.prefetch_metadata()
+
+    def prefetch_metadata(self):
+        # the collection, experiment, channel and downsample requests are independent so we send them together
+        getters = [self.get_coll_metadata, self.get_exp_metadata,
+                   self.get_channel_metdata, self.get_downsample_status]
+        with ThreadPool(len(getters)) as pool:
+            results = pool.map(lambda getter: getter(), getters)
+
+        (self.boss_coll_metadata, self.boss_exp_metadata,
+         self.boss_ch_metadata, self.downsample_status) = results
+
+        # coordinate frame name comes from the experiment, so this one has to wait
+        self.boss_coord_frame_metadata = self.get_coord_frame_metadata(
+            exp_metadata=self.boss_exp_metadata)
 
     def __str__(self):
         string = 'Collection: {}, Experiment: {}, Channel: {}\n'.format(
@@ -60,7 +142,7 @@ class BossRemote:
         metadata_str = json.dumps(metadata, indent=indent_size)
         string += 'Experiment metadata:\n{}\n\n'.format(metadata_str)
 
-        metadata = self.get_coord_frame_metadata(exp_metadata=metadata)
+        metadata = self.boss_coord_frame_metadata
         metadata_str = json.dumps(metadata, indent=indent_size)
         string += 'Coordinate frame metadata:\n{}\n\n'.format(metadata_str)
 
@@ -70,49 +152,66 @@ class BossRemote:
 
         return string
 
-    def get(self, url, headers={}):
+    def get(self, url, headers={}, stream=False):
         if url[0] == '/':
             url = url[1:]
         r = self.session.get("{}{}".format(
-            self.boss_url, url), headers=headers)
+            self.boss_url, url), headers=headers, stream=stream)
         return r
 
+    def get_metadata(self, url, cacheable=None):
+        # GET a JSON metadata endpoint, going through the metadata cache when there is one
+        # cacheable (optional) decides whether a successful response may be stored
+        # the token is part of the key as metadata visibility depends on permissions
+        cache_key = ' '.join((self.boss_url, url, self.token))
+        if self.metadata_cache is not None:
+            data = self.metadata_cache.get(cache_key)
+            if data is not None:
+                return data
+
+        resp = self.get(url, {'Accept': 'application/json'})
+        data = resp.json()
+
+        if self.metadata_cache is not None and resp.status_code == 200:
+            if cacheable is None or cacheable(data):
+                self.metadata_cache.set(cache_key, data)
+        return data
+
     def get_coll_metadata(self):
         # https://api.theboss.io/v1/collection/:collection/
         url = "{}/collection/{}".format(
             BOSS_VERSION, self.meta.collection()
         )
-        resp = self.get(url, {'Accept': 'application/json'})
-        return resp.json()
+        return self.get_metadata(url)
 
     def get_exp_metadata(self):
         # https://api.theboss.io/v1/collection/:collection/experiment/:experiment/
         exp_url = "{}/collection/{}/experiment/{}/".format(
             BOSS_VERSION, self.meta.collection(), self.meta.experiment()
         )
-        resp = self.get(exp_url, {'Accept': 'application/json'})
-        return resp.json()
+        return self.get_metadata(exp_url)
 
     def get_channel_metdata(self):
         # https://api.boss.neurodata.io/v1/collection/:collection/experiment/:experiment/channel/:channel/
         ch_url = '{}/collection/{}/experiment/{}/channel/{}/'.format(
             BOSS_VERSION, self.meta.collection(), self.meta.experiment(), self.meta.channel()
         )
-        resp = self.get(ch_url, {'Accept': 'application/json'})
-        return resp.json()
+        return self.get_metadata(ch_url)
 
     def get_coord_frame_metadata(self, exp_metadata=None):
+        if exp_metadata is None and hasattr(self, 'boss_coord_frame_metadata'):
+            return self.boss_coord_frame_metadata
+
         coord_frame_name = self.get_coord_frame_name(exp_metadata)
         coord_frame_url = "{}/coord/{}".format(BOSS_VERSION, coord_frame_name)
-        resp = self.get(coord_frame_url, {'Accept': 'application/json'})
-        return resp.json()
+        return self.get_metadata(coord_frame_url)
 
     def get_downsample_status(self):
         # https://api.boss.neurodata.io/v1/downsample/kristina15/image/CR1_2ndA
         url = "{}/downsample/{}/{}/{}".format(
             BOSS_VERSION, self.meta.collection(), self.meta.experiment(), self.meta.channel())
-        resp = self.get(url, {'Accept': 'application/json'})
-        return resp.json()
+        # only a finished downsample is final, anything else could change at any moment
+        return self.get_metadata(url, cacheable=lambda data: data.get('status') == 'DOWNSAMPLED')
 
     def get_coord_frame_name(self, exp_data=None):
         if exp_data is None:
@@ -124,18 +223,59 @@ class BossRemote:
         x_rng = [coord_frame['x_start'], coord_frame['x_stop']]
         y_rng = [coord_frame['y_start'], coord_frame['y_stop']]
         z_rng = [coord_frame['z_start'], coord_frame['z_stop']]
-
-        # extents are different in x/y for downsampled data
-        x_rng, y_rng = [[round(bnd / 2**self.meta.res()) for bnd in rng]
-                        for rng in [x_rng, y_rng]]
-
-        if self.meta.iso():
-            # need to convert to list to set new z_rng
-            z_rng = [int(z / 2**self.meta.res()) for z in z_rng]
-
-        return x_rng, y_rng, z_rng
-
-    def cutout(self, x_rng, y_rng, z_rng, datatype, attempts=5):
+        return get_res_extents((x_rng, y_rng, z_rng), self.meta.res(), self.meta.iso())
+
+    def cutout(self, x_rng, y_rng, z_rng, datatype, attempts=5, out=None):
+        # out (optional) is a C contiguous array (zyx) the data is decoded into
+        if self.block_cache is not None:
+            return self.cached_cutout(x_rng, y_rng, z_rng, datatype, attempts=attempts, out=out)
+        return self.fetch_cutout(x_rng, y_rng, z_rng, datatype, attempts=attempts, out=out)
+
+    def get_block_key(self, x_rng, y_rng, z_rng):
+        return (self.boss_url, self.meta.collection(), self.meta.experiment(), self.meta.channel(),
+                self.meta.res(), self.meta.iso(), x_rng[0], y_rng[0], z_rng[0])
+
+    def cached_cutout(self, x_rng, y_rng, z_rng, datatype, attempts=5, out=None):
+        # cutout assembled from cuboid aligned blocks, only blocks missing from the cache are downloaded
+        extents = self.get_xyz_extents()
+        if out is None:
+            data = np.zeros(get_zyx_shape(x_rng, y_rng, z_rng), dtype=datatype)
+        else:
+            data = out
+            if not all(rng[0] >= ext[0] and rng[1] <= ext[1]
+                       for rng, ext in zip((x_rng, y_rng, z_rng), extents)):
+                # blocks won't cover the part outside of the data
+                data[...] = 0
+
+        # blocks are aligned to the Boss cuboids and clipped to the extent of the data
+        blocks = [get_aligned_block([bx, by, bz], extents)
+                  for bz in get_aligned_ranges(z_rng, CUBOID_SIZE[2], extents[2])
+                  for by in get_aligned_ranges(y_rng, CUBOID_SIZE[1], extents[1])
+                  for bx in get_aligned_ranges(x_rng, CUBOID_SIZE[0], extents[0])]
+
+        missing = []
+        for block in blocks:
+            block_data = self.block_cache.get(
+                self.get_block_key(*block), get_zyx_shape(*block), datatype)
+            if block_data is None:
+                missing.append(block)
+            else:
+                insert_block(data, (x_rng, y_rng, z_rng), block_data, block)
+
+        # a request per box of missing blocks, so cached blocks aren't downloaded again
+        for fetch_rngs in merge_blocks(missing):
+            fetched = self.fetch_cutout(*fetch_rngs, datatype, attempts=attempts)
+            for block in missing:
+                if not all(f[0] <= b[0] and b[1] <= f[1] for b, f in zip(block, fetch_rngs)):
+                    continue
+                block_data = fetched[tuple(slice(b[0] - f[0], b[1] - f[0])
+                                           for b, f in zip(reversed(block), reversed(fetch_rngs)))]
+                self.block_cache.put(self.get_block_key(*block), block_data)
+                insert_block(data, (x_rng, y_rng, z_rng), block_data, block)
+
+        return data
+
+    def fetch_cutout(self, x_rng, y_rng, z_rng, datatype, attempts=5, out=None):
         cutout_url_base = "{}/cutout/{}/{}/{}".format(
             BOSS_VERSION, self.meta.collection(), self.meta.experiment(), self.meta.channel())
         cutout_url = "{}/{}/{}:{}/{}:{}/{}:{}/".format(
@@ -144,25 +284,105 @@ class BossRemote:
             cutout_url += '?iso=True'
 
         for attempt in range(attempts):
+            resp = None
             try:
-                resp = self.get(cutout_url, {'Accept': 'application/blosc'})
+                resp = self.get(cutout_url, {'Accept': 'application/blosc'}, stream=True)
                 resp.raise_for_status()
-            except Exception:
+                compressed = read_response(resp)
+            except Exception as e:
+                error = e
                 if attempt != attempts - 1:
                     time.sleep(2**(attempt + 1))
             else:
                 break
+            finally:
+                # streamed responses hold their pooled connection until they're closed
+                if resp is not None:
+                    resp.close()
         else:
             # we failed all the attempts - deal with the consequences.
             raise ConnectionError(
                 'Data from URL {} not fetched.  Status code {}, error {}'.format(
-                    cutout_url, resp.status_code, resp.reason))
+                    cutout_url, getattr(resp, 'status_code', None),
+                    getattr(resp, 'reason', None) or error))
+
+        if out is None:
+            out = np.empty(get_zyx_shape(x_rng, y_rng, z_rng), dtype=datatype)
+        decompress_into(compressed, out)
+        return out
+
+
+def read_response(resp):
+    # reads a (streamed) response body into a single buffer without joining chunks
+    length = resp.headers.get('Content-Length')
+    if length is None or resp.headers.get('Content-Encoding') not in (None, 'identity'):
+        return resp.content
+
+    buffer = bytearray(int(length))
+    view = memoryview(buffer)
+    num_read = 0
+    while num_read < len(buffer):
+        num = resp.raw.readinto(view[num_read:])
+        if not num:
+            break
+        num_read += num
+    if num_read != len(buffer):
+        raise ConnectionError('Response ended after {} of {} bytes'.format(
+            num_read, len(buffer)))
+    return view
+
+
+def decompress_into(compressed, out):
+    # decompresses blosc data straight into the memory of the numpy array out
+    nbytes = blosc.get_cbuffer_sizes(bytes(compressed[:16]))[0]
+    if nbytes != out.nbytes:
+        raise ValueError('Decompressed size {} does not match the cutout size {}'.format(
+            nbytes, out.nbytes))
+
+    if out.flags['C_CONTIGUOUS'] and out.flags['WRITEABLE']:
+        blosc.decompress_ptr(compressed, out.__array_interface__['data'][0])
+    else:
+        data = np.empty(out.shape, dtype=out.dtype)
+        blosc.decompress_ptr(compressed, data.__array_interface__['data'][0])
+        out[...] = data
+    return out
+
+
+def get_res_extents(extents, res, iso=False):
+    # extents (xyz) at res of the res 0 extents
+    x_rng, y_rng, z_rng = extents
+
+    # extents are different in x/y for downsampled data
+    x_rng, y_rng = [[round(bnd / 2**res) for bnd in rng]
+                    for rng in [x_rng, y_rng]]
+
+    if iso:
+        # need to convert to list to set new z_rng
+        z_rng = [int(z / 2**res) for z in z_rng]
+
+    return x_rng, y_rng, z_rng
+
+
+def merge_blocks(blocks):
+    # merges blocks (xyz ranges) into boxes of adjacent blocks: runs in x, then equal runs in y and z
+    boxes = [[list(rng) for rng in block] for block in blocks]
+    for dim in range(3):
+        others = [d for d in range(3) if d != dim]
+        boxes.sort(key=lambda box: ([box[d] for d in others], box[dim]))
+        merged = []
+        for box in boxes:
+            prev = merged[-1] if merged else None
+            if prev is not None and all(prev[d] == box[d] for d in others) and \
+                    prev[dim][1] == box[dim][0]:
+                prev[dim][1] = box[dim][1]
+            else:
+                merged.append(box)
+        boxes = merged
+    return boxes
 
-        raw_data = blosc.decompress(resp.content)
-        data = np.fromstring(raw_data, dtype=datatype)
 
-        return np.reshape(data,
-                          (z_rng[1] - z_rng[0],
-                           y_rng[1] - y_rng[0],
-                           x_rng[1] - x_rng[0]),
-                          order='C')
+def get_aligned_block(rngs, extents):
+    # the cuboid (xyz ranges) containing the start of rngs, clipped to the extents
+    return [[max(rng[0] // stride * stride, ext[0]),
+             min((rng[0] // stride + 1) * stride, ext[1])]
+            for rng, stride, ext in zip(rngs, CUBOID_SIZE, extents)]
@@ -0,0 +1,98 @@
+'''
+Client side downsampling, for pulling a resolution of a channel the Boss hasn't downsampled (yet)
+Res 0 is downloaded in cuboid aligned blocks which are reduced as they arrive (mean for images,
+mode for annotations), so only a block per download thread is held at full resolution
+'''
+
+import numpy as np
+
+from ndex.ndpull.boss_resources import (get_aligned_ranges, get_res_extents, get_zyx_shape,
+                                        insert_block)
+from ndex.request_planner import DEFAULT_REQUEST_MB, get_request_shape
+
+
+def get_downsample_factors(res, iso=False):
+    # voxels (xyz) of res 0 in a voxel of res, z is only downsampled for iso
+    factor = 2**res
+    return factor, factor, factor if iso else 1
+
+
+def get_method(channel_metadata):
+    # annotation ids can't be averaged
+    return 'mode' if channel_metadata.get('type') == 'annotation' else 'mean'
+
+
+def block_mode(blocks):
+    # most frequent value along the last axis, ties go to the smallest value
+    blocks = np.sort(blocks, axis=-1)
+    index = np.arange(blocks.shape[-1])
+    run_starts = np.ones(blocks.shape, dtype=bool)
+    run_starts[..., 1:] = blocks[..., 1:] != blocks[..., :-1]
+    # length of the run of equal values up to each position, the longest run ends at its max
+    run_lengths = index - np.maximum.accumulate(np.where(run_starts, index, 0), axis=-1)
+    longest = run_lengths.argmax(axis=-1)
+    return np.take_along_axis(blocks, longest[..., np.newaxis], axis=-1)[..., 0]
+
+
+def downsample(data, factors, method='mean'):
+    # reduces each factors (xyz) block of data (zyx, a multiple of factors) to a voxel
+    fx, fy, fz = factors
+    nz, ny, nx = data.shape[0] // fz, data.shape[1] // fy, data.shape[2] // fx
+    blocks = data.reshape(nz, fz, ny, fy, nx, fx)
+    if method == 'mode':
+        blocks = blocks.transpose(0, 2, 4, 1, 3, 5).reshape(nz, ny, nx, -1)
+        return block_mode(blocks)
+    if method != 'mean':
+        raise ValueError('Unknown downsample method {}'.format(method))
+    mean = blocks.mean(axis=(1, 3, 5), dtype=np.float64)
+    if np.issubdtype(data.dtype, np.integer):
+        mean = np.rint(mean)
+    return mean.astype(data.dtype)
+
+
+class DownsampledRemote:
+    # a BossRemote (at res 0) whose cutouts are downsampled to res on the client
+    # meta is the BossMeta at res, other attributes (metadata, boss_url) are those of the remote
+    def __init__(self, rmt, meta, request_size_mb=DEFAULT_REQUEST_MB, method=None):
+        self.rmt = rmt
+        self.meta = meta
+        self.factors = get_downsample_factors(meta.res(), meta.iso())
+        self.method = method or get_method(rmt.boss_ch_metadata)
+
+        # res 0 blocks are requests (or a voxel of res, if that's bigger), tiles are those blocks at res
+        request_shape = get_request_shape(rmt.boss_ch_metadata['datatype'], request_size_mb)
+        self.tile_shape = [max(1, stride // factor)
+                           for stride, factor in zip(request_shape, self.factors)]
+
+    def __getattr__(self, name):
+        return getattr(self.rmt, name)
+
+    def __str__(self):
+        return str(self.rmt)
+
+    def get_xyz_extents(self):
+        return get_res_extents(self.rmt.get_xyz_extents(), self.meta.res(), self.meta.iso())
+
+    def get_tiles(self, x_rng, y_rng, z_rng):
+        return [[tx, ty, tz]
+                for tz in get_aligned_ranges(z_rng, self.tile_shape[2])
+                for ty in get_aligned_ranges(y_rng, self.tile_shape[1])
+                for tx in get_aligned_ranges(x_rng, self.tile_shape[0])]
+
+    def cutout(self, x_rng, y_rng, z_rng, datatype, attempts=5, out=None):
+        # tiles are downloaded and reduced one at a time
+        if out is None:
+            out = np.zeros(get_zyx_shape(x_rng, y_rng, z_rng), dtype=datatype)
+        extents = self.rmt.get_xyz_extents()
+        for tile in self.get_tiles(x_rng, y_rng, z_rng):
+            # res 0 region under the tile, the part outside of the data is 0
+            rngs = [[rng[0] * factor, rng[1] * factor] for rng, factor in zip(tile, self.factors)]
+            clipped = [[max(rng[0], ext[0]), min(rng[1], ext[1])]
+                       for rng, ext in zip(rngs, extents)]
+            data = np.zeros(get_zyx_shape(*rngs), dtype=datatype)
+            if all(rng[0] < rng[1] for rng in clipped):
+                insert_block(data, rngs, self.rmt.cutout(*clipped, datatype, attempts=attempts),
+                             clipped)
+            insert_block(out, (x_rng, y_rng, z_rng),
+                         downsample(data, self.factors, self.method), tile)
+        return out
@@ -3,27 +3,26 @@ Command line program to download a region of data from the BOSS as individual TI
 '''
 
 import argparse
-import configparser
-import json
 import math
 import os
 import sys
-import time
 from collections import defaultdict
 from functools import partial
 from multiprocessing.dummy import Pool as ThreadPool
 from pathlib import Path
 
-import blosc
 import numpy as np
-import requests
 import tifffile as tiff
 from tqdm import tqdm
 
+from ndex.ndpull import boss_resources, downsample
+from ndex.ndpull.block_cache import DEFAULT_BLOCK_CACHE_GB, BlockCache
 from ndex.ndpull.boss_resources import *
-
-# download blocks of size 2k by 2k by 16 (xyz), should be multiples of 512 x 512 x 16
-CHUNK_SIZE = (2048, 2048, 16)
+from ndex.ndpull.downsample import DownsampledRemote
+from ndex.request_planner import (DEFAULT_REQUEST_MB, get_request_shape, plan_cutouts,
+                                  plan_strips)
+from ndex.ndpull.zarr_writer import ZarrWriter, create_group
+from ndex.profiler import Profiler
 
 
 def get_cube_lims(rng, stride=16):
@@ -39,7 +38,7 @@ def get_cube_lims(rng, stride=16):
     return buckets
 
 
-def collect_input_args(collection, experiment, channel, config_file=None, token=None, url='https://api.boss.neurodata.io', x=None, y=None, z=None, res=0, outdir='./', full_extent=False, print_metadata=False, iso=False, force_datatype=False):
+def collect_input_args(collection, experiment, channel, config_file=None, token=None, url='https://api.boss.neurodata.io', x=None, y=None, z=None, res=0, outdir='./', full_extent=False, print_metadata=False, iso=False, force_datatype=False, cache_dir=None, metadata_ttl=DEFAULT_METADATA_TTL, block_cache=False, block_cache_size=DEFAULT_BLOCK_CACHE_GB, request_size_mb=DEFAULT_REQUEST_MB, client_downsample=False):
     result = argparse.Namespace(
         collection=collection,
         experiment=experiment,
@@ -52,6 +51,12 @@ def collect_input_args(collection, experiment, channel, config_file=None, token=
         print_metadata=print_metadata,
         iso=iso,
         force_datatype=force_datatype,
+        cache_dir=cache_dir,
+        metadata_ttl=metadata_ttl,
+        block_cache=block_cache,
+        block_cache_size=block_cache_size,
+        request_size_mb=request_size_mb,
+        client_downsample=client_downsample,
     )
     return result
 
@@ -89,6 +94,11 @@ def collect_args():
                         help='Number of threads for downloading data.')
     parser.add_argument('--iso', action='store_true',
                         help='Returns iso data (for downsampling in z)')
+    parser.add_argument('--client_downsample', action='store_true',
+                        help='Download res 0 and downsample it to --res here (mean for images, mode for annotations), for channels the Boss has not downsampled')
+
+    parser.add_argument('--format', type=str, default='tiff', choices=['tiff', 'zarr'],
+                        help='tiff: a file per slice, zarr: a Zarr array (chunks of Boss cuboids) at OUTDIR/<coll>_<exp>_<ch>.zarr/<res>, resumed if it exists')
 
     parser.add_argument('--stack_filename', type=str,
                         help='If specified, tiffs are merged into a single tif stack file, at the outdir specified')
@@ -96,24 +106,22 @@ def collect_args():
     parser.add_argument('--force_datatype', type=str,
                         help='downloaded data will be cast into this datatype (uint8/uint16/uint32)')
 
-    return parser.parse_args()
+    parser.add_argument('--request_size_mb', type=float, default=DEFAULT_REQUEST_MB,
+                        help='Target size (uncompressed MB) of each cutout request, rounded to whole 512x512x16 cuboids')
 
+    parser.add_argument('--profile', type=str, nargs='?', const='ndpull_profile',
+                        help='Profile the download: writes PROFILE.txt (wall/CPU time of each stage) and PROFILE.prof (cProfile stats), default prefix ndpull_profile')
 
-def get_boss_config(boss_config_file=None):
-    config = configparser.ConfigParser()
-
-    if boss_config_file:
-        config.read(boss_config_file)
-        token = config['Default']['token']
-        protocol = config['Default']['protocol']
-        host = config['Default']['host']
-    else:
-        token = os.environ['BOSS_TOKEN']
-        protocol = 'https'
-        host = 'api.boss.neurodata.io'
+    parser.add_argument('--cache_dir', type=str,
+                        help='Directory for cached Boss responses (default: $NDEX_CACHE_DIR or ~/.cache/ndex)')
+    parser.add_argument('--metadata_ttl', type=int, default=DEFAULT_METADATA_TTL,
+                        help='Seconds to reuse cached collection/experiment/channel metadata (0 disables)')
+    parser.add_argument('--block_cache', action='store_true',
+                        help='Keep downloaded cuboids in a local cache so repeated/overlapping pulls are not downloaded again')
+    parser.add_argument('--block_cache_size', type=float, default=DEFAULT_BLOCK_CACHE_GB,
+                        help='Maximum size of the block cache in GB, least recently used blocks are removed first')
 
-    boss_url = ''.join((protocol, '://', host))
-    return token, boss_url
+    return parser.parse_args()
 
 
 def download_slices(result, rmt, threads=4):
@@ -121,40 +129,95 @@ def download_slices(result, rmt, threads=4):
     # get the datatype
     ch_meta = rmt.boss_ch_metadata
     datatype = ch_meta['datatype']
-
-    z_buckets = get_cube_lims(result.z, stride=CHUNK_SIZE[2])
-    for _, z_slices in tqdm(z_buckets.items()):
-        z_rng = [z_slices[0], z_slices[-1] + 1]
-
-        # re-initialize on every slice of z
-        # zyx ordered
-        data_slices = np.zeros((z_rng[1] - z_rng[0],
-                                result.y[1] - result.y[0],
-                                result.x[1] - result.x[0]),
-                               dtype=datatype)
-
-        for y in range(result.y[0], result.y[1], CHUNK_SIZE[1]):
-            y_rng = [y, result.y[1] if (
-                y + CHUNK_SIZE[1]) > result.y[1] else (y + CHUNK_SIZE[1])]
-
-            x_rngs = []
-            for x in range(result.x[0], result.x[1], CHUNK_SIZE[0]):
-                x_rngs.append([x, result.x[1] if (
-                    x + CHUNK_SIZE[0]) > result.x[1] else (x + CHUNK_SIZE[0])])
-
-            cutout_partial = partial(
-                rmt.cutout, y_rng=y_rng, z_rng=z_rng, datatype=datatype)
-            with ThreadPool(threads) as pool:
-                data_list = pool.map(cutout_partial, x_rngs)
-
-            for data, x_rng in zip(data_list, x_rngs):
-                # insert into numpy array
-                data_slices[:,
-                            y_rng[0] - result.y[0]:y_rng[1] - result.y[0],
-                            x_rng[0] - result.x[0]:x_rng[1] - result.x[0]] = data
-
-        save_to_tiffs(data_slices, rmt.meta, result,
-                      z_rng, result.force_datatype)
+    request_mb = getattr(result, 'request_size_mb', DEFAULT_REQUEST_MB)
+    extents = rmt.get_xyz_extents()
+
+    z_buckets = get_cube_lims(result.z, stride=CUBOID_SIZE[2])
+    with ThreadPool(threads) as pool:
+        for _, z_slices in tqdm(z_buckets.items()):
+            z_rng = [z_slices[0], z_slices[-1] + 1]
+
+            # requests are full width strips of the cuboid aligned region, each decoded straight
+            # into its own buffer (zyx), so cutouts aren't decoded and then copied into place
+            strips = plan_strips(result.x, result.y, z_rng, datatype, request_mb, extents)
+            buffers = [np.empty(get_zyx_shape(*strip), dtype=datatype) for strip in strips]
+            pool.starmap(partial(download_cutout, rmt=rmt, datatype=datatype),
+                         zip(strips, buffers))
+
+            save_to_tiffs(get_strip_slices(buffers, strips, result.x, result.y, z_rng),
+                          rmt.meta, result, z_rng, result.force_datatype)
+
+
+def download_cutout(cutout_rngs, out, rmt, datatype):
+    x_rng, y_rng, z_rng = cutout_rngs
+    rmt.cutout(x_rng, y_rng, z_rng, datatype, out=out)
+
+
+def get_strip_slices(buffers, strips, x_rng, y_rng, z_rng):
+    # z slices (yx) of the region from the strips (in y order) that cover it
+    # a slice is only copied (joined) when it spans more than one strip
+    for z in range(*z_rng):
+        parts = []
+        for buffer, (strip_x, strip_y, strip_z) in zip(buffers, strips):
+            y_first, y_last = max(y_rng[0], strip_y[0]), min(y_rng[1], strip_y[1])
+            if y_first < y_last:
+                parts.append(buffer[z - strip_z[0], y_first - strip_y[0]:y_last - strip_y[0],
+                                    x_rng[0] - strip_x[0]:x_rng[1] - strip_x[0]])
+        yield parts[0] if len(parts) == 1 else np.concatenate(parts)
+
+
+def get_zarr_path(meta, outdir):
+    # a group per channel, with an array per resolution
+    group_path = os.path.join(outdir, '{}_{}_{}.zarr'.format(
+        meta.collection(), meta.experiment(), meta.channel()))
+    array_name = '{}{}'.format(meta.res(), '_iso' if meta.iso() else '')
+    return group_path, os.path.join(group_path, array_name)
+
+
+def get_zarr_attrs(rmt):
+    # Boss resource and voxel size (xyz, at the resolution) of the array
+    coord_frame = rmt.boss_coord_frame_metadata
+    res, iso = rmt.meta.res(), rmt.meta.iso()
+    return {'boss': {
+        'url': rmt.boss_url, 'collection': rmt.meta.collection(),
+        'experiment': rmt.meta.experiment(), 'channel': rmt.meta.channel(),
+        'res': res, 'iso': iso, 'extents': [list(rng) for rng in rmt.get_xyz_extents()],
+        'voxel_size': [coord_frame['x_voxel_size'] * 2**res, coord_frame['y_voxel_size'] * 2**res,
+                       coord_frame['z_voxel_size'] * (2**res if iso else 1)],
+        'voxel_unit': coord_frame['voxel_unit'], 'axes': 'zyx'}}
+
+
+def download_zarr(result, rmt, threads=4):
+    # cutouts are written as chunks (Boss cuboids) of a Zarr array by the download threads
+    # the region is expanded to whole cuboids, and cutouts whose chunks exist are skipped (resume)
+    datatype = rmt.boss_ch_metadata['datatype']
+    out_datatype = result.force_datatype or datatype
+    request_shape = get_request_shape(
+        datatype, getattr(result, 'request_size_mb', DEFAULT_REQUEST_MB))
+    extents = rmt.get_xyz_extents()
+
+    group_path, array_path = get_zarr_path(rmt.meta, result.outdir)
+    create_group(group_path)
+    writer = ZarrWriter(array_path, [rng[1] for rng in reversed(extents)], out_datatype,
+                        data_start=[rng[0] for rng in reversed(extents)],
+                        attrs=get_zarr_attrs(rmt)).create()
+
+    cutouts = plan_cutouts(result.x, result.y, result.z, request_shape, extents)
+    missing = [cutout_rngs for cutout_rngs in cutouts if not writer.has_chunks(*cutout_rngs)]
+    if len(missing) < len(cutouts):
+        print('{} of {} cutouts already in {}'.format(
+            len(cutouts) - len(missing), len(cutouts), array_path))
+
+    def write_cutout(cutout_rngs):
+        data = rmt.cutout(*cutout_rngs, datatype)
+        if result.force_datatype:
+            data = data.astype(result.force_datatype)
+        writer.write_region(data, *cutout_rngs)
+
+    with ThreadPool(threads) as pool:
+        for _ in tqdm(pool.imap_unordered(write_cutout, missing), total=len(missing)):
+            pass
+    return array_path
 
 
 def gen_tif_fname(meta, result, zslice, digits):
@@ -174,11 +237,10 @@ def save_to_tiffs(data_slices, meta, result, z_rng, force_datatype=None):
 
     digits = int(math.log10(result.z[1])) + 1
 
-    for zslice in range(z_rng[0], z_rng[1]):
+    # data_slices: the yx slices of z_rng (a zyx array, or any iterable of them)
+    for zslice, data in zip(range(z_rng[0], z_rng[1]), data_slices):
         fname = gen_tif_fname(meta, result, zslice, digits)
 
-        data = data_slices[zslice - z_rng[0], :, :]
-
         if force_datatype:
             data = data.astype(force_datatype)
 
@@ -220,13 +282,29 @@ def validate_args(result):
 
     meta = BossMeta(result.collection, result.experiment,
                     result.channel, result.res, result.iso)
-    rmt = BossRemote(result.url, result.token, meta)
+    # client side downsampling reads res 0
+    client_downsample = getattr(result, 'client_downsample', False) and meta.res() > 0
+    if client_downsample:
+        meta = BossMeta(result.collection, result.experiment, result.channel)
+    metadata_cache = MetadataCache(getattr(result, 'cache_dir', None),
+                                   getattr(result, 'metadata_ttl', DEFAULT_METADATA_TTL))
+    block_cache = None
+    if getattr(result, 'block_cache', False):
+        cache_size = getattr(result, 'block_cache_size', DEFAULT_BLOCK_CACHE_GB)
+        block_cache = BlockCache(getattr(result, 'cache_dir', None),
+                                 int(cache_size * 1024**3))
+    rmt = BossRemote(result.url, result.token, meta,
+                     metadata_cache=metadata_cache, block_cache=block_cache)
 
     if result.print_metadata:
         print(rmt)
         sys.exit()
 
-    if meta.res() > 0:
+    if client_downsample:
+        rmt = DownsampledRemote(rmt, BossMeta(result.collection, result.experiment, result.channel,
+                                              result.res, result.iso),
+                                getattr(result, 'request_size_mb', DEFAULT_REQUEST_MB))
+    elif meta.res() > 0:
         if meta.res() >= rmt.boss_exp_metadata['num_hierarchy_levels']:
             raise ValueError('Res argument too high for experiment')
 
@@ -257,15 +335,35 @@ def validate_args(result):
     return result, rmt
 
 
+def get_profile_targets():
+    # stages of a pull: requests (network), decompression, cutouts and writing the slices
+    module = sys.modules[__name__]
+    return [(BossRemote, 'cutout'), (boss_resources, 'read_response'),
+            (boss_resources, 'decompress_into'), (module, 'download_cutout'),
+            (module, 'save_to_tiffs'), (ZarrWriter, 'write_region'),
+            (DownsampledRemote, 'cutout'), (downsample, 'downsample')]
+
+
 def main():
     args = collect_args()
     result, rmt = validate_args(args)
 
+    profiler = None
+    if args.profile is not None:
+        profiler = Profiler(get_profile_targets(), args.profile).start()
+
     print('Starting download')
-    download_slices(result, rmt, threads=args.threads)
+    try:
+        if args.format == 'zarr':
+            download_zarr(result, rmt, threads=args.threads)
+        else:
+            download_slices(result, rmt, threads=args.threads)
+    finally:
+        if profiler is not None:
+            print(profiler.stop())
     print('Download complete')
 
-    if result.stack_filename:
+    if result.stack_filename and args.format == 'tiff':
         save_to_stack(rmt.meta, result)
 
 
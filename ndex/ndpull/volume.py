@@ -0,0 +1,202 @@
+'''
+NumPy style access to a Boss channel from Python
+vol[z0:z1, y0:y1, x0:x1] downloads the cuboids under the slice concurrently and returns an ndarray
+Cuboids are kept in memory (least recently used are dropped) so nearby slices don't download them again
+'''
+
+import threading
+from collections import OrderedDict
+from multiprocessing.dummy import Pool as ThreadPool
+
+import numpy as np
+
+from ndex.ndpull import ndpull
+from ndex.ndpull.block_cache import DEFAULT_BLOCK_CACHE_GB
+from ndex.ndpull.boss_resources import (CUBOID_SIZE, DEFAULT_METADATA_TTL, get_aligned_ranges,
+                                        get_zyx_shape, insert_block)
+from ndex.request_planner import DEFAULT_REQUEST_MB, get_request_shape, plan_cutouts
+
+# default size of the in memory cuboid cache (MB)
+DEFAULT_CACHE_MB = 1024
+
+
+class CuboidCache:
+    # cuboids (zyx arrays) by their xyz ranges, least recently used are dropped past max_bytes
+    def __init__(self, max_bytes=DEFAULT_CACHE_MB * 1024**2):
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.blocks = OrderedDict()
+        self.nbytes = 0
+
+    def get(self, key):
+        with self.lock:
+            data = self.blocks.get(key)
+            if data is not None:
+                self.blocks.move_to_end(key)
+            return data
+
+    def put(self, key, data):
+        if data.nbytes > self.max_bytes:
+            return
+        with self.lock:
+            old = self.blocks.pop(key, None)
+            if old is not None:
+                self.nbytes -= old.nbytes
+            self.blocks[key] = data
+            self.nbytes += data.nbytes
+            while self.nbytes > self.max_bytes:
+                self.nbytes -= self.blocks.popitem(last=False)[1].nbytes
+
+    def clear(self):
+        with self.lock:
+            self.blocks.clear()
+            self.nbytes = 0
+
+
+def get_cuboid_keys(x_rng, y_rng, z_rng, extents):
+    # xyz ranges (as tuples) of the cuboids overlapping a region, clipped to the extents
+    return [(tuple(bx), tuple(by), tuple(bz))
+            for bz in get_aligned_ranges(z_rng, CUBOID_SIZE[2], extents[2])
+            for by in get_aligned_ranges(y_rng, CUBOID_SIZE[1], extents[1])
+            for bx in get_aligned_ranges(x_rng, CUBOID_SIZE[0], extents[0])]
+
+
+def get_block_rngs(data, data_rngs, block_rngs):
+    # copy of the part of data (with xyz ranges data_rngs) inside of block_rngs
+    return data[tuple(slice(b[0] - d[0], b[1] - d[0])
+                      for b, d in zip(reversed(block_rngs), reversed(data_rngs)))].copy()
+
+
+class BossVolume:
+    # a channel of the Boss (at a resolution) that can be sliced like a zyx ndarray
+    # indices start at the start of the coordinate frame (offset, xyz) and negative indices and steps work
+    # client_downsample: res is downsampled from res 0 here (for channels the Boss hasn't downsampled)
+    # rmt (optional) is a BossRemote to use instead of connecting with the config file
+    def __init__(self, collection, experiment, channel, res=0, config_file=None, iso=False,
+                 threads=8, cache_mb=DEFAULT_CACHE_MB, request_size_mb=DEFAULT_REQUEST_MB,
+                 cache_dir=None, metadata_ttl=DEFAULT_METADATA_TTL, block_cache=False,
+                 block_cache_size=DEFAULT_BLOCK_CACHE_GB, client_downsample=False, rmt=None):
+        if rmt is None:
+            args = ndpull.collect_input_args(
+                collection, experiment, channel, config_file=config_file, res=res, iso=iso,
+                full_extent=True, cache_dir=cache_dir, metadata_ttl=metadata_ttl,
+                block_cache=block_cache, block_cache_size=block_cache_size,
+                request_size_mb=request_size_mb, client_downsample=client_downsample)
+            _, rmt = ndpull.validate_args(args)
+        self.rmt = rmt
+        self.threads = threads
+
+        self.dtype = np.dtype(rmt.boss_ch_metadata['datatype'])
+        self.extents = [list(rng) for rng in rmt.get_xyz_extents()]
+        self.request_shape = get_request_shape(self.dtype, request_size_mb)
+        self.cache = CuboidCache(int(cache_mb * 1024**2))
+
+    @property
+    def offset(self):
+        # Boss coordinates (xyz) of index 0
+        return [rng[0] for rng in self.extents]
+
+    @property
+    def shape(self):
+        return get_zyx_shape(*self.extents)
+
+    @property
+    def ndim(self):
+        return 3
+
+    @property
+    def size(self):
+        return int(np.prod(self.shape))
+
+    @property
+    def nbytes(self):
+        return self.size * self.dtype.itemsize
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __repr__(self):
+        return 'BossVolume({}/{}/{}, res={}, shape={}, dtype={})'.format(
+            self.rmt.meta.collection(), self.rmt.meta.experiment(), self.rmt.meta.channel(),
+            self.rmt.meta.res(), self.shape, self.dtype)
+
+    def __getitem__(self, key):
+        if not isinstance(key, tuple):
+            key = (key,)
+        if sum(k is Ellipsis for k in key) > 1:
+            raise IndexError('an index can only have a single ellipsis (\'...\')')
+        if Ellipsis in key:
+            i = key.index(Ellipsis)
+            key = key[:i] + (slice(None),) * (3 - len(key) + 1) + key[i + 1:]
+        if len(key) > 3:
+            raise IndexError('too many indices for volume: volume is 3-dimensional, but {} were indexed'.format(
+                len(key)))
+        key = key + (slice(None),) * (3 - len(key))
+
+        # index ranges (zyx) and the dimensions dropped by integer indices
+        ranges = []
+        squeeze = []
+        for dim, (k, size) in enumerate(zip(key, self.shape)):
+            if isinstance(k, slice):
+                ranges.append(range(*k.indices(size)))
+            elif isinstance(k, (int, np.integer)):
+                index = int(k) + size if k < 0 else int(k)
+                if not 0 <= index < size:
+                    raise IndexError('index {} is out of bounds for axis {} with size {}'.format(
+                        k, dim, size))
+                ranges.append(range(index, index + 1))
+                squeeze.append(dim)
+            else:
+                raise TypeError('only integers, slices and ellipsis are valid indices, not {}'.format(
+                    type(k).__name__))
+
+        if any(len(rng) == 0 for rng in ranges):
+            data = np.zeros([len(rng) for rng in ranges], dtype=self.dtype)
+        else:
+            # the bounding box of the indices is read, then stepped through
+            bounds = [[min(rng[0], rng[-1]), max(rng[0], rng[-1]) + 1] for rng in ranges]
+            z_rng, y_rng, x_rng = [[b[0] + off, b[1] + off]
+                                   for b, off in zip(bounds, reversed(self.offset))]
+            data = self.read(x_rng, y_rng, z_rng)
+            data = data[tuple(slice(rng.start - b[0],
+                                    rng.stop - b[0] if rng.stop - b[0] >= 0 else None, rng.step)
+                              for rng, b in zip(ranges, bounds))]
+        if squeeze:
+            data = data.squeeze(axis=tuple(squeeze))
+        return data
+
+    def read(self, x_rng, y_rng, z_rng):
+        # zyx data of a region in Boss coordinates (within the extents)
+        if not all(rng[0] >= ext[0] and rng[1] <= ext[1] and rng[0] < rng[1]
+                   for rng, ext in zip((x_rng, y_rng, z_rng), self.extents)):
+            raise ValueError('Region {} is outside of the extents {} (xyz)'.format(
+                [x_rng, y_rng, z_rng], self.extents))
+        data_rngs = (x_rng, y_rng, z_rng)
+        data = np.zeros(get_zyx_shape(*data_rngs), dtype=self.dtype)
+
+        # cuboid aligned requests, those with every cuboid in the cache aren't downloaded
+        requests = []
+        for request in plan_cutouts(x_rng, y_rng, z_rng, self.request_shape, self.extents):
+            keys = get_cuboid_keys(*request, self.extents)
+            blocks = [self.cache.get(key) for key in keys]
+            if any(block is None for block in blocks):
+                requests.append((request, keys))
+                continue
+            for key, block in zip(keys, blocks):
+                insert_block(data, data_rngs, block, key)
+
+        def fetch(request_keys):
+            request, keys = request_keys
+            request_data = self.rmt.cutout(*request, self.dtype.name)
+            for key in keys:
+                block = get_block_rngs(request_data, request, key)
+                self.cache.put(key, block)
+                insert_block(data, data_rngs, block, key)
+
+        if len(requests) == 1 or self.threads <= 1:
+            for request_keys in requests:
+                fetch(request_keys)
+        elif requests:
+            with ThreadPool(min(self.threads, len(requests))) as pool:
+                pool.map(fetch, requests)
+        return data
@@ -0,0 +1,142 @@
+'''
+Writes Boss cutouts to a Zarr (v2) array with chunks of Boss cuboids (zyx: 16, 512, 512)
+Array indices are Boss coordinates, so pulls of different regions fill in the same array
+Chunks are blosc compressed and written atomically, so an interrupted pull can be resumed
+'''
+
+import json
+import os
+import tempfile
+
+import blosc
+import numpy as np
+
+from ndex.common import CUBOID_SIZE
+
+ZARR_FORMAT = 2
+
+# blosc settings of the chunks (numcodecs Blosc: shuffle 1 is byte shuffle)
+BLOSC_CNAME = 'lz4'
+BLOSC_CLEVEL = 5
+
+
+def get_compressor_config():
+    return {'id': 'blosc', 'cname': BLOSC_CNAME, 'clevel': BLOSC_CLEVEL,
+            'shuffle': blosc.SHUFFLE, 'blocksize': 0}
+
+
+def write_json(fname, data):
+    # written to a temporary file first so readers never see part of it
+    fd, tmp_fname = tempfile.mkstemp(dir=os.path.dirname(fname), suffix='.tmp')
+    with os.fdopen(fd, 'w') as f:
+        json.dump(data, f, indent=4, sort_keys=True)
+    os.replace(tmp_fname, fname)
+
+
+def create_group(path):
+    # a Zarr group (a directory the arrays go in)
+    os.makedirs(path, exist_ok=True)
+    if not os.path.exists(os.path.join(path, '.zgroup')):
+        write_json(os.path.join(path, '.zgroup'), {'zarr_format': ZARR_FORMAT})
+    return path
+
+
+class ZarrWriter:
+    # path: directory of the array
+    # shape, chunks and data_start (start of the data, lower indices are always 0) are zyx
+    # attrs go to .zattrs
+    def __init__(self, path, shape, dtype, chunks=CUBOID_SIZE[::-1], data_start=(0, 0, 0),
+                 attrs=None):
+        self.path = path
+        self.shape = [int(s) for s in shape]
+        self.dtype = np.dtype(dtype)
+        self.chunks = [int(c) for c in chunks]
+        self.data_start = [int(s) for s in data_start]
+        self.attrs = attrs
+
+    def get_metadata(self):
+        return {'zarr_format': ZARR_FORMAT, 'shape': self.shape, 'chunks': self.chunks,
+                'dtype': self.dtype.str, 'compressor': get_compressor_config(),
+                'fill_value': 0, 'order': 'C', 'filters': None}
+
+    def create(self):
+        # creates the array, or checks an existing one (of an earlier or interrupted pull) matches
+        os.makedirs(self.path, exist_ok=True)
+        metadata = self.get_metadata()
+        zarray_fname = os.path.join(self.path, '.zarray')
+        if os.path.exists(zarray_fname):
+            with open(zarray_fname) as f:
+                existing = json.load(f)
+            for key in ('shape', 'chunks', 'dtype'):
+                if existing.get(key) != metadata[key]:
+                    raise ValueError('Existing Zarr array {} has {} {}, expected {}'.format(
+                        self.path, key, existing.get(key), metadata[key]))
+        else:
+            write_json(zarray_fname, metadata)
+        if self.attrs is not None:
+            write_json(os.path.join(self.path, '.zattrs'), self.attrs)
+        return self
+
+    def get_chunk_fname(self, chunk_index):
+        return os.path.join(self.path, '.'.join(str(i) for i in chunk_index))
+
+    def get_chunk_indices(self, x_rng, y_rng, z_rng):
+        # zyx indices of the chunks overlapping a region (xyz ranges)
+        rngs = (z_rng, y_rng, x_rng)
+        ranges = [range(rng[0] // chunk, -(-rng[1] // chunk))
+                  for rng, chunk in zip(rngs, self.chunks)]
+        return [(z, y, x) for z in ranges[0] for y in ranges[1] for x in ranges[2]]
+
+    def has_chunks(self, x_rng, y_rng, z_rng):
+        return all(os.path.exists(self.get_chunk_fname(index))
+                   for index in self.get_chunk_indices(x_rng, y_rng, z_rng))
+
+    def write_chunk(self, chunk_index, chunk):
+        chunk = np.ascontiguousarray(chunk, dtype=self.dtype)
+        compressed = blosc.compress_ptr(chunk.__array_interface__['data'][0], chunk.size,
+                                        typesize=self.dtype.itemsize, clevel=BLOSC_CLEVEL,
+                                        shuffle=blosc.SHUFFLE, cname=BLOSC_CNAME)
+
+        fname = self.get_chunk_fname(chunk_index)
+        fd, tmp_fname = tempfile.mkstemp(dir=self.path, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(compressed)
+            os.replace(tmp_fname, fname)
+        except OSError:
+            try:
+                os.remove(tmp_fname)
+            except OSError:
+                pass
+            raise
+
+    def write_region(self, data, x_rng, y_rng, z_rng):
+        # writes the chunks overlapping a region (zyx data), which has to cover their part of the data
+        # so every chunk is complete (the part outside of the data is 0)
+        region = (z_rng, y_rng, x_rng)
+        for index in self.get_chunk_indices(x_rng, y_rng, z_rng):
+            chunk_starts = [i * chunk for i, chunk in zip(index, self.chunks)]
+            starts = [max(start, data_start)
+                      for start, data_start in zip(chunk_starts, self.data_start)]
+            stops = [min(start + chunk, size)
+                     for start, chunk, size in zip(chunk_starts, self.chunks, self.shape)]
+            if not all(rng[0] <= start and stop <= rng[1]
+                       for rng, start, stop in zip(region, starts, stops)):
+                raise ValueError('Region {} does not cover chunk {}'.format(
+                    [x_rng, y_rng, z_rng], index))
+
+            chunk = np.zeros(self.chunks, dtype=self.dtype)
+            chunk[tuple(slice(start - chunk_start, stop - chunk_start)
+                        for start, stop, chunk_start in zip(starts, stops, chunk_starts))] = \
+                data[tuple(slice(start - rng[0], stop - rng[0])
+                           for start, stop, rng in zip(starts, stops, region))]
+            self.write_chunk(index, chunk)
+
+    def read_chunk(self, chunk_index):
+        # the chunk's data (full chunk shape), None if it hasn't been written
+        try:
+            with open(self.get_chunk_fname(chunk_index), 'rb') as f:
+                compressed = f.read()
+        except OSError:
+            return None
+        return np.frombuffer(blosc.decompress(compressed), dtype=self.dtype).reshape(self.chunks)
@@ -0,0 +1,176 @@
+'''
+Chooses the shape of the blocks POSTed to the Boss
+Blocks are whole cuboids in x/y and one cuboid (16 slices) deep, sized from the datatype
+and adjusted from the measured POST throughput (which includes the effect of compression)
+'''
+
+import argparse
+import threading
+import time
+from multiprocessing.dummy import Pool as ThreadPool
+
+import blosc
+import numpy as np
+
+from ndex.common import CUBOID_SIZE
+from ndex.request_planner import get_request_shape
+
+# uncompressed size (MB) of the first blocks POSTed
+DEFAULT_BLOCK_MB = 32
+# largest block POSTed (uncompressed MB), keeps requests well under the Boss limits
+MAX_BLOCK_MB = 256
+# time a single POST should take, longer POSTs are more likely to time out and are costly to retry
+DEFAULT_POST_SECONDS = 4
+
+
+def choose_block_shape(datatype, target_mb=DEFAULT_BLOCK_MB):
+    # (x, y, z) shape of whole cuboids close to target_mb of uncompressed data
+    return get_request_shape(datatype, min(target_mb, MAX_BLOCK_MB))
+
+
+def estimate_compress_ratio(data, datatype, max_bytes=16 * 1024**2):
+    # uncompressed / compressed size of (the start of) a stack, like the blosc payload of a POST
+    sample = np.ascontiguousarray(data.reshape(-1)[:max_bytes // np.dtype(datatype).itemsize],
+                                  dtype=datatype)
+    if sample.size == 0:
+        return 1.0
+    compressed = blosc.compress_ptr(sample.__array_interface__['data'][0], sample.size,
+                                    typesize=sample.dtype.itemsize)
+    return sample.nbytes / len(compressed)
+
+
+class BlockShapeTuner:
+    # picks the block shape for each z stack from the POSTs of the previous stacks
+    def __init__(self, datatype, block_shape=None, start_mb=DEFAULT_BLOCK_MB,
+                 target_seconds=DEFAULT_POST_SECONDS, max_mb=MAX_BLOCK_MB):
+        self.datatype = datatype
+        self.target_seconds = target_seconds
+        self.max_mb = max_mb
+        self.min_mb = np.prod(CUBOID_SIZE) * np.dtype(datatype).itemsize / 1024**2
+
+        # a block shape (x, y) set by the user is never changed
+        self.fixed_shape = None
+        if block_shape is not None:
+            if any(size % cuboid for size, cuboid in zip(block_shape, CUBOID_SIZE)):
+                raise ValueError('Block shape must be a multiple of the Boss cuboid size {}'.format(
+                    CUBOID_SIZE[:2]))
+            self.fixed_shape = (block_shape[0], block_shape[1], CUBOID_SIZE[2])
+
+        self.target_mb = min(max(start_mb, self.min_mb), max_mb)
+        self.compress_ratio = None
+
+        self.lock = threading.Lock()
+        self.nbytes = 0
+        self.seconds = 0
+
+    def set_compress_ratio(self, ratio):
+        # compressible data POSTs faster, start with larger blocks
+        with self.lock:
+            self.compress_ratio = ratio
+            self.target_mb = min(max(self.target_mb * max(ratio, 1), self.min_mb), self.max_mb)
+
+    def record(self, nbytes, seconds):
+        # a successful POST of nbytes (uncompressed) that took seconds
+        with self.lock:
+            self.nbytes += nbytes
+            self.seconds += seconds
+
+    def get_shape(self):
+        if self.fixed_shape is not None:
+            return self.fixed_shape
+
+        with self.lock:
+            if self.seconds > 0:
+                # uncompressed MB/s of one POST, at most doubling or halving the blocks each stack
+                rate = self.nbytes / 1024**2 / self.seconds
+                target_mb = rate * self.target_seconds
+                target_mb = min(max(target_mb, self.target_mb / 2), self.target_mb * 2)
+                self.target_mb = min(max(target_mb, self.min_mb), self.max_mb)
+                self.nbytes = 0
+                self.seconds = 0
+            return choose_block_shape(self.datatype, self.target_mb)
+
+
+def get_block_ranges(extent, stride):
+    # [start, stop] of the blocks covering an extent, on multiples of stride
+    first = extent[0] // stride * stride
+    return [[max(start, extent[0]), min(start + stride, extent[1])]
+            for start in range(first, extent[1], stride)]
+
+
+def benchmark_block_shapes(post, data, shapes, threads=8, repeats=1):
+    # POSTs a zyx stack cut into blocks of each shape with post(x_rng, y_rng, z_rng, block)
+    # returns a list of (shape, MB/s, seconds)
+    z_rng = [0, data.shape[0]]
+    results = []
+    for shape in shapes:
+        blocks = [(x_rng, y_rng) for y_rng in get_block_ranges([0, data.shape[1]], shape[1])
+                  for x_rng in get_block_ranges([0, data.shape[2]], shape[0])]
+
+        def post_block(rngs):
+            x_rng, y_rng = rngs
+            block = np.ascontiguousarray(data[:, y_rng[0]:y_rng[1], x_rng[0]:x_rng[1]])
+            post(x_rng, y_rng, z_rng, block)
+
+        start_time = time.time()
+        with ThreadPool(threads) as pool:
+            for _ in range(repeats):
+                pool.map(post_block, blocks)
+        seconds = time.time() - start_time
+        results.append((tuple(shape), data.nbytes * repeats / 1024**2 / seconds, seconds))
+    return results
+
+
+def print_benchmark(results):
+    print('{:>18} {:>10} {:>10}'.format('block (x, y, z)', 'MB/s', 'seconds'))
+    for shape, mbps, seconds in results:
+        print('{:>18} {:>10.1f} {:>10.2f}'.format(str(shape), mbps, seconds))
+
+
+def main():
+    # sweeps block shapes POSTing synthetic data to an existing channel
+    from ndex.ndpush.boss_resources import BossResParams
+    from ndex.ndpush.ingest_job import IngestJob
+    from ndex.ndpush.ingest_large_vol import post_cutout
+
+    parser = argparse.ArgumentParser(
+        description='Benchmark POST throughput of block shapes (x y) against a Boss channel')
+    parser.add_argument('--collection', type=str, required=True, help='Collection')
+    parser.add_argument('--experiment', type=str, required=True, help='Experiment')
+    parser.add_argument('--channel', type=str, required=True,
+                        help='Channel to POST to (its data is overwritten)')
+    parser.add_argument('--boss_config_file', type=str, default='neurodata.cfg',
+                        help='Path and filename for Boss config (config file w/ server and API Key)')
+    parser.add_argument('--shapes', type=int, nargs='+',
+                        default=[512, 512, 1024, 1024, 2048, 2048],
+                        help='Block shapes as x y pairs (multiples of 512)')
+    parser.add_argument('--size', type=int, nargs=2, default=[4096, 4096],
+                        help='x y size of the synthetic stack POSTed for each shape')
+    parser.add_argument('--sparsity', type=float, default=0.0,
+                        help='Fraction of the synthetic data that is zero (compressibility)')
+    parser.add_argument('--threads', type=int, default=8, help='Number of POSTs at the same time')
+    args = parser.parse_args()
+
+    job_args = argparse.Namespace(datasource='local', collection=args.collection,
+                                  experiment=args.experiment, channel=args.channel,
+                                  boss_config_file=args.boss_config_file, get_extents=True,
+                                  res=0, verify_samples=0)
+    ingest_job = IngestJob(job_args)
+    boss_res_params = BossResParams(ingest_job)
+    boss_res_params.get_resources(get_only=True)
+    datatype = ingest_job.boss_datatype
+
+    rng = np.random.RandomState(0)
+    data = rng.randint(1, np.iinfo(datatype).max, size=(CUBOID_SIZE[2], args.size[1], args.size[0]),
+                       dtype=datatype)
+    data[rng.random_sample(data.shape) < args.sparsity] = 0
+
+    def post(x_rng, y_rng, z_rng, block):
+        post_cutout(boss_res_params, ingest_job, x_rng, y_rng, z_rng, block, attempts=1)
+
+    shapes = list(zip(args.shapes[::2], args.shapes[1::2]))
+    print_benchmark(benchmark_block_shapes(post, data, shapes, threads=args.threads))
+
+
+if __name__ == '__main__':
+    main()
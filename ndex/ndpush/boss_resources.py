@@ -7,22 +7,43 @@ Associated with an ingest job
 import math
 import os
 
+import requests
 from requests import HTTPError
 
 from intern.remote.boss import BossRemote
 from intern.resource.boss.resource import *
 from intern.service.boss.httperrorlist import HTTPErrorList
 
+from ndex.common import get_boss_config
+
+BOSS_VERSION = 'v1'
+
+# seconds to connect to the Boss and to wait for its response to a cutout POST
+CUTOUT_TIMEOUT = (30, 300)
+
 
 class BossResParams:
-    def __init__(self, ingest_job):
+    def __init__(self, ingest_job, shared_params=None):
         self.ingest_job = ingest_job
 
         self.coord_frame_name = '_'.join(
             (ingest_job.coll_name, ingest_job.exp_name))
 
+        if shared_params is not None:
+            # channels ingested together use the same remote and connection pool
+            self.rmt = shared_params.rmt
+            self.boss_url = shared_params.boss_url
+            self.session = shared_params.session
+            return
+
         self.rmt = self.setup_remote()
 
+        # session for requests made outside of intern (e.g. pre-compressed cutouts)
+        # same config file (or environment variable) as the intern remote
+        token, self.boss_url = get_boss_config(self.ingest_job.boss_config_file)
+        self.session = requests.Session()
+        self.session.headers = {'Authorization': 'Token {}'.format(token)}
+
     def get_resources(self, get_only=True):
         self.coll_resource = self.setup_boss_collection(get_only=get_only)
 
@@ -44,6 +65,17 @@ class BossResParams:
             config_dict = {'token': token, 'protocol': protocol, 'host': host}
             return BossRemote(config_dict)
 
+    def post_blosc_cutout(self, res, x_rng, y_rng, z_rng, compressed):
+        # POSTs data that is already blosc compressed (zyx, boss datatype) to the channel
+        cutout_url = '{}/{}/cutout/{}/{}/{}/{}/{}:{}/{}:{}/{}:{}/'.format(
+            self.boss_url, BOSS_VERSION,
+            self.ingest_job.coll_name, self.ingest_job.exp_name, self.ingest_job.ch_name, res,
+            x_rng[0], x_rng[1], y_rng[0], y_rng[1], z_rng[0], z_rng[1])
+        resp = self.session.post(cutout_url, data=compressed,
+                                 headers={'Content-Type': 'application/blosc'},
+                                 timeout=CUTOUT_TIMEOUT)
+        resp.raise_for_status()
+
     def get_boss_project(self, proj_setup, get_only):
         try:
             proj_actual = self.rmt.get_project(proj_setup)
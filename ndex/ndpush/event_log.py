@@ -0,0 +1,75 @@
+'''
+Structured event log for ingest jobs
+Events are JSON lines with typed fields (block coordinates, timings, byte counts)
+They are buffered in memory and written in batches, so POST threads only touch the disk once per batch
+(the thread that fills the buffer writes it)
+'''
+
+import atexit
+import json
+import os
+import threading
+import time
+
+# logs with buffered events, written out when python exits (e.g. after an exception)
+# logs are only in here while they have something buffered, so they aren't kept alive after that
+PENDING_LOGS = set()
+
+
+@atexit.register
+def flush_pending_logs():
+    for event_log in list(PENDING_LOGS):
+        event_log.flush()
+
+
+def get_event_log_fname(coll, exp, ch):
+    return '_'.join(('ingest_events', coll, exp, ch)) + '.jsonl'
+
+
+class EventLog:
+    def __init__(self, fname, flush_every=200, flush_interval=5):
+        # absolute, buffered events can be written after the working directory changed (at exit)
+        self.fname = os.path.abspath(fname)
+        self.flush_every = flush_every
+        self.flush_interval = flush_interval
+
+        self.lock = threading.Lock()
+        self.buffer = []
+        self.last_flush = time.time()
+
+    def record(self, event, **fields):
+        entry = {'time': time.time(), 'event': event}
+        entry.update(fields)
+        with self.lock:
+            self.buffer.append(entry)
+            PENDING_LOGS.add(self)
+            if (len(self.buffer) >= self.flush_every
+                    or entry['time'] - self.last_flush >= self.flush_interval):
+                self.write_buffer()
+
+    def flush(self):
+        with self.lock:
+            self.write_buffer()
+
+    def write_buffer(self):
+        # caller holds the lock
+        if self.buffer:
+            lines = ''.join(json.dumps(entry) + '\n' for entry in self.buffer)
+            with open(self.fname, 'a') as f:
+                f.write(lines)
+            self.buffer = []
+        PENDING_LOGS.discard(self)
+        self.last_flush = time.time()
+
+
+def read_events(fname, event=None):
+    # yields the events (dicts) in the log, optionally only those of one type
+    with open(fname) as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                # blank or partially written line (interrupted ingest)
+                continue
+            if event is None or entry.get('event') == event:
+                yield entry
@@ -4,19 +4,27 @@ Stores all the info for each ingest job
 '''
 
 import io
+import json
+import logging
+import logging.handlers
 import os
 import re
 import time
 from datetime import datetime
+from multiprocessing.dummy import Pool as ThreadPool
 
 import boto3
 import numpy as np
-import tailer
 import tifffile
 from PIL import Image
 from slacker import Slacker
 
+from ndex.ndpush.event_log import EventLog, get_event_log_fname
+from ndex.ndpush.metrics import INGEST_METRICS
 from ndex.ndpush.render_resource import renderResource
+from ndex.ndpush.slack_notifier import SlackNotifier
+from ndex.ndpush.verify import DEFAULT_VERIFY_SAMPLES
+from ndex.ndpush.volume_source import HDF5Source, ZarrSource
 
 
 class IngestJob:
@@ -34,6 +42,9 @@ class IngestJob:
         self.coll_name = args.get('collection')
         self.exp_name = args.get('experiment')
         self.ch_name = args.get('channel')
+
+        # messages of the job go to the text log through a buffer (one write per batch of messages)
+        self.text_log = create_text_log(self.get_log_fname())
         self.datatype = args.get('datatype')
         self.warn_missing_files = args.get('warn_missing_files')
         self.z_range = args.get('z_range')
@@ -47,6 +58,13 @@ class IngestJob:
         self.res = args.get('res')
         self.source_channel = args.get('source_channel')
 
+        # images with interleaved samples (e.g. RGB) are split at read time, one Boss channel per sample
+        self.sample_channels = args.get('sample_channels')
+        if self.sample_channels and self.ch_name in self.sample_channels:
+            self.sample_index = self.sample_channels.index(self.ch_name)
+        else:
+            self.sample_index = None
+
         if self.source_channel is not None:
             self.boss_datatype = 'uint64'  # force boss datatype to uint64 for annotations
             self.ch_type = 'annotation'
@@ -84,8 +102,8 @@ class IngestJob:
             if self.z_range is None:  # if the user isn't specifying the z range for ingest, we just get the entire extent
                 self.z_range = self.z_extent
 
-        # otherwise it's image data
-        elif self.datasource == 's3' or self.datasource == 'local':
+        # otherwise it's image data (slices, or a chunked volume for zarr and hdf5)
+        elif self.datasource in ('s3', 'local', 'zarr', 'hdf5'):
             self.base_fname = args.get('base_filename')
             self.base_path = args.get('base_path')
             self.extension = args.get('extension')
@@ -96,6 +114,18 @@ class IngestJob:
             self.apply_limits()
             self.z_step = args.get('z_step')
 
+        # chunked volumes (zyx) are read a z stack at a time
+        self.volume_source = None
+        if self.datasource == 'zarr' or self.datasource == 'hdf5':
+            if self.sample_channels:
+                raise ValueError('sample channels are not supported for volume datasources')
+            if self.datasource == 'zarr':
+                self.volume_source = ZarrSource(self.get_volume_path())
+            else:
+                self.volume_source = HDF5Source(
+                    self.get_volume_path(), self.get_volume_path(args.get('h5_dataset') or ''),
+                    args.get('h5_cache_mb'))
+
         # initialize offset to zero (x,y,z)
         self.offsets = [0, 0, 0]
         self.forced_offsets = args.get('forced_offsets')
@@ -117,8 +147,13 @@ class IngestJob:
         self.validate_coord_frames()
 
         # creating the slack session
+        self.slack_notifier = None
         self.slack_obj = self.create_slack_session(
             args.get('slack_token_file'))
+        # messages are delivered in the background so they never hold up an ingest thread
+        if self.slack_obj is not None:
+            self.slack_notifier = SlackNotifier(
+                self.slack_obj, self.slack_usr, self.get_log_fname())
 
         if self.datasource == 's3':
             self.s3_res = self.create_s3_res(
@@ -128,9 +163,25 @@ class IngestJob:
 
         self.boss_config_file = args.get('boss_config_file')
 
+        # x/y shape of the POSTed blocks (None to choose it during the ingest with block_tuner)
+        self.block_shape = args.get('block_shape')
+        self.block_tuner = None
+
+        # number of POSTed blocks checked against the Boss at the end of the ingest
+        self.verify_samples = args.get('verify_samples', DEFAULT_VERIFY_SAMPLES)
+
         self.num_READ_failures = 0
         self.num_POST_failures = 0
 
+        # stage timings and counts, shared with the other channels ingested by this process
+        self.metrics = INGEST_METRICS
+
+        # progress bar (IngestProgress), shared with the channels ingested together
+        self.progress = None
+
+        # per block events (POSTs, empty blocks, reads) go to the structured log
+        self.event_log = EventLog(self.get_event_log_fname())
+
         # Document the arguments passed
         self.send_msg('{} Command parameters used: {}'.format(
             get_formatted_datetime(), args))
@@ -211,18 +262,40 @@ class IngestJob:
     def get_log_fname(self):
         return '_'.join(('ingest_log', self.coll_name, self.exp_name, self.ch_name)) + '.txt'
 
-    def send_msg(self, msg, send_slack=False):
-        logfile = self.get_log_fname()
+    def get_event_log_fname(self):
+        return get_event_log_fname(self.coll_name, self.exp_name, self.ch_name)
+
+    def get_manifest_fname(self):
+        return get_manifest_fname(self.coll_name, self.exp_name, self.ch_name)
+
+    def save_manifest(self, args_namespace):
+        # the arguments of the job, so failed cutouts can be repeated without re-entering them
+        with open(self.get_manifest_fname(), 'w') as f:
+            json.dump(vars(args_namespace), f, indent=2)
 
+    def record_event(self, event, x_rng=None, y_rng=None, z_rng=None, **fields):
+        # block coordinates are stored as [start, stop] lists
+        for name, rng in (('x', x_rng), ('y', y_rng), ('z', z_rng)):
+            if rng is not None:
+                fields[name] = [int(rng[0]), int(rng[1])]
+        self.event_log.record(event, coll=self.coll_name, exp=self.exp_name, ch=self.ch_name,
+                              **fields)
+
+    def send_msg(self, msg, send_slack=False):
         print(msg)
-        with open(logfile, 'a') as f:
-            f.write(msg + '\n')
-        if send_slack and self.slack_obj is not None:
-            self.slack_obj.chat.post_message(
-                '@' + self.slack_usr, msg, username='local_ingest.py')
-            content = tailer.tail(open(logfile), 10)
-            self.slack_obj.files.upload(content='\n'.join(
-                content), channels='@' + self.slack_usr, title=get_formatted_datetime() + '_tail_of_log')
+        # messages sent to Slack write out the buffered text log too
+        self.text_log.log(logging.WARNING if send_slack else logging.INFO, msg)
+        if send_slack and self.slack_notifier is not None:
+            self.slack_notifier.send(msg)
+
+    def log_msg(self, msg):
+        # per block messages only go to the (buffered) text log
+        self.text_log.info(msg)
+
+    def flush_logs(self):
+        self.event_log.flush()
+        for handler in self.text_log.handlers:
+            handler.flush()
 
     def calc_offsets(self):
         if self.forced_offsets is not None:
@@ -266,7 +339,11 @@ class IngestJob:
             self.img_size = None
 
     def get_img_info(self, z_slice):
+        if self.volume_source is not None:
+            return self.volume_source.get_img_info()
         img = self.load_img(z_slice)
+        if self.sample_channels and img.ndim == 3:
+            img = self.split_samples(img)[0]
 
         width = img.shape[1]
         height = img.shape[0]
@@ -318,9 +395,17 @@ class IngestJob:
                 raise IOError(msg)
 
     def load_img(self, z_slice):
+        if self.volume_source is not None:
+            return self.read_volume([z_slice, z_slice + 1])[0]
+
         if self.datasource == 'render':
             # download the slice from render server
-            return self.load_render_slice(z_slice)
+            start_time = time.time()
+            im = self.load_render_slice(z_slice)
+            self.metrics.read_seconds.observe(time.time() - start_time, channel=self.ch_name)
+            if im is not None:
+                self.metrics.read_bytes.inc(im.nbytes, channel=self.ch_name)
+            return im
 
         # if it's not render datasource, we are working with images in some form
         img_fname = self.get_img_fname(z_slice)
@@ -329,10 +414,13 @@ class IngestJob:
             im_obj = self.validate_local_img(img_fname)
         elif self.datasource == 's3':
             # download the file from s3
+            start_time = time.time()
             im_obj = self.load_s3_obj(img_fname)
+            self.metrics.read_seconds.observe(time.time() - start_time, channel=self.ch_name)
 
         # called if datasource is s3 or local
         try:
+            start_time = time.time()
             _, extension = os.path.splitext(img_fname)
             # if it's PNG we load it with PILLOW using the user specified datatype
             if extension.lower() == '.png':
@@ -346,6 +434,8 @@ class IngestJob:
             else:
                 im = tifffile.imread(im_obj, is_ome=False)
 
+            self.metrics.decode_seconds.observe(time.time() - start_time, channel=self.ch_name)
+            self.metrics.read_bytes.inc(im.nbytes, channel=self.ch_name)
             return im
 
         except OSError:
@@ -366,6 +456,21 @@ class IngestJob:
                 return None
             raise IOError(msg)
 
+    def get_volume_path(self, path=None):
+        # <ch> in the path (base path by default) is replaced with the channel name
+        if path is None:
+            path = self.base_path
+        return path.replace('<ch>', self.ch_name)
+
+    def read_volume(self, z_rng):
+        # z slices of a volume datasource, the source chunks are read in parallel
+        start_time = time.time()
+        im = self.volume_source.read(z_rng, [0, self.img_size[1]], [0, self.img_size[0]])
+        im = im.astype(self.datatype, copy=False)
+        self.metrics.decode_seconds.observe(time.time() - start_time, channel=self.ch_name)
+        self.metrics.read_bytes.inc(im.nbytes, channel=self.ch_name)
+        return im
+
     def get_img_fname(self, z_index):
         if self.datasource == 'render':
             return None
@@ -400,34 +505,85 @@ class IngestJob:
         # prepend root, append extension
         return os.path.join(base_path, "{}.{}".format(base_fname, self.extension))
 
-    def read_img_stack(self, z_slices):
+    def read_img_stack(self, z_slices, threads=1, all_samples=False):
+        # all_samples: every sample of interleaved images, decoded once into a (sample, z, y, x) array
+        # otherwise only the sample of this channel (if the images have samples)
         self.send_msg('{} Reading image data (z range: {}:{})'.format(
             get_formatted_datetime(), z_slices[0], z_slices[-1] + 1))
 
         start_time = time.time()
-        im_array = np.zeros(
-            (len(z_slices), self.img_size[1], self.img_size[0]), dtype=self.datatype, order='C')
-        for idx, z_slice in enumerate(z_slices):
-            img = self.load_img(z_slice)
-            if img is None and self.warn_missing_files:
-                continue
-            im_array[idx, :, :] = img
+        if self.volume_source is not None:
+            # a single read of the whole stack
+            im_array = self.read_volume([z_slices[0], z_slices[-1] + 1])
+        else:
+            im_array = self.read_img_slices(z_slices, threads, all_samples)
 
-        # cast the data as uint64 for the BOSS annotations even if the data is something else
-        if self.datatype != 'uint64' and self.boss_datatype == 'uint64':
-            im_array = im_array.astype('uint64')
+        # annotation data is kept in the source datatype, blocks are cast to uint64 when they're POSTed
 
         end_time = time.time()
         read_time = end_time - start_time
+        self.metrics.stack_read_seconds.observe(read_time, channel=self.ch_name)
+        self.record_event('read', z_rng=[z_slices[0], z_slices[-1] + 1],
+                          seconds=read_time, nbytes=im_array.nbytes)
         self.send_msg('{} Finished reading image data (z range: {}:{}) in {:.2f} sec'.format(
             get_formatted_datetime(), z_slices[0], z_slices[-1] + 1, read_time))
         return im_array
 
+    def split_samples(self, img):
+        # (S, y, x) view of an image with samples: interleaved (contig) images are (y, x, S),
+        # tifffile returns planar (separate) images as (S, y, x) already
+        samples = len(self.sample_channels)
+        if img.shape[0] == samples and img.shape[-1] != samples:
+            return img
+        return np.moveaxis(img, -1, 0)
+
+    def read_img_slices(self, z_slices, threads=1, all_samples=False):
+        shape = (len(z_slices), self.img_size[1], self.img_size[0])
+        if all_samples:
+            shape = (len(self.sample_channels),) + shape
+        im_array = np.zeros(shape, dtype=self.datatype, order='C')
+
+        def load_slice(idx):
+            img = self.load_img(z_slices[idx])
+            if img is None and self.warn_missing_files:
+                return
+            if all_samples:
+                # each sample plane is contiguous for its channel
+                im_array[:, idx, :, :] = self.split_samples(img)
+            elif self.sample_index is not None:
+                im_array[idx, :, :] = self.split_samples(img)[self.sample_index]
+            else:
+                im_array[idx, :, :] = img
+
+        # slices are decoded in parallel when threads > 1 (file reads and decoding release the GIL)
+        if threads > 1:
+            with ThreadPool(threads) as pool:
+                pool.map(load_slice, range(len(z_slices)))
+        else:
+            for idx in range(len(z_slices)):
+                load_slice(idx)
+        return im_array
+
 
 def get_formatted_datetime():
     return datetime.now().strftime("%Y-%m-%d %H:%M:%S")
 
 
+def create_text_log(fname, capacity=200):
+    # logger of a single job, not registered with logging so it's released with the job
+    # messages are written when the buffer is full, at warnings (Slack messages), on flush_logs
+    # and when python exits (logging.shutdown)
+    target = logging.FileHandler(fname, delay=True)
+    target.setFormatter(logging.Formatter('%(message)s'))
+    logger = logging.Logger(fname, logging.INFO)
+    logger.addHandler(logging.handlers.MemoryHandler(capacity, logging.WARNING, target))
+    return logger
+
+
+def get_manifest_fname(coll_name, exp_name, ch_name):
+    return '_'.join(('ingest_manifest', coll_name, exp_name, ch_name)) + '.json'
+
+
 def validate_limit(data_rng, limit):
     if data_rng is not None and limit is not None:
         if limit[0] < data_rng[0] or limit[1] > data_rng[1]:
@@ -5,21 +5,37 @@ Parses arguments and manages the ingest process
 
 import argparse
 import platform
+import random
 import sys
 import time
 from collections import defaultdict
 from datetime import datetime
-from functools import partial
+from functools import lru_cache, partial
 from multiprocessing.dummy import Pool as ThreadPool
 
+import blosc
 import numpy as np
+from intern.remote.boss import BossRemote
 from PIL import Image
 
+from ndex.common import insert_block
+from ndex.profiler import Profiler
+from ndex.request_planner import get_request_shape, plan_cutouts
+from ndex.ndpush.block_shape import BlockShapeTuner, estimate_compress_ratio
 from ndex.ndpush.boss_resources import BossResParams
 from ndex.ndpush.ingest_job import IngestJob
+from ndex.ndpush.metrics import INGEST_METRICS, MetricsServer
+from ndex.ndpush.progress import IngestProgress, get_channel_nbytes
+from ndex.ndpush.verify import (CUTOUT_MSG, DEFAULT_VERIFY_SAMPLES, block_hash,
+                                get_hash_probability, verify_channel)
+from ndex.ndpush.volume_source import ChunkedSource, HDF5Source
 
 Image.MAX_IMAGE_PIXELS = None
 
+# blosc settings for annotation (label) blocks
+# bitshuffle packs the mostly zero high bits of uint64 labels together and zstd removes them
+ANNO_BLOSC_ARGS = {'cname': 'zstd', 'clevel': 5, 'shuffle': blosc.BITSHUFFLE}
+
 
 def read_channel_names(channels_path):
     try:
@@ -32,106 +48,172 @@ def read_channel_names(channels_path):
         raise FileNotFoundError
 
 
+def is_single_label(data, label):
+    # compared a row, then a slice at a time, so blocks with more labels usually stop early
+    if (data[0, 0] != label).any():
+        return False
+    return not any((plane != label).any() for plane in data)
+
+
+@lru_cache(maxsize=64)
+def encode_single_label_block(label, shape, datatype):
+    # compressed once per label and shape, so blocks of background (or of one label) are not
+    # allocated as datatype at all after the first one
+    block = np.full(shape, label, dtype=datatype)
+    return blosc.compress_ptr(block.__array_interface__['data'][0], block.size,
+                              typesize=block.dtype.itemsize, **ANNO_BLOSC_ARGS)
+
+
+def encode_annotation_block(data, datatype='uint64'):
+    # blosc compresses a block of labels (zyx, in any source datatype) as datatype
+    first = data.flat[0]
+    if is_single_label(data, first):
+        # single label, no need to convert the source
+        return encode_single_label_block(int(first), data.shape, datatype)
+
+    block = np.ascontiguousarray(data, dtype=datatype)
+    return blosc.compress_ptr(block.__array_interface__['data'][0], block.size,
+                              typesize=block.dtype.itemsize, **ANNO_BLOSC_ARGS)
+
+
 def post_cutout(boss_res_params, ingest_job, x_rng, y_rng, z_rng, data, attempts=5):
     ch = ingest_job.ch_name
     cutout_msg = 'Coll: {}, Exp: {}, Ch: {}, x: {}, y: {}, z: {}'.format(
         ingest_job.coll_name, ingest_job.exp_name, ch, x_rng, y_rng, z_rng)
+    metrics = ingest_job.metrics
+
+    # annotation channels are uint64 in the Boss
+    annotation = ingest_job.boss_datatype == 'uint64'
+    if annotation:
+        # compressed once here (not per attempt) with settings for label data
+        start_time = time.time()
+        compressed = encode_annotation_block(data, ingest_job.boss_datatype)
+        metrics.compress_seconds.observe(time.time() - start_time, channel=ch)
+    elif data.dtype != ingest_job.boss_datatype:
+        data = np.asarray(data, dtype=ingest_job.boss_datatype, order='C')
+
     # POST cutout
     for attempt in range(attempts):
         try:
             start_time = time.time()
-            boss_res_params.rmt.create_cutout(boss_res_params.ch_resource, ingest_job.res,
-                                              x_rng, y_rng, z_rng, data)
+            metrics.posts_in_flight.inc(channel=ch)
+            try:
+                if annotation:
+                    boss_res_params.post_blosc_cutout(ingest_job.res,
+                                                      x_rng, y_rng, z_rng, compressed)
+                else:
+                    boss_res_params.rmt.create_cutout(boss_res_params.ch_resource, ingest_job.res,
+                                                      x_rng, y_rng, z_rng, data)
+            finally:
+                metrics.posts_in_flight.dec(channel=ch)
             end_time = time.time()
             post_time = end_time - start_time
-            msg = '{} POST succeeded in {:.2f} sec. {}'.format(
-                get_formatted_datetime(), post_time, cutout_msg)
-            ingest_job.send_msg(msg)
         except Exception as e:
             # attempt failed
-            ingest_job.send_msg(str(e))
+            error = str(e)
+            ingest_job.send_msg(error)
             if attempt != attempts - 1:
+                metrics.post_retries.inc(channel=ch)
                 time.sleep(2**(attempt + 1))
         else:
             break
     else:
         # we failed all the attempts - deal with the consequences.
+        ingest_job.record_event('post', x_rng, y_rng, z_rng, status='failed',
+                                attempts=attempts, error=error)
         msg = '{} Error: data upload failed after multiple attempts, skipping. {}'.format(
             get_formatted_datetime(), cutout_msg)
         ingest_job.send_msg(msg, send_slack=True)
         ingest_job.num_POST_failures += 1
+        metrics.post_failures.inc(channel=ch)
         return 1
-    return 0
 
+    ingest_job.log_msg('{} POST succeeded in {:.2f} sec. {}'.format(
+        get_formatted_datetime(), post_time, cutout_msg))
+    nbytes = data.size * np.dtype(ingest_job.boss_datatype).itemsize
+    metrics.post_seconds.observe(post_time, channel=ch)
+    metrics.post_bytes.inc(nbytes, channel=ch)
+    if annotation:
+        metrics.post_compressed_bytes.inc(len(compressed), channel=ch)
+    # hashes are only needed (and annotation blocks only converted again) for verification,
+    # which checks a sample of the blocks: only about that many blocks are hashed
+    block_digest = None
+    if ingest_job.verify_samples and random.random() < get_hash_probability(
+            nbytes, get_channel_nbytes(ingest_job), ingest_job.verify_samples):
+        block_digest = block_hash(data, ingest_job.boss_datatype)
+    ingest_job.record_event('post', x_rng, y_rng, z_rng, status='ok', attempts=attempt + 1,
+                            seconds=post_time, nbytes=nbytes,
+                            compressed_bytes=len(compressed) if annotation else None,
+                            hash=block_digest)
+    if ingest_job.block_tuner is not None:
+        ingest_job.block_tuner.record(nbytes, post_time)
+    return 0
 
-def download_boss_slice(boss_res_params, ingest_job, z_slice, attempts=3):
-    im_array_boss = np.zeros([1, ingest_job.img_size[1], ingest_job.img_size[0]],
-                             dtype=ingest_job.datatype)
 
-    rmt = boss_res_params.rmt
-    stride = 2048
+def fetch_cutout(boss_res_params, ingest_job, x_rng, y_rng, z_rng, attempts=3):
+    # zyx data of a cutout from the Boss, None if all the attempts failed
+    for attempt in range(attempts):
+        try:
+            return boss_res_params.rmt.get_cutout(boss_res_params.ch_resource, ingest_job.res,
+                                                  x_rng, y_rng, z_rng)
+        except Exception as e:
+            # attempt failed
+            ingest_job.send_msg(str(e))
+            if attempt != attempts - 1:
+                time.sleep(2**(attempt + 1))
 
-    x_buckets = get_supercube_lims(ingest_job.x_extent, stride=stride)
-    y_buckets = get_supercube_lims(ingest_job.y_extent, stride=stride)
-    for _, y_slices in y_buckets.items():
-        y_rng = [y_slices[0],
-                 y_slices[-1]+1]
-        for _, x_slices in x_buckets.items():
-            x_rng = [x_slices[0],
-                     x_slices[-1]+1]
-            for attempt in range(attempts):
-                try:
-                    im_array_boss[0, y_rng[0]-ingest_job.y_extent[0]:y_rng[1]-ingest_job.y_extent[0],
-                                  x_rng[0]-ingest_job.x_extent[0]:x_rng[-1]-ingest_job.x_extent[0]] = rmt.get_cutout(
-                        boss_res_params.ch_resource,
-                        ingest_job.res,
-                        x_rng, y_rng, [z_slice, z_slice + 1]
-                    )
-                except Exception as e:
-                    # attempt failed
-                    ingest_job.send_msg(str(e))
-                    if attempt != attempts - 1:
-                        time.sleep(2**(attempt + 1))
-                else:
-                    break
-            else:
-                # we failed all the attempts - deal with the consequences.
-                msg = '{} Error: download cutout failed after multiple attempts'.format(
-                    get_formatted_datetime())
-                ingest_job.send_msg(msg, send_slack=True)
-    return im_array_boss
+    # we failed all the attempts - deal with the consequences.
+    msg = '{} Error: download cutout failed after multiple attempts. {}'.format(
+        get_formatted_datetime(), CUTOUT_MSG.format(ingest_job.coll_name, ingest_job.exp_name,
+                                                    ingest_job.ch_name, x_rng, y_rng, z_rng))
+    ingest_job.send_msg(msg, send_slack=True)
+    return None
 
 
-def assert_equal(boss_res_params, ingest_job, z_rng):
-    ingest_job.send_msg('Checking to make sure data has been POSTed correctly')
+def read_region(boss_res_params, ingest_job, x_rng, y_rng, z_rng, threads=8, attempts=3, pool=None):
+    # reads back a region (zyx array) from the Boss, requests are split on cuboid boundaries
+    # and fetched in parallel (on pool if given)
+    # raises a ConnectionError if any request still failed after its attempts
+    data = np.zeros([z_rng[1] - z_rng[0], y_rng[1] - y_rng[0], x_rng[1] - x_rng[0]],
+                    dtype=ingest_job.boss_datatype)
+    data_rngs = [x_rng, y_rng, z_rng]
 
-    # choose a rand slice:
-    rand_slice = np.random.randint(z_rng[0], z_rng[1])
+    # the requests don't extend past the region, so no data is downloaded twice
+    request_shape = get_request_shape(ingest_job.boss_datatype)
+    cutouts = plan_cutouts(x_rng, y_rng, z_rng, request_shape, extents=data_rngs)
 
-    # load data from Boss
-    msg = '{} Getting random z slice from BOSS for comparison'.format(
-        get_formatted_datetime())
-    ingest_job.send_msg(msg)
+    failed = []
 
-    im_array_boss = download_boss_slice(
-        boss_res_params, ingest_job, rand_slice + ingest_job.offsets[2])
+    def fetch(cutout_rngs):
+        block = fetch_cutout(boss_res_params, ingest_job, *cutout_rngs, attempts=attempts)
+        if block is None:
+            failed.append(cutout_rngs)
+        else:
+            insert_block(data, data_rngs, block, cutout_rngs)
+
+    if len(cutouts) == 1:
+        # no pool for a single request (e.g. a block read back by verify)
+        fetch(cutouts[0])
+    elif pool is None:
+        with ThreadPool(threads) as pool:
+            pool.map(fetch, cutouts)
+    else:
+        pool.map(fetch, cutouts)
 
-    msg = '{} Z slice from BOSS downloaded'.format(
-        get_formatted_datetime())
-    ingest_job.send_msg(msg)
+    if failed:
+        raise ConnectionError('{} of {} requests failed reading x: {}, y: {}, z: {}'.format(
+            len(failed), len(cutouts), x_rng, y_rng, z_rng))
+    return data
 
-    # load source data (one z slice)
-    im_array_local = ingest_job.read_img_stack([rand_slice])
 
-    # assert that cutout from the boss is the same as what was sent
-    if np.array_equal(im_array_boss, im_array_local):
-        ingest_job.send_msg('Test slice {} in Boss matches file {}'.format(
-            rand_slice, ingest_job.get_img_fname(rand_slice)))
-        return True
-    else:
-        ingest_job.send_msg('Test slice {} in Boss does *NOT* match file {}'.format(
-            rand_slice, ingest_job.get_img_fname(rand_slice)), send_slack=True)
-        return False
+def get_profile_targets():
+    # stages of an ingest: reading/decoding images, compressing blocks and POSTing them
+    module = sys.modules[__name__]
+    return [(IngestJob, 'load_img'), (IngestJob, 'read_img_stack'),
+            (ChunkedSource, 'read'), (HDF5Source, 'read'),
+            (module, 'ingest_block'), (module, 'post_cutout'),
+            (module, 'encode_annotation_block'), (BossRemote, 'create_cutout'),
+            (BossResParams, 'post_blosc_cutout')]
 
 
 def get_supercube_lims(rng, stride=16):
@@ -161,18 +243,30 @@ def ingest_block(x_slice_key, x_buckets, boss_res_params, ingest_job, y_rng, z_r
                     x_rng[0]-ingest_job.x_extent[0]:x_rng[1]-ingest_job.x_extent[0]]
     data = np.asarray(data, order='C')
 
-    if np.sum(data) == 0:
-        ingest_job.send_msg('{} Block empty for Collection: {}, Experiment: {}, Channel: {} x/y/z: {}/{}/{}, skipping'.format(
+    ingest_job.metrics.blocks_queued.dec(channel=ingest_job.ch_name)
+    nbytes = data.size * np.dtype(ingest_job.boss_datatype).itemsize
+
+    # any() stops at the first non zero value (and can't overflow like sum)
+    if not data.any():
+        ingest_job.log_msg('{} Block empty for Collection: {}, Experiment: {}, Channel: {} x/y/z: {}/{}/{}, skipping'.format(
             get_formatted_datetime(),
             ingest_job.coll_name, ingest_job.exp_name, ingest_job.ch_name, x_rng, y_rng, z_rng))
+        ingest_job.record_event('empty', x_rng, y_rng, z_rng)
+        ingest_job.metrics.empty_blocks.inc(channel=ingest_job.ch_name)
+        if ingest_job.progress is not None:
+            ingest_job.progress.update(nbytes, 'empty')
         return
 
     # POST each block to the BOSS
-    post_cutout(boss_res_params, ingest_job,
-                x_rng, y_rng, z_rng, data, attempts=3)
+    failed = post_cutout(boss_res_params, ingest_job,
+                         x_rng, y_rng, z_rng, data, attempts=3)
+    if ingest_job.progress is not None:
+        ingest_job.progress.update(nbytes, 'failed' if failed else 'ok')
 
 
-def per_channel_ingest(args, channel, threads=8):
+def setup_channel_ingest(args, channel, shared_params=None):
+    # creates the ingest job and boss resources for a channel, returns None if only creating resources
+    # shared_params (BossResParams of another channel) shares its connections to the Boss
     args.channel = channel
     ingest_job = IngestJob(args)
 
@@ -195,46 +289,84 @@ def per_channel_ingest(args, channel, threads=8):
 
     # create or get the boss resources for the data
     get_only = not ingest_job.create_resources
-    boss_res_params = BossResParams(ingest_job)
+    boss_res_params = BossResParams(ingest_job, shared_params=shared_params)
     boss_res_params.get_resources(get_only=get_only)
 
+    # the boss datatype is known once we have the channel
+    ingest_job.block_tuner = BlockShapeTuner(ingest_job.boss_datatype, ingest_job.block_shape)
+
     # we just create the resources, don't do anything else
     if ingest_job.create_resources:
         ingest_job.send_msg('{} Resources set up. Collection: {}, Experiment: {}, Channel: {}'.format(
             get_formatted_datetime(), ingest_job.coll_name, ingest_job.exp_name, ingest_job.ch_name))
-        return 0
+        return None
     else:
+        # saved for repeat_cutouts, which re-ingests failed cutouts from the same source
+        ingest_job.save_manifest(args)
         ingest_job.send_msg('{} Starting ingest for Collection: {}, Experiment: {}, Channel: {}, Z: {z[0]},{z[1]}'.format(
             get_formatted_datetime(), ingest_job.coll_name, ingest_job.exp_name, ingest_job.ch_name, z=ingest_job.z_range))
 
-    # we begin the ingest here:
-    stride_x = 1024
-    stride_y = 1024
-    stride_z = 16
+    return ingest_job, boss_res_params
+
+
+def start_progress(args, ingest_jobs):
+    # one progress bar for the channels ingested together (and an entry in the status file)
+    args = vars(args)
+    z_range = ingest_jobs[0].z_range
+    name = '{} z {}-{}'.format(','.join(ingest_job.ch_name for ingest_job in ingest_jobs),
+                               z_range[0], z_range[1])
+    progress = IngestProgress(name, status_file=args.get('status_file'),
+                              show_bar=not args.get('no_progress'))
+    for ingest_job in ingest_jobs:
+        progress.add_total(get_channel_nbytes(ingest_job))
+        ingest_job.progress = progress
+    return progress
+
+
+def get_z_buckets(ingest_job, stride_z=16):
+    return get_supercube_lims(ingest_job.z_range, stride_z)
+
+
+def ingest_z_stack(ingest_job, boss_res_params, z_slices, pool, im_array=None):
+    # read images into numpy array (unless they were already read)
+    if im_array is None:
+        im_array = ingest_job.read_img_stack(z_slices)
+    z_rng = [z_slices[0] - ingest_job.offsets[2],
+             z_slices[-1] + 1 - ingest_job.offsets[2]]
+
+    # block shape for this stack, from the datatype, the data and the previous POSTs
+    tuner = ingest_job.block_tuner
+    if tuner.fixed_shape is None and tuner.compress_ratio is None:
+        tuner.set_compress_ratio(estimate_compress_ratio(im_array, ingest_job.boss_datatype))
+    stride_x, stride_y, _ = tuner.get_shape()
     x_buckets = get_supercube_lims(ingest_job.x_extent, stride_x)
     y_buckets = get_supercube_lims(ingest_job.y_extent, stride_y)
-    z_buckets = get_supercube_lims(ingest_job.z_range, stride_z)
 
-    with ThreadPool(threads) as pool:
+    ingest_job.metrics.blocks_queued.inc(len(x_buckets) * len(y_buckets),
+                                         channel=ingest_job.ch_name)
 
-        # load images files in stacks of 16 at a time into numpy array
-        for _, z_slices in z_buckets.items():
-            # read images into numpy array
-            im_array = ingest_job.read_img_stack(z_slices)
-            z_rng = [z_slices[0] - ingest_job.offsets[2],
-                     z_slices[-1] + 1 - ingest_job.offsets[2]]
+    # slice into np array blocks
+    for _, y_slices in y_buckets.items():
+        y_rng = [y_slices[0], y_slices[-1] + 1]
+
+        ingest_block_partial = partial(
+            ingest_block, x_buckets=x_buckets, boss_res_params=boss_res_params, ingest_job=ingest_job,
+            y_rng=y_rng, z_rng=z_rng, im_array=im_array)
+        pool.map(ingest_block_partial, x_buckets.keys())
 
-            # slice into np array blocks
-            for _, y_slices in y_buckets.items():
-                y_rng = [y_slices[0], y_slices[-1] + 1]
 
-                ingest_block_partial = partial(
-                    ingest_block, x_buckets=x_buckets, boss_res_params=boss_res_params, ingest_job=ingest_job,
-                    y_rng=y_rng, z_rng=z_rng, im_array=im_array)
-                pool.map(ingest_block_partial, x_buckets.keys())
+def finish_channel_ingest(ingest_job, boss_res_params):
+    # the whole z range has been read
+    if ingest_job.volume_source is not None:
+        ingest_job.volume_source.close()
 
-    # checking data posted correctly for an entire z slice
-    assert_equal(boss_res_params, ingest_job, ingest_job.z_range)
+    # checking data posted correctly by comparing hashes of a sample of the blocks
+    if ingest_job.verify_samples:
+        # blocks are read back with the same retries as any other read of the Boss
+        fetch = partial(read_region, boss_res_params, ingest_job)
+        verify_channel(ingest_job, fetch, ingest_job.verify_samples)
+    else:
+        ingest_job.event_log.flush()
 
     ch_link = (
         'https://ndwebtools.neurodata.io/channel_detail/{}/{}/{}/').format(ingest_job.coll_name, ingest_job.exp_name, ingest_job.ch_name)
@@ -243,6 +375,95 @@ def per_channel_ingest(args, channel, threads=8):
         get_formatted_datetime(),
         ingest_job.z_range, ingest_job.coll_name, ingest_job.exp_name, ingest_job.ch_name,
         ingest_job.num_READ_failures, ingest_job.num_POST_failures, ch_link), send_slack=True)
+    ingest_job.send_msg(ingest_job.metrics.summary(ingest_job.ch_name))
+    ingest_job.flush_logs()
+
+    # wait for the queued Slack messages to go out
+    if ingest_job.slack_notifier is not None:
+        ingest_job.slack_notifier.close()
+
+
+def per_channel_ingest(args, channel, threads=8):
+    channel_ingest = setup_channel_ingest(args, channel)
+    if channel_ingest is None:
+        return 0
+    ingest_job, boss_res_params = channel_ingest
+
+    # we begin the ingest here:
+    z_buckets = get_z_buckets(ingest_job)
+    progress = start_progress(args, [ingest_job])
+
+    with ThreadPool(threads) as pool:
+
+        # load images files in stacks of 16 at a time into numpy array
+        for _, z_slices in z_buckets.items():
+            ingest_z_stack(ingest_job, boss_res_params, z_slices, pool)
+
+    progress.close()
+    finish_channel_ingest(ingest_job, boss_res_params)
+
+    return 0
+
+
+def multi_channel_ingest(args, channels, threads=8, parallel_channels=2):
+    # ingests the channels together, z stack by z stack
+    # at most parallel_channels stacks are in memory and at most threads blocks are POSTed at a time
+    channel_ingests = []
+    shared_params = None
+    for channel in channels:
+        channel_ingest = setup_channel_ingest(args, channel, shared_params=shared_params)
+        if channel_ingest is not None:
+            channel_ingests.append(channel_ingest)
+            if shared_params is None:
+                shared_params = channel_ingest[1]
+    if not channel_ingests:
+        return 0
+
+    # the channels share the arguments, so they share the z bucket schedule
+    z_buckets = get_z_buckets(channel_ingests[0][0])
+    progress = start_progress(args, [ingest_job for ingest_job, _ in channel_ingests])
+
+    with ThreadPool(threads) as pool, ThreadPool(parallel_channels) as channel_pool:
+        for _, z_slices in z_buckets.items():
+            channel_pool.starmap(ingest_z_stack, [
+                (ingest_job, boss_res_params, z_slices, pool)
+                for ingest_job, boss_res_params in channel_ingests])
+    progress.close()
+
+    for ingest_job, boss_res_params in channel_ingests:
+        finish_channel_ingest(ingest_job, boss_res_params)
+
+    return 0
+
+
+def split_channel_ingest(args, channels, threads=8):
+    # each sample of interleaved (e.g. RGB) images goes to its own channel
+    # stacks are decoded once and the sample planes are POSTed to their channels
+    args.sample_channels = channels
+    channel_ingests = []
+    shared_params = None
+    for channel in channels:
+        channel_ingest = setup_channel_ingest(args, channel, shared_params=shared_params)
+        if channel_ingest is not None:
+            channel_ingests.append(channel_ingest)
+            if shared_params is None:
+                shared_params = channel_ingest[1]
+    if len(channel_ingests) != len(channels):
+        return 0
+
+    reader = channel_ingests[0][0]
+    z_buckets = get_z_buckets(reader)
+    progress = start_progress(args, [ingest_job for ingest_job, _ in channel_ingests])
+
+    with ThreadPool(threads) as pool:
+        for _, z_slices in z_buckets.items():
+            samples = reader.read_img_stack(z_slices, all_samples=True)
+            for (ingest_job, boss_res_params), im_array in zip(channel_ingests, samples):
+                ingest_z_stack(ingest_job, boss_res_params, z_slices, pool, im_array=im_array)
+    progress.close()
+
+    for ingest_job, boss_res_params in channel_ingests:
+        finish_channel_ingest(ingest_job, boss_res_params)
 
     return 0
 
@@ -252,18 +473,26 @@ def main():
         description='Copy image z stacks to Boss for a single channel')
 
     parser.add_argument('--base_path', type=str,
-                        help='Directory where image stacks are located (e.g. "/data/images/"')
+                        help='Directory where image stacks are located (e.g. "/data/images/"), or the Zarr array / HDF5 file for the zarr and hdf5 datasources (zyx, z index is the slice)')
     parser.add_argument('--base_filename', type=str,
                         help='Base filename with z values specified "ch1_<>" or w/ leading zeros "ch1_<p:4>"')
     parser.add_argument('--extension', type=str, help='Extension (tif(f)/png)')
     parser.add_argument('--datasource', type=str, default='local',
-                        help='Location of files, either "local", "s3", or "render"')
+                        help='Location of files, either "local", "s3", "render", "zarr" (a local Zarr array) or "hdf5" (a dataset in a local HDF5 file), arrays are read a z stack at a time')
+    parser.add_argument('--h5_dataset', type=str,
+                        help='Dataset (zyx) in the HDF5 file for the hdf5 datasource (e.g. "volumes/labels", <ch> is replaced with the channel)')
+    parser.add_argument('--h5_cache_mb', type=float,
+                        help='HDF5 chunk cache size in MB, default fits a layer of chunks (all of x and y) up to 1 GB')
     parser.add_argument('--collection', type=str, help='Collection')
     parser.add_argument('--experiment', type=str, help='Experiment')
 
     parser.add_argument('--channel', type=str, help='Channel')
     parser.add_argument('--channels_list_file', type=str,
                         help='Path to a file with list of channels separated into separate lines')
+    parser.add_argument('--parallel_channels', type=int, default=1,
+                        help='Number of channels (from the channels list file) ingested at the same time, sharing the z stack schedule')
+    parser.add_argument('--sample_channels', type=str, nargs='+',
+                        help='Channels for each sample of interleaved images (e.g. "red green blue" for RGB), images are split at read time')
 
     parser.add_argument('--voxel_size', type=float,
                         nargs=3, help='Voxel size in x y z')
@@ -302,6 +531,19 @@ def main():
 
     parser.add_argument('--warn_missing_files', action='store_true',
                         help='Warn on missing files instead of failing')
+    parser.add_argument('--block_shape', type=int, nargs=2,
+                        help='x y size of the POSTed blocks (multiples of 512), chosen from the datatype and POST throughput if not set')
+    parser.add_argument('--verify_samples', type=int, default=DEFAULT_VERIFY_SAMPLES,
+                        help='Number of POSTed blocks downloaded and checked after the ingest (0 to skip, default = {})'.format(DEFAULT_VERIFY_SAMPLES))
+
+    parser.add_argument('--status_file', type=str,
+                        help='File the progress is shared in by ingest workers (e.g. one per z range), view it with ndprogress STATUS_FILE')
+    parser.add_argument('--no_progress', action='store_true',
+                        help='Don\'t show the progress bar')
+    parser.add_argument('--profile', type=str, nargs='?', const='ndpush_profile',
+                        help='Profile the ingest: writes PROFILE.txt (wall/CPU time of each stage) and PROFILE.prof (cProfile stats), default prefix ndpush_profile')
+    parser.add_argument('--metrics_port', type=int,
+                        help='Serve the ingest metrics (Prometheus text format) at http://localhost:PORT/metrics during the ingest')
 
     parser.add_argument('--s3_bucket_name', type=str,
                         help='S3 bucket name')
@@ -352,8 +594,26 @@ def main():
     else:
         channels = [args.channel]
 
-    for channel in channels:
-        per_channel_ingest(args, channel)
+    metrics_server = None
+    if args.metrics_port is not None:
+        metrics_server = MetricsServer(INGEST_METRICS.registry, args.metrics_port)
+    profiler = None
+    if args.profile is not None:
+        profiler = Profiler(get_profile_targets(), args.profile).start()
+
+    try:
+        if args.sample_channels is not None:
+            split_channel_ingest(args, args.sample_channels)
+        elif args.parallel_channels > 1 and len(channels) > 1:
+            multi_channel_ingest(args, channels, parallel_channels=args.parallel_channels)
+        else:
+            for channel in channels:
+                per_channel_ingest(args, channel)
+    finally:
+        if metrics_server is not None:
+            metrics_server.stop()
+        if profiler is not None:
+            print(profiler.stop())
 
 
 if __name__ == '__main__':
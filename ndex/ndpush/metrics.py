@@ -0,0 +1,253 @@
+'''
+Metrics of the ingest stages (read, decode, compress, POST), labelled by channel
+Exposed in the Prometheus text format on an optional local HTTP endpoint (/metrics)
+and summarized at the end of each channel's ingest
+'''
+
+import bisect
+import socketserver
+import threading
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+# upper bounds (seconds) of the latency histogram buckets
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def format_labels(labelnames, labelvalues, extra=()):
+    pairs = list(zip(labelnames, labelvalues)) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join('{}="{}"'.format(name, str(value).replace('\\', '\\\\').replace(
+        '"', '\\"').replace('\n', '\\n')) for name, value in pairs) + '}'
+
+
+def format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class ThreadingHTTPServer(socketserver.ThreadingMixIn, HTTPServer):
+    # http.server.ThreadingHTTPServer is only in python 3.7+
+    pass
+
+
+class Metric:
+    def __init__(self, name, documentation, labelnames=('channel',)):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.lock = threading.Lock()
+        self.values = {}
+
+    def get_key(self, labels):
+        return tuple(str(labels.get(name, '')) for name in self.labelnames)
+
+    def render(self):
+        lines = ['# HELP {} {}'.format(self.name, self.documentation),
+                 '# TYPE {} {}'.format(self.name, self.type)]
+        with self.lock:
+            for key in sorted(self.values):
+                lines.extend(self.render_value(key, self.values[key]))
+        return lines
+
+    def render_value(self, key, value):
+        return ['{}{} {}'.format(self.name, format_labels(self.labelnames, key), format_value(value))]
+
+
+class Counter(Metric):
+    type = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self.get_key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def get(self, **labels):
+        with self.lock:
+            return self.values.get(self.get_key(labels), 0)
+
+
+class Gauge(Counter):
+    type = 'gauge'
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def set(self, value, **labels):
+        with self.lock:
+            self.values[self.get_key(labels)] = value
+
+
+class HistogramValue:
+    def __init__(self, num_buckets):
+        self.bucket_counts = [0] * num_buckets
+        self.count = 0
+        self.sum = 0
+        self.max = 0
+
+
+class Histogram(Metric):
+    type = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=('channel',), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets) + (float('inf'),)
+
+    def observe(self, value, **labels):
+        key = self.get_key(labels)
+        with self.lock:
+            hist = self.values.get(key)
+            if hist is None:
+                hist = self.values[key] = HistogramValue(len(self.buckets))
+            hist.bucket_counts[bisect.bisect_left(self.buckets, value)] += 1
+            hist.count += 1
+            hist.sum += value
+            hist.max = max(hist.max, value)
+
+    def get(self, **labels):
+        with self.lock:
+            return self.values.get(self.get_key(labels))
+
+    def quantile(self, q, **labels):
+        # upper bound of the bucket holding the q quantile (the max if it's past the last bucket)
+        hist = self.get(**labels)
+        if hist is None or hist.count == 0:
+            return 0
+        rank = q * hist.count
+        cumulative = 0
+        for bound, count in zip(self.buckets, hist.bucket_counts):
+            cumulative += count
+            if cumulative >= rank:
+                return min(bound, hist.max)
+        return hist.max
+
+    def render_value(self, key, hist):
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets, hist.bucket_counts):
+            cumulative += count
+            lines.append('{}_bucket{} {}'.format(
+                self.name, format_labels(self.labelnames, key, [('le', format_value(bound))]),
+                cumulative))
+        labels = format_labels(self.labelnames, key)
+        lines.append('{}_sum{} {}'.format(self.name, labels, format_value(float(hist.sum))))
+        lines.append('{}_count{} {}'.format(self.name, labels, hist.count))
+        return lines
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self):
+        # Prometheus text exposition format
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+class IngestMetrics:
+    # the metrics of every channel ingested by this process
+    def __init__(self, registry=None):
+        self.registry = MetricsRegistry() if registry is None else registry
+        reg = self.registry.register
+
+        self.read_seconds = reg(Histogram(
+            'ndpush_read_seconds', 'Time to fetch an image (S3 download or render request)'))
+        self.decode_seconds = reg(Histogram(
+            'ndpush_decode_seconds', 'Time to decode an image (includes reading local files)'))
+        self.stack_read_seconds = reg(Histogram(
+            'ndpush_stack_read_seconds', 'Time to read and decode a z stack of images'))
+        self.compress_seconds = reg(Histogram(
+            'ndpush_compress_seconds', 'Time to blosc compress an annotation block'))
+        self.post_seconds = reg(Histogram(
+            'ndpush_post_seconds', 'Time of a successful block POST'))
+
+        self.read_bytes = reg(Counter(
+            'ndpush_read_bytes_total', 'Bytes of decoded image data'))
+        self.post_bytes = reg(Counter(
+            'ndpush_post_bytes_total', 'Uncompressed bytes of the POSTed blocks'))
+        self.post_compressed_bytes = reg(Counter(
+            'ndpush_post_compressed_bytes_total',
+            'Bytes sent in annotation block POSTs (blosc compressed, intern compresses image blocks)'))
+
+        self.posts_in_flight = reg(Gauge(
+            'ndpush_posts_in_flight', 'Block POSTs waiting for a response'))
+        self.blocks_queued = reg(Gauge(
+            'ndpush_blocks_queued', 'Blocks of the z stacks in memory waiting for a POST thread'))
+
+        self.post_retries = reg(Counter(
+            'ndpush_post_retries_total', 'Block POSTs that failed and were retried'))
+        self.post_failures = reg(Counter(
+            'ndpush_post_failures_total', 'Blocks that could not be POSTed'))
+        self.empty_blocks = reg(Counter(
+            'ndpush_empty_blocks_total', 'Blocks skipped because they are all zero'))
+
+    def summary(self, channel):
+        # end of run breakdown of the stages of a channel's ingest
+        lines = ['Ingest metrics for channel {}:'.format(channel),
+                 '  {:<12} {:>8} {:>10} {:>10} {:>10} {:>10} {:>10}'.format(
+                     'stage', 'count', 'total s', 'mean ms', 'p50 ms', 'p99 ms', 'max ms')]
+        for stage, hist in (('read', self.read_seconds), ('decode', self.decode_seconds),
+                            ('stack read', self.stack_read_seconds),
+                            ('compress', self.compress_seconds), ('POST', self.post_seconds)):
+            value = hist.get(channel=channel)
+            if value is None or value.count == 0:
+                continue
+            lines.append('  {:<12} {:>8} {:>10.2f} {:>10.1f} {:>10.1f} {:>10.1f} {:>10.1f}'.format(
+                stage, value.count, value.sum, value.sum / value.count * 1000,
+                hist.quantile(0.5, channel=channel) * 1000,
+                hist.quantile(0.99, channel=channel) * 1000, value.max * 1000))
+        # only annotation blocks are compressed by ndpush
+        compressed_bytes = self.post_compressed_bytes.get(channel=channel)
+        lines.append('  read {:.1f} MB, POSTed {:.1f} MB{}, {} retries, {} failed POSTs, {} empty blocks skipped'.format(
+            self.read_bytes.get(channel=channel) / 1024**2,
+            self.post_bytes.get(channel=channel) / 1024**2,
+            ' ({:.1f} MB compressed)'.format(compressed_bytes / 1024**2) if compressed_bytes else '',
+            self.post_retries.get(channel=channel), self.post_failures.get(channel=channel),
+            self.empty_blocks.get(channel=channel)))
+        return '\n'.join(lines)
+
+
+# shared by all the ingest jobs of the process, so one endpoint serves every channel
+INGEST_METRICS = IngestMetrics()
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split('?')[0] not in ('/', '/metrics'):
+            self.send_error(404)
+            return
+        body = self.server.registry.render().encode()
+        self.send_response(200)
+        self.send_header('Content-Type', CONTENT_TYPE)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class MetricsServer:
+    # serves the registry on http://host:port/metrics from a background thread
+    def __init__(self, registry, port, host='127.0.0.1'):
+        self.server = ThreadingHTTPServer((host, port), MetricsHandler)
+        self.server.daemon_threads = True
+        self.server.registry = registry
+        self.port = self.server.server_address[1]
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.thread.join()
@@ -1,8 +1,18 @@
 import argparse
 import os
+import re
 
 from tqdm import tqdm
 
+from ndex.ndpush.event_log import read_events
+
+# cutout description in a log line, ranges are logged either as tuples or lists:
+# Coll: coll, Exp: exp, Ch: ch, x: (0, 512), y: [0, 512], z: (0, 16)
+CUTOUT_RE = re.compile(r'Coll: (.+?), Exp: (.+?), Ch: (.+?), '
+                       r'x: [(\[](\d+), (\d+)[)\]], '
+                       r'y: [(\[](\d+), (\d+)[)\]], '
+                       r'z: [(\[](\d+), (\d+)[)\]]')
+
 
 def get_nonexistant_path(fname_path):
     """
@@ -26,12 +36,15 @@ def get_nonexistant_path(fname_path):
     return new_fname
 
 
-def search(lines, text):
-    results = []
-    for line in lines:
-        if text in line:
-            results.append(line)
-    return results
+def parse_cutout(line):
+    # returns the cutout text and (coll, exp, ch, x, y, z) with ranges as tuples, or None if there isn't one
+    match = CUTOUT_RE.search(line)
+    if match is None:
+        return None
+    coll, exp, ch = match.group(1, 2, 3)
+    x, y, z = [(int(match.group(idx)), int(match.group(idx + 1)))
+               for idx in (4, 6, 8)]
+    return match.group(0), (coll, exp, ch, x, y, z)
 
 
 def parse_log(logfile, outfile):
@@ -40,24 +53,68 @@ def parse_log(logfile, outfile):
     if os.path.isfile(outfile):
         outfile = get_nonexistant_path(outfile)
 
-    # this just creates and empties the outfile if it already exists
-    with open(outfile, 'w'):
-        pass
-
-    # read the entire thing into memory because we have to search the thing multiple times
+    # single pass through the log, a cutout can succeed after (or before) it failed
+    failed = {}
+    succeeded = set()
     with open(logfile) as f:
-        log_lines = f.readlines()
+        for line in tqdm(f):
+            if 'POST succeeded' in line:
+                parsed = parse_cutout(line)
+                if parsed is not None:
+                    succeeded.add(parsed[1])
+            elif ', skipping' in line:
+                parsed = parse_cutout(line)
+                if parsed is not None:
+                    # keeps the order of the log and drops duplicates
+                    failed.setdefault(parsed[1], parsed[0])
+
+    with open(outfile, 'w') as fo:
+        fo.writelines(cutout + '\n' for key, cutout in failed.items()
+                      if key not in succeeded)
+
+    return outfile
 
-    error_lines = search(log_lines, ', skipping')
-    success_lines = search(log_lines, 'POST succeeded')
 
-    for line in tqdm(error_lines):
-        line_split = line.split(' Coll: ')
-        cutout = 'Coll: {}'.format(line_split[1]).strip('\n')
-        cutout_lines = search(success_lines, cutout)
-        if not cutout_lines:
-            with open(outfile, 'a') as fo:
-                fo.write(cutout + '\n')
+def get_failed_cutouts(eventfile):
+    # (coll, exp, ch, x, y, z) of the POSTs in an event log that failed and never succeeded
+    # and of the blocks that failed verification (unless they were POSTed again afterwards)
+    failed = {}
+    succeeded = set()
+    for event in read_events(eventfile):
+        if event['event'] not in ('post', 'verify'):
+            continue
+        key = (event['coll'], event['exp'], event['ch'],
+               tuple(event['x']), tuple(event['y']), tuple(event['z']))
+        if event['event'] == 'verify':
+            if event['status'] != 'ok':
+                succeeded.discard(key)
+                failed[key] = None
+        elif event['status'] == 'ok':
+            succeeded.add(key)
+            failed.pop(key, None)
+        elif key not in succeeded:
+            failed[key] = None
+    return list(failed)
+
+
+def get_posted_cutouts(eventfile):
+    # (coll, exp, ch, x, y, z) of the POSTs in an event log that succeeded (and weren't failed later)
+    posted = set((event['coll'], event['exp'], event['ch'],
+                  tuple(event['x']), tuple(event['y']), tuple(event['z']))
+                 for event in read_events(eventfile, 'post') if event['status'] == 'ok')
+    return posted - set(get_failed_cutouts(eventfile))
+
+
+def parse_event_log(eventfile, outfile):
+    # same as parse_log, for the structured (.jsonl) event log
+
+    if os.path.isfile(outfile):
+        outfile = get_nonexistant_path(outfile)
+
+    with open(outfile, 'w') as fo:
+        fo.writelines('Coll: {}, Exp: {}, Ch: {}, x: {}, y: {}, z: {}\n'.format(
+            coll, exp, ch, list(x), list(y), list(z))
+            for coll, exp, ch, x, y, z in get_failed_cutouts(eventfile))
 
     return outfile
 
@@ -65,13 +122,16 @@ def parse_log(logfile, outfile):
 def main():
     parser = argparse.ArgumentParser(description='Search log file for errors')
     parser.add_argument('--logfile', type=str,
-                        default='log.txt', help='log file to parse')
+                        default='log.txt', help='log file (or .jsonl event log) to parse')
     parser.add_argument('--outfile', type=str,
                         default='repeat_cutouts.txt', help='log file to parse')
     args = parser.parse_args()
 
     print('Parsing the log file...')
-    parse_log(args.logfile, args.outfile)
+    if args.logfile.endswith('.jsonl'):
+        parse_event_log(args.logfile, args.outfile)
+    else:
+        parse_log(args.logfile, args.outfile)
     print('Parsing log file complete.')
 
 
@@ -0,0 +1,236 @@
+'''
+Progress of an ingest over its blocks: MB/s, blocks/s, ETA, empty and failed blocks
+Updated by all the POST threads of a process, shown as a progress bar
+Worker processes (e.g. one per z range) can share their progress through a status file
+'''
+
+import argparse
+import json
+import os
+import socket
+import threading
+import time
+
+import numpy as np
+from tqdm import tqdm
+
+try:
+    import fcntl
+except ImportError:
+    # not available on Windows, the status file isn't locked there
+    fcntl = None
+
+# seconds between writes of the status file
+STATUS_INTERVAL = 10
+
+# workers that haven't updated the status file for this long are reported as stalled
+STALLED_SECONDS = 600
+
+
+def get_channel_nbytes(ingest_job):
+    # bytes of a channel's ingest (its x/y extent and z range in the Boss datatype)
+    size = [rng[1] - rng[0] for rng in (ingest_job.x_extent, ingest_job.y_extent,
+                                         ingest_job.z_range)]
+    return int(np.prod(size)) * np.dtype(ingest_job.boss_datatype).itemsize
+
+
+class IngestProgress:
+    # name: shown on the bar and in the status file
+    # key: entry in the status file (host:pid:name by default)
+    def __init__(self, name, status_file=None, show_bar=True, key=None,
+                 status_interval=STATUS_INTERVAL):
+        self.name = name
+        self.status_file = status_file
+        self.key = key or '{}:{}:{}'.format(socket.gethostname(), os.getpid(), name)
+        self.status_interval = status_interval
+
+        self.lock = threading.Lock()
+        self.total_bytes = 0
+        self.done_bytes = 0
+        self.blocks = 0
+        self.empty_blocks = 0
+        self.failed_blocks = 0
+        self.start_time = time.time()
+        self.last_write = 0
+        self.workers_msg = None
+
+        self.bar = tqdm(total=0, desc=name, unit='B', unit_scale=True, unit_divisor=1024,
+                        disable=not show_bar)
+
+    def add_total(self, nbytes):
+        # bytes of another channel (or z range) handled by this process
+        with self.lock:
+            self.total_bytes += nbytes
+            self.bar.total = self.total_bytes
+            self.bar.refresh()
+
+    def update(self, nbytes, status='ok'):
+        # a block is done: POSTed (ok), skipped because it's all zero (empty) or not POSTed (failed)
+        with self.lock:
+            self.done_bytes += nbytes
+            self.blocks += 1
+            if status == 'empty':
+                self.empty_blocks += 1
+            elif status == 'failed':
+                self.failed_blocks += 1
+
+            postfix = {'blocks/s': '{:.1f}'.format(self.blocks / max(time.time() - self.start_time, 1e-6)),
+                       'empty': '{:.0%}'.format(self.empty_blocks / self.blocks),
+                       'failed': self.failed_blocks}
+            if self.workers_msg is not None:
+                postfix['all'] = self.workers_msg
+            self.bar.set_postfix(postfix, refresh=False)
+            self.bar.update(nbytes)
+
+            write_status = (self.status_file is not None
+                            and time.time() - self.last_write >= self.status_interval)
+            if write_status:
+                self.last_write = time.time()
+        if write_status:
+            self.write_status()
+
+    def get_status(self, done=False):
+        with self.lock:
+            return {'name': self.name, 'total_bytes': self.total_bytes,
+                    'done_bytes': self.done_bytes, 'blocks': self.blocks,
+                    'empty_blocks': self.empty_blocks, 'failed_blocks': self.failed_blocks,
+                    'start_time': self.start_time, 'updated': time.time(), 'done': done}
+
+    def write_status(self, done=False):
+        # updates this process's entry, the bar shows the progress of all the workers
+        statuses = update_status_file(self.status_file, self.key, self.get_status(done))
+        if len(statuses) > 1:
+            summary = summarize_status(statuses)
+            with self.lock:
+                self.workers_msg = '{:.0%} ETA {}'.format(
+                    summary['fraction'], format_seconds(summary['eta_seconds']))
+
+    def close(self):
+        if self.status_file is not None:
+            self.write_status(done=True)
+        self.bar.close()
+
+
+def lock_file(f):
+    if fcntl is not None:
+        fcntl.flock(f, fcntl.LOCK_EX)
+
+
+def read_status_file(status_file):
+    # entries of the workers, by key
+    try:
+        with open(status_file) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def update_status_file(status_file, key, status):
+    # replaces an entry, locked so the workers don't overwrite each other's entries
+    with open(status_file + '.lock', 'a') as lock:
+        lock_file(lock)
+        statuses = read_status_file(status_file)
+        statuses[key] = status
+        tmp_fname = '{}.{}.tmp'.format(status_file, os.getpid())
+        with open(tmp_fname, 'w') as f:
+            json.dump(statuses, f, indent=1)
+        os.replace(tmp_fname, status_file)
+    return statuses
+
+
+def get_worker_rates(status, now=None):
+    # bytes/s and blocks/s of a worker since it started
+    if now is None:
+        now = time.time()
+    end_time = status['updated'] if status['done'] else now
+    seconds = max(end_time - status['start_time'], 1e-6)
+    return status['done_bytes'] / seconds, status['blocks'] / seconds
+
+
+def summarize_status(statuses, now=None):
+    # totals of the workers, they run in parallel so the ETA is that of the slowest one
+    if now is None:
+        now = time.time()
+    summary = {'workers': len(statuses), 'active': 0, 'stalled': 0, 'total_bytes': 0,
+               'done_bytes': 0, 'blocks': 0, 'empty_blocks': 0, 'failed_blocks': 0,
+               'bytes_per_sec': 0, 'blocks_per_sec': 0, 'eta_seconds': 0}
+    for status in statuses.values():
+        for field in ('total_bytes', 'done_bytes', 'blocks', 'empty_blocks', 'failed_blocks'):
+            summary[field] += status[field]
+        if status['done']:
+            continue
+        if now - status['updated'] > STALLED_SECONDS:
+            summary['stalled'] += 1
+            continue
+        summary['active'] += 1
+        bytes_per_sec, blocks_per_sec = get_worker_rates(status, now)
+        summary['bytes_per_sec'] += bytes_per_sec
+        summary['blocks_per_sec'] += blocks_per_sec
+        remaining = status['total_bytes'] - status['done_bytes']
+        eta = remaining / bytes_per_sec if bytes_per_sec else float('inf')
+        summary['eta_seconds'] = max(summary['eta_seconds'], eta)
+    summary['fraction'] = (summary['done_bytes'] / summary['total_bytes']
+                           if summary['total_bytes'] else 0)
+    return summary
+
+
+def format_seconds(seconds):
+    if seconds == float('inf'):
+        return '?'
+    return tqdm.format_interval(seconds)
+
+
+def format_status(status, now=None):
+    # one line for a worker or a summary
+    bytes_per_sec, blocks_per_sec = (
+        (status['bytes_per_sec'], status['blocks_per_sec']) if 'bytes_per_sec' in status
+        else get_worker_rates(status, now))
+    blocks = max(status['blocks'], 1)
+    return '{:.1%} of {:.1f} GB, {:.1f} MB/s, {:.1f} blocks/s, {:.0%} empty, {} failed'.format(
+        status['done_bytes'] / status['total_bytes'] if status['total_bytes'] else 0,
+        status['total_bytes'] / 1024**3, bytes_per_sec / 1024**2, blocks_per_sec,
+        status['empty_blocks'] / blocks, status['failed_blocks'])
+
+
+def print_status(status_file, now=None):
+    if now is None:
+        now = time.time()
+    statuses = read_status_file(status_file)
+    if not statuses:
+        print('No progress in {}'.format(status_file))
+        return
+    for key, status in sorted(statuses.items()):
+        if status['done']:
+            state = 'done'
+        elif now - status['updated'] > STALLED_SECONDS:
+            state = 'stalled'
+        else:
+            state = 'running'
+        print('{} ({}, {}): {}'.format(status['name'], key, state, format_status(status, now)))
+    summary = summarize_status(statuses, now)
+    print('Total ({} of {} workers running): {}, ETA {}'.format(
+        summary['active'], summary['workers'], format_status(summary),
+        format_seconds(summary['eta_seconds']) if summary['active'] else '-'))
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Show the progress of the ingest workers sharing a status file (ndpush --status_file)')
+    parser.add_argument('status_file', type=str, help='Status file of the ingest workers')
+    parser.add_argument('--watch', type=float,
+                        help='Print the progress every WATCH seconds (until interrupted)')
+    args = parser.parse_args()
+
+    while True:
+        print_status(args.status_file)
+        if args.watch is None:
+            break
+        try:
+            time.sleep(args.watch)
+        except KeyboardInterrupt:
+            break
+        print()
+
+
+if __name__ == '__main__':
+    main()
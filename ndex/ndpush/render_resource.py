@@ -261,27 +261,36 @@ def get_supercubes(rng, stride=512):
     return buckets
 
 
-def benchmark_get_tile(renderObj, step_size):
+def benchmark_get_tile(renderObj, step_size, num_runs=5, window=[0, 10000]):
+    # average time of random step_size x step_size tiles (unscaled box size)
     times = []
-    for z in range(0, 5):
-        x = random.randint(renderObj.x_rng[0], renderObj.x_rng[1] - step_size)
-        y = random.randint(renderObj.y_rng[0], renderObj.y_rng[1] - step_size)
+    for _ in range(num_runs):
+        z = random.randint(renderObj.z_rng[0], renderObj.z_rng[1] - 1)
+        x = random.randint(
+            renderObj.x_rng_unscaled[0], renderObj.x_rng_unscaled[1] - step_size
+        )
+        y = random.randint(
+            renderObj.y_rng_unscaled[0], renderObj.y_rng_unscaled[1] - step_size
+        )
         t0 = time.time()
         data = renderObj.get_render_tile(
-            z, x, y, step_size, step_size, 1, window=[0, 10000]
+            z, x, y, step_size, step_size, window=window
         )
         t1 = time.time()
-        times.append((t1 - t0) / data.size * 10e5)
+        times.append((t1 - t0) / data.size * 1e6)
     tot_time = np.mean(times)
     print("Step {} took average {:.2f} sec / 10e5 pixels.".format(step_size, tot_time))
+    return tot_time
 
 
-def benchmark_get_img(renderObj, threads, num_runs=10):
+def benchmark_get_img(renderObj, threads, num_runs=10, tile_size=8192, window=None):
     times = []
     for _ in range(0, num_runs):
-        z = random.randint(renderObj.z_rng[0], renderObj.z_rng[1])
+        z = random.randint(renderObj.z_rng[0], renderObj.z_rng[1] - 1)
         t0 = time.time()
-        im_array = renderObj.get_render_img(z, scale=1, threads=threads)
+        im_array = renderObj.get_render_img(
+            z, window=window, threads=threads, tile_size=tile_size
+        )
         t1 = time.time()
         times.append((t1 - t0))
     tot_time = np.mean(times)
@@ -290,4 +299,4 @@ def benchmark_get_img(renderObj, threads, num_runs=10):
             threads, tot_time, num_runs, im_array.shape
         )
     )
-
+    return tot_time
@@ -1,13 +1,24 @@
 import argparse
-import re
+import json
+import os
 from argparse import Namespace
+from collections import OrderedDict, defaultdict
+from functools import partial
+from multiprocessing.dummy import Pool as ThreadPool
 
 import numpy as np
 
 from ndex.ndpush.boss_resources import BossResParams
-from ndex.ndpush.ingest_job import IngestJob
+from ndex.ndpush.ingest_job import IngestJob, get_manifest_fname
 from ndex.ndpush.ingest_large_vol import post_cutout
-from ndex.ndpush.parse_log import parse_log
+from ndex.ndpush.parse_log import get_failed_cutouts, parse_cutout, parse_log
+
+# arguments describing where the source images are (the answers to gather_info)
+SOURCE_ARGS = ['datasource', 's3_bucket_name', 'aws_profile', 'boss_config_file',
+               'base_path', 'base_filename', 'extension', 'z_step']
+
+# memory for image stacks kept between retry passes
+DEFAULT_STACK_CACHE_GB = 4
 
 
 class Cutout:
@@ -42,16 +53,45 @@ class ImgData():
         self.y = np.shape(im_array)[1]
         self.x = np.shape(im_array)[2]
 
+    def contains(self, z_rng):
+        return self.z_rng[0] <= z_rng[0] and z_rng[1] <= self.z_rng[1]
 
-def parse_cut_line(c_line):
-    coll = re.search('Coll: (.+?),', c_line).group(1)
-    exp = re.search('Exp: (.+?),', c_line).group(1)
-    ch = re.search('Ch: (.+?),', c_line).group(1)
-    x = list(map(int, re.search('x: \((.+?)\)', c_line).group(1).split(', ')))
-    y = list(map(int, re.search('y: \((.+?)\)', c_line).group(1).split(', ')))
-    z = list(map(int, re.search('z: \((.+?)\)', c_line).group(1).split(', ')))
 
-    return coll, exp, ch, x, y, z
+class StackCache:
+    # least recently used image stacks (ImgData), up to max_bytes in total
+    def __init__(self, max_bytes=DEFAULT_STACK_CACHE_GB * 1024**3):
+        self.max_bytes = max_bytes
+        self.stacks = OrderedDict()
+        self.nbytes = 0
+
+    def get(self, z_rng):
+        # any cached stack covering z_rng
+        for key, imgdata in self.stacks.items():
+            if imgdata.contains(z_rng):
+                self.stacks.move_to_end(key)
+                return imgdata
+        return None
+
+    def contains(self, z_rng):
+        # like get, without making the stack the most recently used
+        return any(imgdata.contains(z_rng) for imgdata in self.stacks.values())
+
+    def put(self, imgdata):
+        key = tuple(imgdata.z_rng)
+        if key in self.stacks:
+            self.nbytes -= self.stacks.pop(key).im_data.nbytes
+        self.stacks[key] = imgdata
+        self.nbytes += imgdata.im_data.nbytes
+
+        # the newest stack is always kept, even when it is over the budget on its own
+        while self.nbytes > self.max_bytes and len(self.stacks) > 1:
+            _, evicted = self.stacks.popitem(last=False)
+            self.nbytes -= evicted.im_data.nbytes
+
+
+def parse_cut_line(c_line):
+    _, (coll, exp, ch, x, y, z) = parse_cutout(c_line)
+    return coll, exp, ch, list(x), list(y), list(z)
 
 
 def gather_info():
@@ -104,7 +144,77 @@ def gather_info():
                      )
 
 
-def ingest_cuts(cutouts, ingest_job, boss_res_params):
+def load_manifest(manifest_file):
+    # arguments saved by ndpush at the start of an ingest
+    with open(manifest_file) as f:
+        return Namespace(**json.load(f))
+
+
+def get_source_args(args, coll, exp, ch, single_channel=True):
+    # source of the images for a channel: a manifest, the command line or (as a last resort) prompts
+    if args.manifest is not None:
+        if single_channel:
+            return load_manifest(args.manifest)
+        # a manifest is the source of one channel, with cutouts of several channels
+        # each of them needs its own
+        manifest_file = get_manifest_fname(coll, exp, ch)
+        if not os.path.isfile(manifest_file):
+            raise ValueError('--manifest is only used for the cutouts of a single channel, '
+                             'manifest {} of channel {} not found'.format(manifest_file, ch))
+        return load_manifest(manifest_file)
+    if args.datasource is not None:
+        return Namespace(warn_missing_files=True,
+                         **{name: getattr(args, name) for name in SOURCE_ARGS})
+    manifest_file = get_manifest_fname(coll, exp, ch)
+    if os.path.isfile(manifest_file):
+        return load_manifest(manifest_file)
+    return gather_info()
+
+
+def group_cutouts(cutouts, stride_z=16):
+    # cutouts grouped by the z supercuboid they start in, in z order
+    groups = defaultdict(list)
+    for cut in cutouts:
+        groups[cut.z[0] // stride_z].append(cut)
+    return [groups[key] for key in sorted(groups)]
+
+
+def post_cut(cut, imgdata, ingest_job, boss_res_params):
+    # created for multithreading
+    cut.send_msg(
+        'Attempting re-ingest of cutout: {}'.format(cut.cutout_string()))
+
+    z_start = cut.z[0] - imgdata.z_rng[0]
+    data = imgdata.im_data[z_start:z_start + cut.z[1] - cut.z[0],
+                           cut.y[0]:cut.y[1], cut.x[0]:cut.x[1]]
+    data = np.asarray(data, order='C')
+    ret_val = post_cutout(boss_res_params, ingest_job, cut.x,
+                          cut.y, cut.z, data, attempts=2)
+    if ret_val == 0:
+        cut.send_msg(
+            'Successful re-ingest of cutout: {}'.format(cut.cutout_string()))
+    else:
+        cut.send_msg(
+            'Error: re-ingest of cutout failed: {}'.format(cut.cutout_string()))
+    return ret_val
+
+
+def plan_retries(cutouts, stride_z=16):
+    # (z_rng, cutouts) reads in z order, supercuboid groups with overlapping z ranges are merged
+    # so no z slice is read twice
+    plan = []
+    for group in group_cutouts(cutouts, stride_z):
+        z_rng = [min(cut.z[0] for cut in group), max(cut.z[1] for cut in group)]
+        if plan and z_rng[0] < plan[-1][0][1]:
+            plan[-1][0][1] = max(plan[-1][0][1], z_rng[1])
+            plan[-1][1].extend(group)
+        else:
+            plan.append((z_rng, group))
+    return plan
+
+
+def ingest_cuts(cutouts, ingest_job, boss_res_params, threads=8, read_threads=4, passes=2,
+                cache=None):
     coll = ingest_job.coll_name
     exp = ingest_job.exp_name
     ch = ingest_job.ch_name
@@ -113,31 +223,33 @@ def ingest_cuts(cutouts, ingest_job, boss_res_params):
                            ingest_job.y_extent[1],
                            ingest_job.z_extent[1]]
 
-    # sort by z, y, x...
-    cutouts.sort(key=lambda c: (c.z, c.y, c.x))
-
-    imgdata = None
-    for cut in cutouts:
-        cut.send_msg(
-            'Attempting re-ingest of cutout: {}'.format(cut.cutout_string()))
-
-        # if the data is not in the previous data (same z slice)
-        # load the data
-        if imgdata is None or imgdata.z_rng != cut.z:
-            z_slices = range(cut.z[0], cut.z[1])
-            im_array = ingest_job.read_img_stack(z_slices)
-            imgdata = ImgData(im_array, cut.z)
-
-        data = imgdata.im_data[:, cut.y[0]:cut.y[1], cut.x[0]:cut.x[1]]
-        data = np.asarray(data, order='C')
-        ret_val = post_cutout(boss_res_params, ingest_job, cut.x,
-                              cut.y, cut.z, data, attempts=2)
-        if ret_val == 0:
-            cut.send_msg(
-                'Successful re-ingest of cutout: {}'.format(cut.cutout_string()))
-        else:
-            cut.send_msg(
-                'Error: re-ingest of cutout failed: {}'.format(cut.cutout_string()))
+    # stacks are kept for the cutouts that fail again and are retried in the next pass
+    if cache is None:
+        cache = StackCache()
+
+    remaining = cutouts
+    with ThreadPool(threads) as pool:
+        for _ in range(passes):
+            failed = []
+            # each stack of images is read once and all of its cutouts are POSTed together
+            # stacks still cached from the previous pass go first, before reads evict them
+            plan = plan_retries(remaining)
+            plan.sort(key=lambda item: not cache.contains(item[0]))
+            for z_rng, group in plan:
+                imgdata = cache.get(z_rng)
+                if imgdata is None:
+                    im_array = ingest_job.read_img_stack(range(*z_rng), threads=read_threads)
+                    imgdata = ImgData(im_array, z_rng)
+                    cache.put(imgdata)
+
+                post_cut_partial = partial(post_cut, imgdata=imgdata, ingest_job=ingest_job,
+                                           boss_res_params=boss_res_params)
+                ret_vals = pool.map(post_cut_partial, group)
+                failed.extend(cut for cut, ret_val in zip(group, ret_vals) if ret_val != 0)
+
+            remaining = failed
+            if not remaining:
+                break
 
     cutouts[-1].send_msg('Finished cutouts for collection {}, experiment {}, channel {}'.format(
         coll, exp, ch))
@@ -158,7 +270,20 @@ def get_cutouts(repeatfile):
     return cutouts
 
 
-def iterate_posting_cutouts(cutouts):
+def get_event_cutouts(eventfile):
+    # cutouts straight from the typed fields of an event log (no text parsing)
+    return [Cutout(coll, exp, ch, list(x), list(y), list(z))
+            for coll, exp, ch, x, y, z in get_failed_cutouts(eventfile)]
+
+
+def iterate_posting_cutouts(cutouts, args=None):
+    if args is None:
+        # no source given, ask for it
+        args = Namespace(manifest=None, datasource=None, threads=8, read_threads=4, passes=2,
+                         stack_cache_gb=DEFAULT_STACK_CACHE_GB)
+
+    single_channel = len(set((cu.collection, cu.experiment, cu.channel) for cu in cutouts)) == 1
+
     # separate the cutouts into groupings of shared collections/experiments/channels
     collections = set([cu.collection for cu in cutouts])
     for coll in collections:
@@ -175,18 +300,25 @@ def iterate_posting_cutouts(cutouts):
                         coll, exp, ch)
                     cus_ch[-1].send_msg(msg)
 
-                    args = gather_info()
-                    args.collection = coll
-                    args.experiment = exp
-                    args.channel = ch
-                    args.get_extents = True
+                    source_args = get_source_args(args, coll, exp, ch, single_channel)
+                    source_args.collection = coll
+                    source_args.experiment = exp
+                    source_args.channel = ch
+                    source_args.get_extents = True
+                    source_args.create_resources = False
 
-                    ingest_job = IngestJob(args)
+                    ingest_job = IngestJob(source_args)
                     # we get these things from the resources that already exist on the boss:
                     boss_res_params = BossResParams(ingest_job)
                     boss_res_params.get_resources(get_only=True)
 
-                    ingest_cuts(cus_ch, ingest_job, boss_res_params)
+                    cache = StackCache(args.stack_cache_gb * 1024**3)
+                    ingest_cuts(cus_ch, ingest_job, boss_res_params,
+                                threads=args.threads, read_threads=args.read_threads,
+                                passes=args.passes, cache=cache)
+
+                    if ingest_job.slack_notifier is not None:
+                        ingest_job.slack_notifier.close()
 
 
 def main():
@@ -194,16 +326,49 @@ def main():
         description='Search log file for errors and post the data to the boss')
     parser.add_argument('--logfile', type=str,
                         default=None, help='log file to parse')
+    parser.add_argument('--eventlog', type=str,
+                        default=None, help='structured (.jsonl) event log to get the failed cutouts from')
     parser.add_argument('--repeatfile', type=str,
                         default='repeat_cutouts.txt', help='log file to parse')
-    args = parser.parse_args()
 
-    if args.logfile is not None:
-        args.repeatfile = parse_log(args.logfile, args.repeatfile)
+    # source of the images, without these the manifest saved by ndpush is used (or you are prompted)
+    parser.add_argument('--manifest', type=str,
+                        help='Job manifest (ingest_manifest_*.json) saved by ndpush, '
+                        'for the cutouts of a single channel')
+    parser.add_argument('--datasource', type=str,
+                        help='Location of files, either "local" or "s3"')
+    parser.add_argument('--s3_bucket_name', type=str,
+                        help='S3 bucket name')
+    parser.add_argument('--aws_profile', type=str, default='default',
+                        help='Name of profile in .aws/credentials file (default = default)')
+    parser.add_argument('--boss_config_file', type=str, default='neurodata.cfg',
+                        help='Path and filename for Boss config (config file w/ server and API Key)')
+    parser.add_argument('--base_path', type=str,
+                        help='Directory where image stacks are located (e.g. "/data/images/"')
+    parser.add_argument('--base_filename', type=str,
+                        help='Base filename with z values specified "ch1_<>" or w/ leading zeros "ch1_<p:4>"')
+    parser.add_argument('--extension', type=str, help='Extension (tif(f)/png)')
+    parser.add_argument('--z_step', type=int, default=1,
+                        help='Z step size for input files, default 1')
+
+    parser.add_argument('--threads', type=int, default=8,
+                        help='Number of cutouts POSTed at the same time')
+    parser.add_argument('--read_threads', type=int, default=4,
+                        help='Number of images read at the same time')
+    parser.add_argument('--passes', type=int, default=2,
+                        help='Number of passes over the cutouts (cutouts failing again are retried in the next pass)')
+    parser.add_argument('--stack_cache_gb', type=float, default=DEFAULT_STACK_CACHE_GB,
+                        help='Memory (GB) for image stacks kept between passes')
+    args = parser.parse_args()
 
-    cutouts = get_cutouts(args.repeatfile)
+    if args.eventlog is not None:
+        cutouts = get_event_cutouts(args.eventlog)
+    else:
+        if args.logfile is not None:
+            args.repeatfile = parse_log(args.logfile, args.repeatfile)
+        cutouts = get_cutouts(args.repeatfile)
 
-    iterate_posting_cutouts(cutouts)
+    iterate_posting_cutouts(cutouts, args)
 
     print('Finished all failed cutouts, check logs for errors')
 
@@ -0,0 +1,108 @@
+'''
+Sends Slack messages for an ingest job from a background thread
+Messages arriving close together are coalesced into one post, posts are rate limited
+and the log tail uploads are capped per minute, so a Slack outage never stalls ingest threads
+'''
+
+import atexit
+import queue
+import threading
+import time
+from datetime import datetime
+
+import tailer
+
+
+class SlackNotifier:
+    def __init__(self, slack_obj, slack_usr, logfile, coalesce_interval=5, min_post_interval=1,
+                 max_uploads_per_min=2, max_msgs_per_post=20, username='local_ingest.py'):
+        self.slack_obj = slack_obj
+        self.slack_usr = slack_usr
+        self.logfile = logfile
+        self.coalesce_interval = coalesce_interval
+        self.min_post_interval = min_post_interval
+        self.max_uploads_per_min = max_uploads_per_min
+        self.max_msgs_per_post = max_msgs_per_post
+        self.username = username
+
+        self.last_post = 0
+        self.upload_times = []
+
+        self.closed = False
+        self.queue = queue.Queue()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+        # deliver anything still queued when python exits, without hanging on a dead Slack
+        # (until close, which unregisters it so closed notifiers aren't kept alive)
+        atexit.register(self.close, timeout=30)
+
+    def send(self, msg):
+        # returns immediately, the message is posted by the background thread
+        if self.closed or not self.thread.is_alive():
+            print('Slack message not sent, notifier is closed: {}'.format(msg))
+            return
+        self.queue.put(msg)
+
+    def close(self, timeout=None):
+        if self.closed:
+            return
+        self.closed = True
+        atexit.unregister(self.close)
+        if self.thread.is_alive():
+            self.queue.put(None)
+            self.thread.join(timeout)
+
+    def run(self):
+        closing = False
+        while not closing:
+            msg = self.queue.get()
+            if msg is None:
+                break
+
+            # collect whatever else arrives within the coalesce interval
+            msgs = [msg]
+            deadline = time.time() + self.coalesce_interval
+            while True:
+                try:
+                    msg = self.queue.get(timeout=max(0, deadline - time.time()))
+                except queue.Empty:
+                    break
+                if msg is None:
+                    closing = True
+                    break
+                msgs.append(msg)
+
+            self.deliver(msgs)
+
+    def deliver(self, msgs):
+        wait = self.last_post + self.min_post_interval - time.time()
+        if wait > 0:
+            time.sleep(wait)
+
+        text = '\n'.join(msgs[:self.max_msgs_per_post])
+        if len(msgs) > self.max_msgs_per_post:
+            text += '\n... and {} more messages (see {})'.format(
+                len(msgs) - self.max_msgs_per_post, self.logfile)
+
+        try:
+            self.slack_obj.chat.post_message(
+                '@' + self.slack_usr, text, username=self.username)
+        except Exception as e:
+            print('Slack message not sent: {}'.format(e))
+        self.last_post = time.time()
+
+        # only a limited number of log tails are uploaded per minute
+        now = time.time()
+        self.upload_times = [t for t in self.upload_times if now - t < 60]
+        if len(self.upload_times) >= self.max_uploads_per_min:
+            return
+        self.upload_times.append(now)
+
+        try:
+            with open(self.logfile) as f:
+                content = tailer.tail(f, 10)
+            self.slack_obj.files.upload(content='\n'.join(content), channels='@' + self.slack_usr,
+                                        title=datetime.now().strftime("%Y-%m-%d %H:%M:%S") + '_tail_of_log')
+        except Exception as e:
+            print('Slack log upload failed: {}'.format(e))
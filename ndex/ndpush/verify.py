@@ -0,0 +1,206 @@
+'''
+Verifies an ingest from the hashes of the POSTed blocks
+A sample of the blocks in an event log is downloaded from the Boss in parallel and hashed
+Mismatches are recorded in the event log and the repeat cutouts file
+'''
+
+import argparse
+import hashlib
+import random
+from multiprocessing.dummy import Pool as ThreadPool
+
+import numpy as np
+
+from ndex.common import get_boss_config
+from ndex.ndpull.boss_resources import BossMeta, BossRemote
+from ndex.ndpush.event_log import EventLog, read_events
+
+try:
+    import xxhash
+except ImportError:
+    xxhash = None
+
+# number of blocks checked after an ingest
+DEFAULT_VERIFY_SAMPLES = 64
+
+# about this many times the number of samples are hashed during an ingest
+# (more than the sample, as empty blocks aren't POSTed and some POSTs fail)
+HASH_OVERSAMPLE = 4
+
+CUTOUT_MSG = 'Coll: {}, Exp: {}, Ch: {}, x: {}, y: {}, z: {}'
+
+
+def get_hash_name():
+    # xxhash is much faster, blake2b is only in python 3.6+
+    if xxhash is not None:
+        return 'xxh64'
+    return 'blake2b' if hasattr(hashlib, 'blake2b') else 'sha256'
+
+
+def get_hash_probability(block_nbytes, total_nbytes, num_samples):
+    # chance of hashing a POSTed block, so about HASH_OVERSAMPLE * num_samples blocks of a channel
+    # (total_nbytes) are hashed whatever the shape of the blocks
+    if not num_samples or not total_nbytes:
+        return 0
+    return min(1.0, HASH_OVERSAMPLE * num_samples * block_nbytes / total_nbytes)
+
+
+def block_hash(data, datatype, hash_name=None):
+    # hash ("name:hexdigest") of a zyx block as it's stored in the Boss (C order, datatype)
+    if hash_name is None:
+        hash_name = get_hash_name()
+    block = np.ascontiguousarray(data, dtype=datatype)
+    if hash_name == 'xxh64':
+        digest = xxhash.xxh64(block).hexdigest()
+    elif hash_name == 'blake2b':
+        digest = hashlib.blake2b(block, digest_size=16).hexdigest()
+    elif hash_name == 'sha256':
+        digest = hashlib.sha256(block).hexdigest()
+    else:
+        raise ValueError('Unknown hash: {}'.format(hash_name))
+    return '{}:{}'.format(hash_name, digest)
+
+
+def get_posted_blocks(eventfile):
+    # latest successful POST (with a hash) of each block in the event log
+    blocks = {}
+    for event in read_events(eventfile, 'post'):
+        if event['status'] == 'ok' and event.get('hash'):
+            key = (event['coll'], event['exp'], event['ch'],
+                   tuple(event['x']), tuple(event['y']), tuple(event['z']))
+            blocks[key] = event['hash']
+    return blocks
+
+
+def sample_blocks(blocks, num_samples, seed=None):
+    # random (block key, hash) pairs, all of them if there are fewer than num_samples
+    keys = sorted(blocks)
+    if num_samples < len(keys):
+        keys = random.Random(seed).sample(keys, num_samples)
+    return [(key, blocks[key]) for key in keys]
+
+
+def verify_block(block, fetch, datatype):
+    # True if the block in the Boss has the hash recorded at POST time
+    (_, _, _, x_rng, y_rng, z_rng), expected = block
+    data = fetch(list(x_rng), list(y_rng), list(z_rng))
+    return block_hash(data, datatype, expected.split(':')[0]) == expected
+
+
+def verify_blocks(blocks, fetch, datatype, threads=8):
+    # fetch(x_rng, y_rng, z_rng) returns the zyx data in the Boss
+    # returns a list of (block key, status), status is 'ok', 'mismatch' or 'error'
+    def check(block):
+        try:
+            return 'ok' if verify_block(block, fetch, datatype) else 'mismatch'
+        except Exception as e:
+            print('Verification of {} failed: {}'.format(block[0], e))
+            return 'error'
+
+    with ThreadPool(threads) as pool:
+        statuses = pool.map(check, blocks)
+    return [(key, status) for (key, _), status in zip(blocks, statuses)]
+
+
+def verify_channel(ingest_job, fetch, num_samples=DEFAULT_VERIFY_SAMPLES, threads=8):
+    # checks a sample of the blocks POSTed by an ingest job, returns True if they all match
+    # fetch(x_rng, y_rng, z_rng) reads a block back from the Boss (ingest_large_vol.read_region)
+    ingest_job.event_log.flush()
+    blocks = sample_blocks(get_posted_blocks(ingest_job.event_log.fname), num_samples)
+    if not blocks:
+        ingest_job.send_msg('No POSTed blocks with hashes to verify in {}'.format(
+            ingest_job.event_log.fname), send_slack=True)
+        return True
+    ingest_job.send_msg('Verifying {} POSTed blocks'.format(len(blocks)))
+
+    results = verify_blocks(blocks, fetch, ingest_job.boss_datatype, threads=threads)
+
+    num_failed = 0
+    for (coll, exp, ch, x_rng, y_rng, z_rng), status in results:
+        ingest_job.record_event('verify', x_rng, y_rng, z_rng, status=status)
+        if status != 'ok':
+            num_failed += 1
+            ingest_job.send_msg('Block {} in Boss: {}'.format(
+                CUTOUT_MSG.format(coll, exp, ch, list(x_rng), list(y_rng), list(z_rng)), status))
+    ingest_job.event_log.flush()
+
+    if num_failed:
+        ingest_job.send_msg('{} of {} verified blocks do *NOT* match the source, re-POST them with repeat_cutouts --eventlog {}'.format(
+            num_failed, len(results), ingest_job.event_log.fname), send_slack=True)
+        return False
+    ingest_job.send_msg('All {} verified blocks match the source'.format(len(results)))
+    return True
+
+
+def verify_event_log(eventfile, boss_config_file=None, res=0, num_samples=DEFAULT_VERIFY_SAMPLES,
+                     threads=8, repeatfile=None, seed=None):
+    # standalone verification (ndverify), returns the keys of the blocks that failed
+    # raises a ValueError if there are no blocks to verify, so it isn't taken for a pass
+    blocks = sample_blocks(get_posted_blocks(eventfile), num_samples, seed=seed)
+    if not blocks:
+        raise ValueError('No POSTed blocks with hashes in {} (was the ingest run with '
+                         '--verify_samples 0?)'.format(eventfile))
+
+    token, boss_url = get_boss_config(boss_config_file)
+    event_log = EventLog(eventfile)
+
+    failed = []
+    channels = sorted(set(key[:3] for key, _ in blocks))
+    for coll, exp, ch in channels:
+        rmt = BossRemote(boss_url, token, BossMeta(coll, exp, ch, res))
+        datatype = rmt.boss_ch_metadata['datatype']
+
+        def fetch(x_rng, y_rng, z_rng):
+            return rmt.cutout(x_rng, y_rng, z_rng, datatype)
+
+        ch_blocks = [block for block in blocks if block[0][:3] == (coll, exp, ch)]
+        for key, status in verify_blocks(ch_blocks, fetch, datatype, threads=threads):
+            _, _, _, x_rng, y_rng, z_rng = key
+            event_log.record('verify', coll=coll, exp=exp, ch=ch,
+                             x=list(x_rng), y=list(y_rng), z=list(z_rng), status=status)
+            if status != 'ok':
+                failed.append(key)
+    event_log.flush()
+
+    # failed blocks are added to the repeat cutouts file
+    if repeatfile is not None and failed:
+        with open(repeatfile, 'a') as f:
+            f.writelines(CUTOUT_MSG.format(coll, exp, ch, list(x), list(y), list(z)) + '\n'
+                         for coll, exp, ch, x, y, z in failed)
+
+    print('{} of {} blocks verified, {} failed'.format(
+        len(blocks) - len(failed), len(blocks), len(failed)))
+    return failed
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Verify an ingest by comparing hashes of a sample of the POSTed blocks with the Boss')
+    parser.add_argument('eventlog', type=str,
+                        help='Event log (ingest_events_*.jsonl) of the ingest')
+    parser.add_argument('--config_file', type=str,
+                        help='Path and filename for Boss config (config file w/ server and API Key)')
+    parser.add_argument('--res', type=int, default=0,
+                        help='Resolution the blocks were POSTed to (default = 0)')
+    parser.add_argument('--samples', type=int, default=DEFAULT_VERIFY_SAMPLES,
+                        help='Number of blocks to check (default = {})'.format(DEFAULT_VERIFY_SAMPLES))
+    parser.add_argument('--threads', type=int, default=8,
+                        help='Number of blocks downloaded at the same time')
+    parser.add_argument('--repeatfile', type=str, default='repeat_cutouts.txt',
+                        help='File the failed blocks are added to (input for repeat_cutouts)')
+    parser.add_argument('--seed', type=int,
+                        help='Seed for choosing the sample of blocks')
+    args = parser.parse_args()
+
+    try:
+        failed = verify_event_log(args.eventlog, args.config_file, res=args.res,
+                                  num_samples=args.samples, threads=args.threads,
+                                  repeatfile=args.repeatfile, seed=args.seed)
+    except ValueError as e:
+        raise SystemExit('Error: {}'.format(e))
+    if failed:
+        raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,221 @@
+'''
+Chunked volumes (zyx) as ingest sources, read a z stack at a time instead of slice by slice
+Zarr stacks are split on the source chunks and the chunks are read and decoded in parallel
+Zarr (v2) arrays are read with the zarr package if it's installed, otherwise blosc or
+uncompressed arrays are read directly
+HDF5 datasets (h5py) are read a stack at a time as a single hyperslab, through a chunk cache
+'''
+
+import json
+import os
+from abc import ABC, abstractmethod
+from multiprocessing.dummy import Pool as ThreadPool
+
+import blosc
+import numpy as np
+
+try:
+    import zarr
+except ImportError:
+    zarr = None
+
+try:
+    import h5py
+except ImportError:
+    h5py = None
+
+# number of chunks read at the same time
+DEFAULT_READ_THREADS = 8
+
+# slots in the HDF5 chunk cache per chunk that fits in it (HDF5 suggests ~100, a prime number of slots)
+H5_CACHE_SLOTS_PER_CHUNK = 100
+H5_MAX_CACHE_SLOTS = 10**6
+
+# the default chunk cache (a layer of chunks) is at most this size (or a chunk, if that's bigger)
+H5_MAX_DEFAULT_CACHE_MB = 1024
+
+
+def get_chunk_ranges(rng, chunk):
+    # splits rng on the chunk boundaries: (chunk index, [start, stop]) pairs
+    ranges = []
+    start = rng[0]
+    while start < rng[1]:
+        stop = min((start // chunk + 1) * chunk, rng[1])
+        ranges.append((start // chunk, [start, stop]))
+        start = stop
+    return ranges
+
+
+def next_prime(n):
+    # smallest prime >= n
+    n = max(n, 2)
+    while any(n % i == 0 for i in range(2, int(n**0.5) + 1)):
+        n += 1
+    return n
+
+
+class VolumeSource(ABC):
+    # a zyx volume with shape, chunks and dtype, subclasses read regions of it
+    def __init__(self, path, threads=DEFAULT_READ_THREADS):
+        self.path = path
+        self.threads = threads
+        self.shape = None
+        self.chunks = None
+        self.dtype = None
+
+    def get_img_info(self):
+        # width, height and datatype of the slices
+        return self.shape[2], self.shape[1], self.dtype
+
+    def check_region(self, z_rng, y_rng, x_rng):
+        if not all(0 <= rng[0] < rng[1] <= size
+                   for rng, size in zip((z_rng, y_rng, x_rng), self.shape)):
+            raise ValueError('Region {} (zyx) is outside of {} with shape {}'.format(
+                [z_rng, y_rng, x_rng], self.path, self.shape))
+
+    @abstractmethod
+    def read(self, z_rng, y_rng, x_rng):
+        # zyx data of a region
+        pass
+
+    def close(self):
+        # releases open files, the source isn't read after this
+        pass
+
+
+class ChunkedSource(VolumeSource):
+    # a volume read chunk by chunk, subclasses read the part of a chunk in a region
+    @abstractmethod
+    def read_chunk_region(self, chunk_index, z_rng, y_rng, x_rng):
+        pass
+
+    def read(self, z_rng, y_rng, x_rng):
+        # zyx data of a region, the parts of each chunk in it are read in parallel
+        self.check_region(z_rng, y_rng, x_rng)
+        data = np.empty((z_rng[1] - z_rng[0], y_rng[1] - y_rng[0], x_rng[1] - x_rng[0]),
+                        dtype=self.dtype)
+        pieces = [((iz, iy, ix), rz, ry, rx)
+                  for iz, rz in get_chunk_ranges(z_rng, self.chunks[0])
+                  for iy, ry in get_chunk_ranges(y_rng, self.chunks[1])
+                  for ix, rx in get_chunk_ranges(x_rng, self.chunks[2])]
+
+        def read_piece(piece):
+            chunk_index, rz, ry, rx = piece
+            data[rz[0] - z_rng[0]:rz[1] - z_rng[0], ry[0] - y_rng[0]:ry[1] - y_rng[0],
+                 rx[0] - x_rng[0]:rx[1] - x_rng[0]] = self.read_chunk_region(
+                     chunk_index, rz, ry, rx)
+
+        if self.threads > 1 and len(pieces) > 1:
+            with ThreadPool(min(self.threads, len(pieces))) as pool:
+                pool.map(read_piece, pieces)
+        else:
+            for piece in pieces:
+                read_piece(piece)
+        return data
+
+
+class ZarrSource(ChunkedSource):
+    # path is the directory of a Zarr (v2) array
+    def __init__(self, path, threads=DEFAULT_READ_THREADS):
+        super().__init__(path, threads)
+        try:
+            with open(os.path.join(path, '.zarray')) as f:
+                meta = json.load(f)
+        except OSError:
+            raise ValueError('No Zarr array at {}'.format(path))
+        if len(meta['shape']) != 3:
+            raise ValueError('Zarr array {} has {} dimensions, expected 3 (zyx)'.format(
+                path, len(meta['shape'])))
+
+        self.shape = meta['shape']
+        self.chunks = meta['chunks']
+        self.dtype = np.dtype(meta['dtype'])
+        self.fill_value = meta.get('fill_value') or 0
+        self.separator = meta.get('dimension_separator', '.')
+
+        self.array = None
+        if zarr is not None:
+            self.array = zarr.open(path, mode='r')
+        else:
+            compressor = meta.get('compressor')
+            if (compressor not in (None, {}) and compressor.get('id') != 'blosc') or \
+                    meta.get('filters') or meta.get('order', 'C') != 'C':
+                raise ValueError('Zarr array {} (compressor {}, filters {}, order {}) needs the zarr package: pip install zarr'.format(
+                    path, compressor, meta.get('filters'), meta.get('order')))
+            self.compressed = compressor is not None
+
+    def read_chunk(self, chunk_index):
+        # the full chunk, filled with the fill value if it was never written
+        fname = os.path.join(self.path, self.separator.join(str(i) for i in chunk_index))
+        try:
+            with open(fname, 'rb') as f:
+                buffer = f.read()
+        except OSError:
+            return np.full(self.chunks, self.fill_value, dtype=self.dtype)
+        if self.compressed:
+            buffer = blosc.decompress(buffer)
+        return np.frombuffer(buffer, dtype=self.dtype).reshape(self.chunks)
+
+    def read_chunk_region(self, chunk_index, z_rng, y_rng, x_rng):
+        if self.array is not None:
+            return self.array[z_rng[0]:z_rng[1], y_rng[0]:y_rng[1], x_rng[0]:x_rng[1]]
+        starts = [i * chunk for i, chunk in zip(chunk_index, self.chunks)]
+        return self.read_chunk(chunk_index)[tuple(
+            slice(rng[0] - start, rng[1] - start)
+            for rng, start in zip((z_rng, y_rng, x_rng), starts))]
+
+
+class HDF5Source(VolumeSource):
+    # dataset (zyx) in the HDF5 file at path
+    # cache_mb: size of the chunk cache, by default a layer of chunks (all of y and x) fits in it,
+    # so chunks spanning two z stacks are decompressed once (up to H5_MAX_DEFAULT_CACHE_MB)
+    def __init__(self, path, dataset, cache_mb=None):
+        # h5py serializes the reads, so each region is read with a single call
+        super().__init__(path, threads=1)
+        if h5py is None:
+            raise ValueError('HDF5 file {} needs the h5py package: pip install h5py'.format(path))
+        self.dataset_name = dataset
+
+        try:
+            with h5py.File(path, 'r') as f:
+                if dataset not in f or not isinstance(f[dataset], h5py.Dataset):
+                    names = []
+                    f.visititems(lambda name, obj: names.append(name)
+                                 if isinstance(obj, h5py.Dataset) else None)
+                    raise ValueError('No dataset {} in {} (datasets: {})'.format(
+                        dataset, path, ', '.join(names)))
+                dset = f[dataset]
+                self.shape = list(dset.shape)
+                # contiguous datasets are a single chunk
+                self.chunks = list(dset.chunks or dset.shape)
+                self.dtype = dset.dtype
+        except OSError as e:
+            raise ValueError('Unable to open HDF5 file {}: {}'.format(path, e))
+        if len(self.shape) != 3:
+            raise ValueError('Dataset {} in {} has {} dimensions, expected 3 (zyx)'.format(
+                dataset, path, len(self.shape)))
+
+        chunk_nbytes = int(np.prod(self.chunks)) * self.dtype.itemsize
+        if cache_mb is None:
+            layer_chunks = -(-self.shape[1] // self.chunks[1]) * -(-self.shape[2] // self.chunks[2])
+            self.cache_nbytes = min(layer_chunks * chunk_nbytes,
+                                    max(H5_MAX_DEFAULT_CACHE_MB * 1024**2, chunk_nbytes))
+        else:
+            self.cache_nbytes = int(cache_mb * 1024**2)
+        nslots = next_prime(min(max(self.cache_nbytes // chunk_nbytes, 1) * H5_CACHE_SLOTS_PER_CHUNK,
+                                H5_MAX_CACHE_SLOTS))
+
+        self.file = h5py.File(path, 'r', rdcc_nbytes=self.cache_nbytes, rdcc_nslots=nslots)
+        self.dataset = self.file[dataset]
+
+    def read(self, z_rng, y_rng, x_rng):
+        # a single hyperslab, HDF5 reads the chunks under it in their storage order
+        self.check_region(z_rng, y_rng, x_rng)
+        data = np.empty((z_rng[1] - z_rng[0], y_rng[1] - y_rng[0], x_rng[1] - x_rng[0]),
+                        dtype=self.dtype)
+        self.dataset.read_direct(data, np.s_[z_rng[0]:z_rng[1], y_rng[0]:y_rng[1],
+                                             x_rng[0]:x_rng[1]])
+        return data
+
+    def close(self):
+        self.file.close()
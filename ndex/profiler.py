@@ -0,0 +1,139 @@
+'''
+Opt-in profiling of the ingest (ndpush) and pull (ndpull) hot paths (--profile)
+Wraps the functions of each stage to time them (wall and CPU time of the calling thread)
+and profiles the threads running them with cProfile, written as PREFIX.prof and PREFIX.txt
+'''
+
+import cProfile
+import functools
+import pstats
+import threading
+import time
+
+# CPU time of the calling thread is python 3.7+, before that it's the CPU time of the process
+thread_time = getattr(time, 'thread_time', time.process_time)
+
+
+class FunctionStats:
+    def __init__(self):
+        self.calls = 0
+        self.wall = 0
+        self.cpu = 0
+        self.max_wall = 0
+
+
+class Profiler:
+    # targets: (module or class, function name) pairs to wrap
+    # output_prefix: PREFIX.prof (cProfile stats of all the threads) and PREFIX.txt (breakdown)
+    def __init__(self, targets, output_prefix, use_cprofile=True):
+        self.targets = targets
+        self.output_prefix = output_prefix
+        self.use_cprofile = use_cprofile
+
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.stats = {}
+        self.profiles = []
+        self.patched = []
+
+        self.start_time = None
+        self.start_cpu = None
+        self.report = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def enter(self):
+        # the outermost profiled call of a thread enables its profiler
+        depth = getattr(self.local, 'depth', 0)
+        if depth == 0 and self.use_cprofile:
+            profile = getattr(self.local, 'profile', None)
+            if profile is None:
+                profile = self.local.profile = cProfile.Profile()
+                with self.lock:
+                    self.profiles.append(profile)
+            try:
+                profile.enable()
+                self.local.enabled = True
+            except ValueError:
+                # python 3.12+ allows one active profiler per process, it's the main thread's
+                # (and sees the calls of all the threads)
+                self.local.enabled = False
+        self.local.depth = depth + 1
+
+    def exit(self):
+        self.local.depth -= 1
+        if self.local.depth == 0 and getattr(self.local, 'enabled', False):
+            self.local.profile.disable()
+
+    def record(self, name, wall, cpu):
+        with self.lock:
+            stats = self.stats.get(name)
+            if stats is None:
+                stats = self.stats[name] = FunctionStats()
+            stats.calls += 1
+            stats.wall += wall
+            stats.cpu += cpu
+            stats.max_wall = max(stats.max_wall, wall)
+
+    def wrap(self, owner, name):
+        func = getattr(owner, name)
+        label = '{}.{}'.format(owner.__name__.split('.')[-1], name)
+
+        @functools.wraps(func)
+        def profiled(*args, **kwargs):
+            self.enter()
+            start_wall, start_cpu = time.perf_counter(), thread_time()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self.record(label, time.perf_counter() - start_wall,
+                            thread_time() - start_cpu)
+                self.exit()
+        setattr(owner, name, profiled)
+        self.patched.append((owner, name, func))
+
+    def start(self):
+        for owner, name in self.targets:
+            self.wrap(owner, name)
+        self.start_time = time.perf_counter()
+        self.start_cpu = time.process_time()
+        # the calling (main) thread is profiled for the whole run
+        self.enter()
+        return self
+
+    def stop(self):
+        self.exit()
+        elapsed = time.perf_counter() - self.start_time
+        process_cpu = time.process_time() - self.start_cpu
+        for owner, name, func in reversed(self.patched):
+            setattr(owner, name, func)
+        self.patched = []
+
+        self.report = format_report(self.stats, elapsed, process_cpu)
+        with open(self.output_prefix + '.txt', 'w') as f:
+            f.write(self.report + '\n')
+        profiles = [profile for profile in self.profiles if profile.getstats()]
+        if profiles:
+            pstats.Stats(*profiles).dump_stats(self.output_prefix + '.prof')
+        return self.report
+
+
+def format_report(stats, elapsed, process_cpu):
+    # times are inclusive (e.g. ingest_block includes post_cutout) and summed over the threads
+    # wall time a thread spends off the CPU is waiting: on the network or disk, or for the GIL
+    lines = ['{:<32} {:>8} {:>10} {:>10} {:>6} {:>10} {:>10}'.format(
+        'function', 'calls', 'wall s', 'cpu s', 'cpu %', 'mean ms', 'max ms')]
+    for name, func_stats in sorted(stats.items(), key=lambda item: -item[1].wall):
+        lines.append('{:<32} {:>8} {:>10.2f} {:>10.2f} {:>6.0%} {:>10.1f} {:>10.1f}'.format(
+            name, func_stats.calls, func_stats.wall, func_stats.cpu,
+            func_stats.cpu / func_stats.wall if func_stats.wall else 0,
+            func_stats.wall / func_stats.calls * 1000, func_stats.max_wall * 1000))
+    lines.append('elapsed {:.2f} s, process CPU {:.2f} s ({:.2f} cores busy on average)'.format(
+        elapsed, process_cpu, process_cpu / elapsed if elapsed else 0))
+    lines.append('Low cpu % is time waiting: on the network (POST/GET functions), or for the GIL '
+                 'if the process uses about one core while decode/compress functions wait')
+    return '\n'.join(lines)
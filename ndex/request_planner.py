@@ -0,0 +1,76 @@
+'''
+Plans cutout requests to the Boss
+Requests are aligned to the Boss cuboids and sized from the datatype and a target payload
+'''
+
+import math
+
+import numpy as np
+
+from ndex.common import CUBOID_SIZE
+
+# target size (uncompressed, MB) of the data returned by a single cutout request
+DEFAULT_REQUEST_MB = 64
+
+
+def get_request_shape(datatype, target_mb=DEFAULT_REQUEST_MB):
+    # shape (xyz) of a request of whole cuboids, one cuboid deep, close to target_mb of data
+    cuboid_bytes = np.prod(CUBOID_SIZE) * np.dtype(datatype).itemsize
+    num_cuboids = max(1, int(target_mb * 1024**2 // cuboid_bytes))
+
+    # as square as possible in x/y
+    num_x = max(1, int(math.sqrt(num_cuboids)))
+    num_y = max(1, num_cuboids // num_x)
+    return (num_x * CUBOID_SIZE[0], num_y * CUBOID_SIZE[1], CUBOID_SIZE[2])
+
+
+def expand_range(rng, cuboid):
+    # rng expanded out to cuboid boundaries
+    return [rng[0] // cuboid * cuboid, -(-rng[1] // cuboid) * cuboid]
+
+
+def plan_ranges(rng, stride, cuboid, extent=None):
+    # expands rng out to cuboid boundaries and splits it in ranges of stride (a multiple of cuboid)
+    # ranges are clipped to the extent of the data, the caller crops the data to rng
+    start, stop = expand_range(rng, cuboid)
+
+    ranges = []
+    for first in range(start, stop, stride):
+        last = min(first + stride, stop)
+        if extent is not None:
+            first, last = max(first, extent[0]), min(last, extent[1])
+        if first < last:
+            ranges.append([first, last])
+    return ranges
+
+
+def plan_cutouts(x_rng, y_rng, z_rng, request_shape, extents=None):
+    # list of cuboid aligned cutout requests ([x_rng, y_rng, z_rng]) which cover the region
+    if extents is None:
+        extents = [None, None, None]
+
+    x_rngs, y_rngs, z_rngs = [plan_ranges(rng, stride, cuboid, extent)
+                              for rng, stride, cuboid, extent in
+                              zip([x_rng, y_rng, z_rng], request_shape, CUBOID_SIZE, extents)]
+    return [[x, y, z] for z in z_rngs for y in y_rngs for x in x_rngs]
+
+
+def plan_strips(x_rng, y_rng, z_rng, datatype, target_mb=DEFAULT_REQUEST_MB, extents=None):
+    # cutout requests ([x_rng, y_rng, z_rng]) of the whole (cuboid aligned) width and depth
+    # of the region, split in y, so each is contiguous in a zyx array and can be decoded in place
+    if extents is None:
+        extents = [None, None, None]
+    x_rng, z_rng = [expand_range(rng, cuboid) for rng, cuboid in zip([x_rng, z_rng], CUBOID_SIZE[::2])]
+    x_rng, z_rng = [rng if extent is None else [max(rng[0], extent[0]), min(rng[1], extent[1])]
+                    for rng, extent in zip([x_rng, z_rng], extents[::2])]
+
+    # rows of about target_mb, whole cuboids if a cuboid row fits, otherwise a power of 2
+    # (a divisor of the cuboid height) so no request crosses a cuboid boundary
+    row_bytes = (x_rng[1] - x_rng[0]) * (z_rng[1] - z_rng[0]) * np.dtype(datatype).itemsize
+    rows = max(1, int(target_mb * 1024**2 // row_bytes))
+    if rows >= CUBOID_SIZE[1]:
+        rows = rows // CUBOID_SIZE[1] * CUBOID_SIZE[1]
+    else:
+        rows = 2**int(math.log2(rows))
+    y_rngs = plan_ranges(y_rng, rows, min(rows, CUBOID_SIZE[1]), extents[1])
+    return [[x_rng, y, z_rng] for y in y_rngs]
@@ -18,6 +18,7 @@ import sys
 sys.path.append("..")
 
 from ingest_large_vol import get_supercube_lims, post_cutout
+from ndex.ndpush.block_shape import choose_block_shape
 from src.ingest.boss_resources import BossResParams
 from src.ingest.ingest_job import IngestJob
 
@@ -124,12 +125,13 @@ def main():
         y_rng = ingest_job.y_extent
         z_rng = [slices[0], slices[-1] + 1]
 
-        block_size = 1024  # evenly divisible into x/y widths
+        # whole cuboids, sized for the datatype
+        block_x, block_y, _ = choose_block_shape(ingest_job.boss_datatype)
         pool_args = []
-        for yy in range(y_rng[0], y_rng[1], block_size):
-            yy_rng = [yy, yy + block_size]
-            for xx in range(x_rng[0], x_rng[1], block_size):
-                xx_rng = [xx, xx + block_size]
+        for yy in range(y_rng[0], y_rng[1], block_y):
+            yy_rng = [yy, min(yy + block_y, y_rng[1])]
+            for xx in range(x_rng[0], x_rng[1], block_x):
+                xx_rng = [xx, min(xx + block_x, x_rng[1])]
                 sub_data = data[:,
                                 yy_rng[0] - y_rng[0]:yy_rng[1] - y_rng[0],
                                 xx_rng[0] - x_rng[0]:xx_rng[1] - x_rng[0]]
@@ -39,6 +39,8 @@ setup(name='ndexchange',
       entry_points={'console_scripts':
                     ['ndpull=ndex.ndpull.ndpull:main',
                      'ndpush=ndex.ndpush.ingest_large_vol:main',
+                     'ndverify=ndex.ndpush.verify:main',
+                     'ndprogress=ndex.ndpush.progress:main',
                      'expand_stacks=scripts.expand_stacks:main',
                      ], },
       )
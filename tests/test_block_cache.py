@@ -0,0 +1,123 @@
+import os
+
+import numpy as np
+import pytest
+
+from ndex.ndpull.block_cache import BlockCache
+from ndex.ndpull.boss_resources import (BossMeta, BossRemote, MetadataCache,
+                                        get_aligned_ranges, merge_blocks)
+
+
+def gen_volume(x_rng, y_rng, z_rng):
+    # deterministic data so cutouts can be checked against any sub region
+    z, y, x = np.meshgrid(np.arange(*z_rng), np.arange(*y_rng), np.arange(*x_rng),
+                          indexing='ij')
+    return ((x + 3 * y + 7 * z) % 251).astype('uint8')
+
+
+def create_remote(cache_dir, x_stop=2048, y_stop=1500, z_stop=40):
+    boss_url = 'http://localhost:1/'
+    token = 'not_a_token'
+    metadata = {
+        'v1/collection/coll': {'name': 'coll'},
+        'v1/collection/coll/experiment/exp/': {'name': 'exp', 'coord_frame': 'coll_exp'},
+        'v1/collection/coll/experiment/exp/channel/ch/': {'name': 'ch', 'datatype': 'uint8'},
+        'v1/downsample/coll/exp/ch': {'status': 'DOWNSAMPLED'},
+        'v1/coord/coll_exp': {'x_start': 0, 'x_stop': x_stop, 'y_start': 0, 'y_stop': y_stop,
+                              'z_start': 0, 'z_stop': z_stop},
+    }
+    metadata_cache = MetadataCache(cache_dir)
+    for url, data in metadata.items():
+        metadata_cache.set(' '.join((boss_url, url, token)), data)
+
+    rmt = BossRemote(boss_url, token, BossMeta('coll', 'exp', 'ch'),
+                     metadata_cache=metadata_cache, block_cache=BlockCache(cache_dir))
+
+    # serve cutouts locally and keep track of what was requested
+    rmt.requests = []
+
+    def fetch_cutout(x_rng, y_rng, z_rng, datatype, attempts=5):
+        rmt.requests.append((x_rng, y_rng, z_rng))
+        return gen_volume(x_rng, y_rng, z_rng).astype(datatype)
+    rmt.fetch_cutout = fetch_cutout
+    return rmt
+
+
+class TestBlockCache:
+
+    def test_aligned_ranges(self):
+        assert get_aligned_ranges([100, 1100], 512) == [
+            [100, 512], [512, 1024], [1024, 1100]]
+        assert get_aligned_ranges([0, 1024], 512) == [[0, 512], [512, 1024]]
+        assert get_aligned_ranges([100, 1100], 512, [0, 600]) == [
+            [100, 512], [512, 600]]
+
+    def test_put_get(self, tmp_path):
+        cache = BlockCache(str(tmp_path))
+        data = gen_volume([0, 64], [0, 32], [0, 4])
+        cache.put('key', data)
+
+        assert np.array_equal(cache.get('key', data.shape, data.dtype), data)
+        assert cache.get('other_key', data.shape, data.dtype) is None
+        # a block of the wrong size is a miss
+        assert cache.get('key', (4, 32, 32), data.dtype) is None
+
+    def test_lru_eviction(self, tmp_path):
+        data = np.random.randint(0, 255, size=(4, 64, 64), dtype='uint8')
+        cache = BlockCache(str(tmp_path), max_bytes=int(data.nbytes * 2.5))
+
+        cache.put('a', data)
+        cache.put('b', data)
+        # make 'a' the least recently used
+        a_fname = str(cache.get_fname('a'))
+        os.utime(a_fname, (1, 1))
+
+        cache.put('c', data)
+        assert cache.get('a', data.shape, data.dtype) is None
+        assert cache.get('b', data.shape, data.dtype) is not None
+        assert cache.get('c', data.shape, data.dtype) is not None
+
+    def test_cutout_aligned_and_cached(self, tmp_path):
+        rmt = create_remote(str(tmp_path))
+        x_rng, y_rng, z_rng = [100, 700], [600, 900], [3, 20]
+
+        data = rmt.cutout(x_rng, y_rng, z_rng, 'uint8')
+        assert np.array_equal(data, gen_volume(x_rng, y_rng, z_rng))
+        # the request is expanded to cuboid boundaries
+        assert rmt.requests == [([0, 1024], [512, 1024], [0, 32])]
+
+        # overlapping request is served from the cache
+        x_rng, y_rng, z_rng = [200, 1000], [700, 1000], [5, 30]
+        data = rmt.cutout(x_rng, y_rng, z_rng, 'uint8')
+        assert np.array_equal(data, gen_volume(x_rng, y_rng, z_rng))
+        assert len(rmt.requests) == 1
+
+    def test_cutout_clipped_to_extent(self, tmp_path):
+        rmt = create_remote(str(tmp_path))
+        x_rng, y_rng, z_rng = [1500, 2048], [1200, 1500], [32, 40]
+
+        data = rmt.cutout(x_rng, y_rng, z_rng, 'uint8')
+        assert np.array_equal(data, gen_volume(x_rng, y_rng, z_rng))
+        assert rmt.requests == [([1024, 2048], [1024, 1500], [32, 40])]
+
+    def test_cutout_sparse_misses(self, tmp_path):
+        rmt = create_remote(str(tmp_path))
+        # cuboids at x 512-1024 (both z) and x 0-512, z 16-32 are cached
+        rmt.cutout([512, 1024], [0, 512], [0, 32], 'uint8')
+        rmt.cutout([0, 512], [0, 512], [16, 32], 'uint8')
+        rmt.requests = []
+
+        x_rng, y_rng, z_rng = [0, 2048], [0, 512], [0, 32]
+        data = rmt.cutout(x_rng, y_rng, z_rng, 'uint8')
+        assert np.array_equal(data, gen_volume(x_rng, y_rng, z_rng))
+        # only the missing cuboids are downloaded, in boxes
+        assert sorted(rmt.requests) == [([0, 512], [0, 512], [0, 16]),
+                                        ([1024, 2048], [0, 512], [0, 32])]
+
+    def test_merge_blocks(self):
+        blocks = [[[0, 512], [0, 512], [0, 16]], [[512, 1024], [0, 512], [0, 16]],
+                  [[0, 512], [512, 600], [0, 16]], [[512, 1024], [512, 600], [0, 16]],
+                  [[1536, 2048], [0, 512], [0, 16]]]
+        assert sorted(merge_blocks(blocks)) == [[[0, 1024], [0, 600], [0, 16]],
+                                                [[1536, 2048], [0, 512], [0, 16]]]
+        assert merge_blocks([]) == []
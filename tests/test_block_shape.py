@@ -0,0 +1,64 @@
+import numpy as np
+import pytest
+
+from ndex.ndpush.block_shape import (BlockShapeTuner, benchmark_block_shapes, choose_block_shape,
+                                     estimate_compress_ratio, get_block_ranges)
+
+
+class TestBlockShape:
+
+    def test_choose_block_shape(self):
+        assert choose_block_shape('uint16') == (1024, 1024, 16)
+        assert choose_block_shape('uint8') == (1024, 2048, 16)
+        # a 1024x1024x16 uint64 block would be 128 MB
+        assert choose_block_shape('uint64') == (512, 512, 16)
+
+    def test_fixed_shape(self):
+        tuner = BlockShapeTuner('uint64', (1024, 1024))
+        tuner.record(1024**3, 1)
+        assert tuner.get_shape() == (1024, 1024, 16)
+
+        with pytest.raises(ValueError):
+            BlockShapeTuner('uint8', (1000, 1024))
+
+    def test_tuner_adapts(self):
+        tuner = BlockShapeTuner('uint16', target_seconds=1)
+        assert tuner.get_shape() == (1024, 1024, 16)
+
+        # fast POSTs: blocks grow, at most twice as large per stack
+        tuner.record(32 * 1024**2, 0.1)
+        assert tuner.get_shape() == (1024, 2048, 16)
+        tuner.record(64 * 1024**2, 0.1)
+        assert tuner.get_shape() == (2048, 2048, 16)
+
+        # slow POSTs: blocks shrink down to one cuboid
+        for _ in range(5):
+            tuner.record(64 * 1024**2, 60)
+            shape = tuner.get_shape()
+        assert shape == (512, 512, 16)
+
+    def test_compress_ratio(self):
+        sparse = np.zeros((16, 512, 512), dtype='uint64')
+        sparse[:, :10, :10] = 5
+        noise = np.random.randint(0, 2**16, size=(16, 512, 512), dtype='uint16')
+        assert estimate_compress_ratio(sparse, 'uint64') > 10
+        assert estimate_compress_ratio(noise, 'uint16') < 1.5
+
+        tuner = BlockShapeTuner('uint64')
+        tuner.set_compress_ratio(estimate_compress_ratio(sparse, 'uint64'))
+        assert np.prod(tuner.get_shape()) > np.prod(choose_block_shape('uint64'))
+
+    def test_benchmark(self):
+        assert get_block_ranges([100, 1300], 512) == [[100, 512], [512, 1024], [1024, 1300]]
+
+        data = np.ones((16, 1024, 1536), dtype='uint8')
+        posted = []
+
+        def post(x_rng, y_rng, z_rng, block):
+            assert block.shape == (16, y_rng[1] - y_rng[0], x_rng[1] - x_rng[0])
+            posted.append(block.nbytes)
+
+        results = benchmark_block_shapes(post, data, [(512, 512), (1024, 1024)], threads=2)
+        assert [shape for shape, _, _ in results] == [(512, 512), (1024, 1024)]
+        assert sum(posted) == 2 * data.nbytes
+        assert all(mbps > 0 for _, mbps, _ in results)
@@ -0,0 +1,37 @@
+import numpy as np
+import tifffile
+
+from ndex.benchmarks.boss_benchmark import RSSMonitor, get_rss, run_benchmarks
+from ndex.benchmarks.mock_boss import MockBoss
+
+
+class TestBossBenchmark:
+
+    def setup_method(self):
+        self.boss = MockBoss().start()
+
+    def teardown_method(self):
+        self.boss.stop()
+
+    def test_run_benchmarks(self, tmp_path):
+        config_file = self.boss.write_config(str(tmp_path / 'mock.cfg'))
+        size = (1024, 512, 16)
+        results = run_benchmarks(config_file, str(tmp_path), ['uint8', 'uint64'], [2],
+                                 [(512, 512)], size)
+
+        assert [(r['mode'], r['datatype']) for r in results] == [
+            ('ingest', 'uint8'), ('pull', 'uint8'), ('ingest', 'uint64'), ('pull', 'uint64')]
+        assert all(r['MB/s'] > 0 and r['p99_ms'] >= r['p50_ms'] > 0 for r in results)
+
+        # the images went through ndpush into the mock and back out through ndpull
+        img = tifffile.imread(str(tmp_path / 'images_uint8' / 'img_0003.tif'))
+        data = self.boss.read('ndex_benchmark', 'benchmark_1024x512x16', 'uint8_t2_512x512', 0,
+                              [0, 1024], [0, 512], [0, 16], 'uint8')
+        assert np.array_equal(data[3], img)
+        assert len(list((tmp_path / 'pull_uint8_t2_512x512').glob('*.tif'))) == 16
+
+    def test_rss_monitor(self):
+        with RSSMonitor() as rss:
+            data = np.ones(64 * 1024**2, dtype='uint8')
+        assert rss.peak >= data.nbytes
+        assert get_rss() > 0
@@ -7,7 +7,7 @@ import pytest
 from intern.resource.boss.resource import *
 from requests import HTTPError
 
-from ndex.ndpush.boss_resources import BossResParams
+from ndex.ndpush.boss_resources import CUTOUT_TIMEOUT, BossResParams
 from ndex.ndpush.ingest_job import IngestJob
 
 BOSS_URL = 'https://api.boss.neurodata.io/latest/'
@@ -18,6 +18,11 @@ class TestBossResources:
     def setup(self):
         pass
 
+    @pytest.fixture(autouse=True)
+    def log_dir(self, tmp_path, monkeypatch):
+        # the ingest logs are written to the working directory, also when a test fails
+        monkeypatch.chdir(tmp_path)
+
     def test_get_boss_res_params_just_names(self):
         args = Namespace(
             datasource='local',
@@ -299,3 +304,33 @@ class TestBossResources:
             args.source_channel, args.collection, args.experiment)
         source_resource = boss_res_params.rmt.get_project(source_setup)
         boss_res_params.rmt.delete_project(source_resource)
+
+
+class FakeSession:
+    # records the POSTs like a requests.Session
+    def __init__(self):
+        self.posts = []
+
+    def post(self, url, **kwargs):
+        self.posts.append((url, kwargs))
+        return self
+
+    def raise_for_status(self):
+        pass
+
+
+class TestPostBloscCutout:
+
+    def test_post_timeout(self):
+        boss_res_params = BossResParams.__new__(BossResParams)
+        boss_res_params.ingest_job = Namespace(coll_name='coll', exp_name='exp', ch_name='ch')
+        boss_res_params.boss_url = 'https://api.boss.neurodata.io'
+        boss_res_params.session = FakeSession()
+
+        boss_res_params.post_blosc_cutout(0, [0, 512], [0, 512], [0, 16], b'compressed')
+
+        url, kwargs = boss_res_params.session.posts[0]
+        assert url == 'https://api.boss.neurodata.io/v1/cutout/coll/exp/ch/0/0:512/0:512/0:16/'
+        assert kwargs['data'] == b'compressed'
+        # a POST never waits on the Boss forever
+        assert kwargs['timeout'] == CUTOUT_TIMEOUT
@@ -0,0 +1,130 @@
+import numpy as np
+import pytest
+import tifffile
+
+from ndex.benchmarks.mock_boss import MockBoss
+from ndex.ndpull import ndpull
+from ndex.ndpull.downsample import block_mode, downsample, get_downsample_factors
+from ndex.ndpull.volume import BossVolume
+
+
+def gen_volume(x_rng, y_rng, z_rng):
+    z, y, x = np.meshgrid(np.arange(*z_rng), np.arange(*y_rng), np.arange(*x_rng),
+                          indexing='ij')
+    return ((x + 3 * y + 7 * z) % 251).astype('uint8')
+
+
+def gen_labels(x_rng, y_rng, z_rng):
+    # 10 x 10 x 4 blocks of labels
+    z, y, x = np.meshgrid(np.arange(*z_rng), np.arange(*y_rng), np.arange(*x_rng),
+                          indexing='ij')
+    return (1 + x // 10 + 1000 * (y // 10) + 10**6 * (z // 4)).astype('uint64')
+
+
+def expected_mean(data, factors):
+    # data padded with zeros to multiples of factors (zyx), then averaged
+    fx, fy, fz = factors
+    shape = [-(-s // f) * f for s, f in zip(data.shape, (fz, fy, fx))]
+    padded = np.zeros(shape, dtype='float64')
+    padded[:data.shape[0], :data.shape[1], :data.shape[2]] = data
+    return np.rint(padded.reshape(shape[0] // fz, fz, shape[1] // fy, fy, shape[2] // fx, fx)
+                   .mean(axis=(1, 3, 5))).astype(data.dtype)
+
+
+class TestDownsample:
+
+    def test_factors(self):
+        assert get_downsample_factors(0) == (1, 1, 1)
+        assert get_downsample_factors(2) == (4, 4, 1)
+        assert get_downsample_factors(2, iso=True) == (4, 4, 4)
+
+    def test_mean(self):
+        data = gen_volume([0, 64], [0, 32], [0, 8])
+        assert np.array_equal(downsample(data, (2, 2, 1)), expected_mean(data, (2, 2, 1)))
+        assert np.array_equal(downsample(data, (4, 4, 4)), expected_mean(data, (4, 4, 4)))
+        assert downsample(data, (4, 4, 4)).dtype == np.uint8
+
+        data = np.array([[[1, 2], [2, 2]]], dtype='uint16')
+        # 1.75 rounds to 2
+        assert downsample(data, (2, 2, 1)).tolist() == [[[2]]]
+        with pytest.raises(ValueError):
+            downsample(data, (2, 2, 1), method='max')
+
+    def test_mode(self):
+        blocks = np.array([[3, 1, 3, 2], [5, 5, 4, 4], [0, 0, 0, 7], [9, 8, 7, 6]])
+        # ties go to the smaller value
+        assert block_mode(blocks).tolist() == [3, 4, 0, 6]
+
+        data = np.zeros((2, 4, 4), dtype='uint64')
+        data[:, :2, :2] = [[5, 5], [5, 7]]
+        data[:, 2:, 2:] = [[10**12, 10**12], [3, 3]]
+        assert downsample(data, (2, 2, 2), method='mode').tolist() == [[[5, 0], [0, 3]]]
+        labels = gen_labels([0, 40], [0, 40], [0, 8])
+        assert np.array_equal(downsample(labels, (2, 2, 1), method='mode'), labels[:, ::2, ::2])
+
+
+class TestClientDownsample:
+
+    def setup_method(self):
+        # not a multiple of the cuboids (or of 4 in x) at the end
+        self.extents = [[0, 1102], [0, 600], [0, 20]]
+        self.boss = MockBoss().start()
+        self.data = gen_volume(*self.extents)
+        self.labels = gen_labels(*self.extents)
+        self.boss.add_channel('coll', 'exp', 'image', datatype='uint8', x_extent=self.extents[0],
+                              y_extent=self.extents[1], z_extent=self.extents[2])
+        self.boss.add_channel('coll', 'exp', 'labels', datatype='uint64', ch_type='annotation',
+                              x_extent=self.extents[0], y_extent=self.extents[1],
+                              z_extent=self.extents[2])
+        self.boss.write('coll', 'exp', 'image', 0, *self.extents, self.data)
+        self.boss.write('coll', 'exp', 'labels', 0, *self.extents, self.labels)
+
+    def teardown_method(self):
+        self.boss.stop()
+
+    def get_args(self, tmp_path, channel, res, **kwargs):
+        config_file = self.boss.write_config(str(tmp_path / 'mock.cfg'))
+        return ndpull.collect_input_args('coll', 'exp', channel, config_file=config_file, res=res,
+                                         outdir=str(tmp_path), cache_dir=str(tmp_path / 'cache'),
+                                         **kwargs)
+
+    def test_not_downsampled(self, tmp_path):
+        with pytest.raises(ValueError):
+            ndpull.validate_args(self.get_args(tmp_path, 'image', 1, full_extent=True))
+
+    def test_pull_slices(self, tmp_path):
+        args = self.get_args(tmp_path, 'image', 1, full_extent=True, client_downsample=True,
+                             request_size_mb=1)
+        result, rmt = ndpull.validate_args(args)
+        assert rmt.meta.res() == 1
+        assert result.x == [0, 551] and result.y == [0, 300] and result.z == [0, 20]
+        ndpull.download_slices(result, rmt, threads=2)
+
+        expected = expected_mean(self.data, (2, 2, 1))
+        fnames = sorted(tmp_path.glob('coll_exp_image_x0-551_y0-300_z*.tif'))
+        assert len(fnames) == 20
+        assert np.array_equal(tifffile.imread(str(fnames[13])), expected[13])
+
+    def test_annotations(self, tmp_path):
+        args = self.get_args(tmp_path, 'labels', 2, x=[100, 275], y=[10, 150], z=[3, 5],
+                             iso=True, client_downsample=True)
+        result, rmt = ndpull.validate_args(args)
+        assert rmt.method == 'mode' and rmt.factors == (4, 4, 4)
+        assert rmt.get_xyz_extents() == ([0, 276], [0, 150], [0, 5])
+
+        data = rmt.cutout([100, 275], [10, 150], [3, 5], 'uint64')
+        assert np.array_equal(data, self.labels[12:20:4, 40:600:4, 400:1100:4])
+
+    def test_volume(self, tmp_path):
+        config_file = self.boss.write_config(str(tmp_path / 'mock.cfg'))
+        vol = BossVolume('coll', 'exp', 'image', res=1, client_downsample=True,
+                         config_file=config_file, cache_dir=str(tmp_path / 'cache'))
+        assert vol.shape == (20, 300, 551)
+        # the mock only has res 0
+        assert np.array_equal(vol[5:7, 100:, :], expected_mean(self.data, (2, 2, 1))[5:7, 100:, :])
+
+        # the last voxel in x is half outside of the data
+        vol = BossVolume('coll', 'exp', 'image', res=2, client_downsample=True,
+                         config_file=config_file, cache_dir=str(tmp_path / 'cache'))
+        assert vol.shape == (20, 150, 276)
+        assert np.array_equal(vol[3], expected_mean(self.data, (4, 4, 1))[3])
@@ -0,0 +1,56 @@
+from multiprocessing.dummy import Pool as ThreadPool
+
+from ndex.ndpush.event_log import PENDING_LOGS, EventLog, flush_pending_logs, read_events
+
+
+class TestEventLog:
+
+    def test_record_read(self, tmp_path):
+        fname = str(tmp_path / 'events.jsonl')
+        event_log = EventLog(fname)
+        event_log.record('post', x=[0, 512], status='ok', seconds=1.5)
+        event_log.record('empty', x=[512, 1024])
+        event_log.flush()
+
+        events = list(read_events(fname))
+        assert [e['event'] for e in events] == ['post', 'empty']
+        assert events[0]['x'] == [0, 512]
+        assert events[0]['seconds'] == 1.5
+
+        assert len(list(read_events(fname, 'empty'))) == 1
+
+    def test_buffered(self, tmp_path):
+        fname = tmp_path / 'events.jsonl'
+        event_log = EventLog(str(fname), flush_every=10, flush_interval=3600)
+        for idx in range(9):
+            event_log.record('post', idx=idx)
+        assert not fname.exists()
+
+        event_log.record('post', idx=9)
+        assert len(list(read_events(str(fname)))) == 10
+
+    def test_flush_at_exit(self, tmp_path):
+        fname = tmp_path / 'events.jsonl'
+        event_log = EventLog(str(fname), flush_every=10, flush_interval=3600)
+        assert event_log not in PENDING_LOGS
+        event_log.record('post', idx=0)
+        assert event_log in PENDING_LOGS
+
+        # what the exit handler does, logs aren't held on to once they're written
+        flush_pending_logs()
+        assert len(list(read_events(str(fname)))) == 1
+        assert event_log not in PENDING_LOGS
+
+    def test_threads(self, tmp_path):
+        fname = str(tmp_path / 'events.jsonl')
+        event_log = EventLog(fname, flush_every=7)
+        with ThreadPool(8) as pool:
+            pool.map(lambda idx: event_log.record('post', idx=idx), range(1000))
+        event_log.flush()
+
+        assert sorted(e['idx'] for e in read_events(fname)) == list(range(1000))
+
+    def test_partial_line(self, tmp_path):
+        fname = tmp_path / 'events.jsonl'
+        fname.write_text('{"event": "post", "idx": 0}\n{"event": "po')
+        assert [e['idx'] for e in read_events(str(fname))] == [0]
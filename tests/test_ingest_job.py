@@ -5,9 +5,10 @@ from datetime import datetime
 import boto3
 import numpy as np
 import pytest
+import tifffile
 from PIL import Image
 
-from ndex.ndpush.ingest_job import IngestJob
+from ndex.ndpush.ingest_job import IngestJob, create_text_log
 from create_images import create_img_file, del_test_images, gen_images
 
 
@@ -179,6 +180,7 @@ class TestIngestJob:
 
         msg = 'test_message_' + datetime.now().strftime("%Y-%m-%d %H:%M:%S")
         ingest_job.send_msg(msg)
+        ingest_job.flush_logs()
 
         log_fname = ingest_job.get_log_fname()
         with open(log_fname) as f:
@@ -540,3 +542,95 @@ class TestIngestJob:
     #     assert im_height == ingest_job.img_size[1]
     #     assert im_datatype == self.args.datatype
     #     os.remove(ingest_job.get_log_fname())
+
+
+class TestSampleChannels:
+    def setup_method(self):
+        self.args = Namespace(
+            datasource='local',
+            collection='ben_dev',
+            experiment='dev_ingest_4',
+            channel='green',
+            sample_channels=['red', 'green', 'blue'],
+            datatype='uint8',
+            base_filename='rgb_<p:4>',
+            base_path='rgb_images/',
+            extension='tif',
+            x_extent=[0, 64],
+            y_extent=[0, 32],
+            z_extent=[0, 4],
+            z_range=[0, 4],
+            z_step=1,
+            warn_missing_files=True)
+
+    def create_rgb_images(self, tmp_path, planar=False):
+        (tmp_path / 'rgb_images').mkdir()
+        imgs = np.random.randint(0, 256, size=(4, 32, 64, 3), dtype='uint8')
+        for z, img in enumerate(imgs):
+            fname = str(tmp_path / 'rgb_images' / 'rgb_{:04d}.tif'.format(z))
+            if planar:
+                tifffile.imsave(fname, np.moveaxis(img, -1, 0), planarconfig='separate')
+            else:
+                tifffile.imsave(fname, img)
+        return imgs
+
+    def test_read_channel_sample(self, tmp_path, monkeypatch):
+        monkeypatch.chdir(tmp_path)
+        imgs = self.create_rgb_images(tmp_path)
+
+        ingest_job = IngestJob(self.args)
+        assert ingest_job.sample_index == 1
+
+        im_array = ingest_job.read_img_stack([0, 1, 2, 3])
+        assert np.array_equal(im_array, imgs[..., 1])
+
+    def test_read_all_samples(self, tmp_path, monkeypatch):
+        monkeypatch.chdir(tmp_path)
+        imgs = self.create_rgb_images(tmp_path)
+
+        ingest_job = IngestJob(self.args)
+        samples = ingest_job.read_img_stack([1, 2], threads=2, all_samples=True)
+        assert samples.shape == (3, 2, 32, 64)
+        for idx in range(3):
+            assert samples[idx].flags['C_CONTIGUOUS']
+            assert np.array_equal(samples[idx], imgs[1:3, ..., idx])
+
+    def test_read_planar_samples(self, tmp_path, monkeypatch):
+        monkeypatch.chdir(tmp_path)
+        imgs = self.create_rgb_images(tmp_path, planar=True)
+
+        ingest_job = IngestJob(self.args)
+        assert ingest_job.get_img_info(0) == (64, 32, np.dtype('uint8'))
+
+        im_array = ingest_job.read_img_stack([0, 1, 2, 3])
+        assert np.array_equal(im_array, imgs[..., 1])
+
+        samples = ingest_job.read_img_stack([1, 2], all_samples=True)
+        for idx in range(3):
+            assert np.array_equal(samples[idx], imgs[1:3, ..., idx])
+
+
+class TestTextLog:
+    def test_buffered(self, tmp_path):
+        log_fname = str(tmp_path / 'ingest_log.txt')
+        text_log = create_text_log(log_fname)
+
+        msgs = ['block {}'.format(idx) for idx in range(10)]
+        for msg in msgs:
+            text_log.info(msg)
+        # per block messages are kept in memory until the buffer is written
+        assert not os.path.isfile(log_fname)
+
+        # warnings (messages sent to Slack) write them out, in order
+        text_log.warning('error')
+        with open(log_fname) as f:
+            assert f.read().splitlines() == msgs + ['error']
+
+    def test_capacity(self, tmp_path):
+        log_fname = str(tmp_path / 'ingest_log.txt')
+        text_log = create_text_log(log_fname, capacity=4)
+        for idx in range(6):
+            text_log.info('block {}'.format(idx))
+        with open(log_fname) as f:
+            assert len(f.readlines()) == 4
+
@@ -1,20 +1,202 @@
 import os
+import threading
 import time
 from argparse import Namespace
 from datetime import datetime
 from multiprocessing.dummy import Pool as ThreadPool
 from functools import partial
 
+import blosc
 import numpy as np
 import pytest
 
+from ndex.ndpush import ingest_large_vol
 from ndex.ndpush.ingest_large_vol import (per_channel_ingest, post_cutout, read_channel_names,
-                                          assert_equal, ingest_block, get_supercube_lims, download_boss_slice)
+                                          ingest_block, get_supercube_lims,
+                                          encode_annotation_block, encode_single_label_block,
+                                          is_single_label, multi_channel_ingest,
+                                          read_region)
+from ndex.ndpush.block_shape import BlockShapeTuner
 from ndex.ndpush.boss_resources import BossResParams
 from ndex.ndpush.ingest_job import IngestJob
+from ndex.ndpush.metrics import IngestMetrics
 from create_images import del_test_images, gen_images
 
 
+class TestAnnotationBlocks:
+
+    def decode(self, compressed, shape):
+        return np.frombuffer(blosc.decompress(compressed), dtype='uint64').reshape(shape)
+
+    def test_encode_keeps_labels(self):
+        data = np.random.randint(0, 2**16, size=(16, 64, 64), dtype='uint16')
+        compressed = encode_annotation_block(data)
+        assert np.array_equal(self.decode(compressed, data.shape), data)
+
+    def test_encode_single_label(self):
+        data = np.full((16, 64, 64), 7, dtype='uint8')
+        compressed = encode_annotation_block(data)
+        assert np.array_equal(self.decode(compressed, data.shape), data)
+        assert len(compressed) < data.size * 8 / 100
+
+        # the compressed block is reused for the same label and shape
+        hits = encode_single_label_block.cache_info().hits
+        assert encode_annotation_block(data.astype('uint32')) is compressed
+        assert encode_single_label_block.cache_info().hits == hits + 1
+
+    def test_single_label(self):
+        data = np.full((16, 64, 64), 3, dtype='uint32')
+        assert is_single_label(data, 3)
+        # a different label in the last slice, and in a non contiguous view
+        data[15, 63, 63] = 4
+        assert not is_single_label(data, 3)
+        assert is_single_label(data[:15, :, ::2], 3)
+        compressed = encode_annotation_block(data)
+        assert np.array_equal(self.decode(compressed, data.shape), data)
+
+    def test_encode_sparse_smaller_than_default(self):
+        data = np.zeros((16, 256, 256), dtype='uint32')
+        data[:, 100:120, 50:90] = 12345
+        data[:, 200:210, 10:20] = 2**31
+
+        compressed = encode_annotation_block(data)
+        default = blosc.compress(data.astype('uint64').tobytes(), typesize=8)
+        assert np.array_equal(self.decode(compressed, data.shape), data)
+        assert len(compressed) <= len(default)
+
+
+class FakeChannelJob:
+    # ingest job of a channel with a constant (non zero) stack
+    def __init__(self, channel, value, in_flight):
+        self.ch_name = channel
+        self.value = value
+        self.in_flight = in_flight
+        self.x_extent, self.y_extent, self.z_range = [0, 2048], [0, 1024], [0, 40]
+        self.offsets = [0, 0, 0]
+        self.stacks = []
+        self.boss_datatype = 'uint8'
+        self.block_tuner = BlockShapeTuner('uint8', (1024, 1024))
+        self.metrics = IngestMetrics()
+
+    def read_img_stack(self, z_slices, all_samples=False):
+        if all_samples:
+            # sample planes of value 1, 2, 3 (one per channel)
+            self.stacks.append(list(z_slices))
+            return np.stack([np.full((len(z_slices), 1024, 2048), value, dtype='uint8')
+                             for value in (1, 2, 3)])
+        with self.in_flight['lock']:
+            self.in_flight['count'] += 1
+            self.in_flight['max'] = max(self.in_flight['max'], self.in_flight['count'])
+        time.sleep(0.01)
+        with self.in_flight['lock']:
+            self.in_flight['count'] -= 1
+        self.stacks.append(list(z_slices))
+        return np.full((len(z_slices), 1024, 2048), self.value, dtype='uint8')
+
+
+class TestMultiChannelIngest:
+
+    def setup_method(self):
+        self.in_flight = {'lock': threading.Lock(), 'count': 0, 'max': 0}
+        self.shared = []
+        self.posted = []
+        self.finished = []
+
+    def fake_setup(self, args, channel, shared_params=None):
+        self.shared.append(shared_params)
+        job = FakeChannelJob(channel, len(self.shared), self.in_flight)
+        return job, 'params_' + channel
+
+    def fake_post(self, boss_res_params, ingest_job, x_rng, y_rng, z_rng, data, attempts=5):
+        assert (data == ingest_job.value).all()
+        self.posted.append((ingest_job.ch_name, tuple(x_rng), tuple(y_rng), tuple(z_rng)))
+        return 0
+
+    def test_multi_channel_ingest(self, monkeypatch):
+        monkeypatch.setattr(ingest_large_vol, 'setup_channel_ingest', self.fake_setup)
+        monkeypatch.setattr(ingest_large_vol, 'post_cutout', self.fake_post)
+        monkeypatch.setattr(ingest_large_vol, 'finish_channel_ingest',
+                            lambda job, params: self.finished.append(job.ch_name))
+
+        channels = ['ch0', 'ch1', 'ch2']
+        assert multi_channel_ingest(Namespace(), channels, threads=4, parallel_channels=2) == 0
+
+        # connections shared from the first channel
+        assert self.shared == [None, 'params_ch0', 'params_ch0']
+        # every channel walks the same z buckets, with no more than 2 stacks read at once
+        assert self.in_flight['max'] <= 2
+        assert len(self.posted) == len(set(self.posted)) == 3 * 2 * 3
+        assert self.finished == channels
+
+    def test_split_channel_ingest(self, monkeypatch):
+        monkeypatch.setattr(ingest_large_vol, 'setup_channel_ingest', self.fake_setup)
+        monkeypatch.setattr(ingest_large_vol, 'post_cutout', self.fake_post)
+        monkeypatch.setattr(ingest_large_vol, 'finish_channel_ingest',
+                            lambda job, params: self.finished.append(job.ch_name))
+
+        channels = ['red', 'green', 'blue']
+        args = Namespace()
+        assert ingest_large_vol.split_channel_ingest(args, channels, threads=4) == 0
+        assert args.sample_channels == channels
+
+        # stacks are only read by the first channel, the planes go to every channel
+        assert len(self.shared) == 3
+        assert len(self.posted) == 3 * 2 * 3
+        assert {ch for ch, _, _, _ in self.posted} == set(channels)
+        assert self.finished == channels
+
+
+class FakeIntern:
+    # serves a deterministic volume, every request fails once (requests at x 0 always fail)
+    def __init__(self):
+        self.requests = []
+
+    def get_cutout(self, ch_resource, res, x_rng, y_rng, z_rng):
+        self.requests.append((tuple(x_rng), tuple(y_rng), tuple(z_rng)))
+        if self.requests.count(self.requests[-1]) == 1 or x_rng[0] == 0:
+            raise ConnectionError('dropped')
+        return volume(x_rng, y_rng, z_rng)
+
+
+def volume(x_rng, y_rng, z_rng):
+    z, y, x = np.meshgrid(np.arange(*z_rng), np.arange(*y_rng), np.arange(*x_rng), indexing='ij')
+    return ((x + 5 * y + 11 * z) % 65521).astype('uint16')
+
+
+class TestReadRegion:
+
+    def test_read_region(self, monkeypatch):
+        monkeypatch.setattr(time, 'sleep', lambda secs: None)
+        boss_res_params = Namespace(rmt=FakeIntern(), ch_resource=None)
+        ingest_job = Namespace(boss_datatype='uint16', res=0, send_msg=lambda msg, send_slack=False: None)
+
+        x_rng, y_rng, z_rng = [100, 3000], [500, 1100], [5, 6]
+        data = read_region(boss_res_params, ingest_job, x_rng, y_rng, z_rng, threads=4)
+        assert np.array_equal(data, volume(x_rng, y_rng, z_rng))
+
+        # requests split on cuboid boundaries without going past the region
+        for req_x, req_y, req_z in set(boss_res_params.rmt.requests):
+            assert req_x[0] == x_rng[0] or req_x[0] % 512 == 0
+            assert req_y[0] == y_rng[0] or req_y[0] % 512 == 0
+            assert req_x[1] <= x_rng[1] and req_y[1] <= y_rng[1] and req_z == (5, 6)
+
+    def test_read_region_failed(self, monkeypatch):
+        monkeypatch.setattr(time, 'sleep', lambda secs: None)
+        msgs = []
+        boss_res_params = Namespace(rmt=FakeIntern(), ch_resource=None)
+        ingest_job = Namespace(coll_name='coll', exp_name='exp', ch_name='ch1', boss_datatype='uint16',
+                               res=0, send_msg=lambda msg, send_slack=False: msgs.append(msg))
+
+        # a single request, read without a pool
+        assert np.array_equal(read_region(boss_res_params, ingest_job, [512, 600], [0, 64], [0, 16]),
+                              volume([512, 600], [0, 64], [0, 16]))
+
+        with pytest.raises(ConnectionError, match=r'1 of 3 requests failed .* x: \[0, 3000\]'):
+            read_region(boss_res_params, ingest_job, [0, 3000], [0, 64], [0, 16], threads=2)
+        # the failed cutout is named in the error message
+        assert any('x: [0, 1024], y: [0, 64], z: [0, 16]' in msg for msg in msgs)
+
+
 class TestIngestLargeVol:
 
     def setup(self):
@@ -151,8 +333,8 @@ class TestIngestLargeVol:
         time_taken = time.time() - start_time
         print('{} secs taken with {} threads'.format(time_taken, threads))
 
-        data_boss = download_boss_slice(
-            boss_res_params, ingest_job, 0)[0, :, :]
+        data_boss = read_region(boss_res_params, ingest_job, ingest_job.x_extent,
+                                ingest_job.y_extent, [0, 1])[0, :, :]
 
         data_local = im_array[0, :, :]
 
@@ -474,11 +656,9 @@ class TestIngestLargeVol:
     #     result = per_channel_ingest(self.args, channel)
     #     assert result == 0
 
-    #     #assert equal
     #     ingest_job = IngestJob(self.args)
     #     boss_res_params = BossResParams(ingest_job)
     #     boss_res_params.get_resources(get_only=True)
-    #     assert assert_equal(boss_res_params, ingest_job, self.args.z_range)
 
     #     # cleanup
     #     boss_res_params.rmt.delete_project(boss_res_params.ch_resource)
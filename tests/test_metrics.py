@@ -0,0 +1,171 @@
+from argparse import Namespace
+
+import blosc
+import numpy as np
+import pytest
+import requests
+
+from ndex.ndpush.ingest_large_vol import post_cutout
+from ndex.ndpush.metrics import (Counter, Gauge, Histogram, IngestMetrics, MetricsRegistry,
+                                 MetricsServer)
+
+
+class FakeBossResParams:
+    def __init__(self, fail=0):
+        self.fail = fail
+        self.posted = []
+        # image blocks are POSTed with the intern remote
+        self.rmt = self
+        self.ch_resource = None
+
+    def post(self, body):
+        if self.fail:
+            self.fail -= 1
+            raise Exception('POST failed')
+        self.posted.append(body)
+
+    def post_blosc_cutout(self, res, x_rng, y_rng, z_rng, compressed):
+        self.post(compressed)
+
+    def create_cutout(self, resource, res, x_rng, y_rng, z_rng, data):
+        self.post(data)
+
+
+class TestMetrics:
+
+    def test_counter_gauge(self):
+        counter = Counter('test_total', 'A counter')
+        counter.inc(channel='a')
+        counter.inc(5, channel='a')
+        counter.inc(channel='b')
+        assert counter.get(channel='a') == 6
+        assert counter.get(channel='b') == 1
+        assert counter.get(channel='c') == 0
+
+        gauge = Gauge('test_gauge', 'A gauge')
+        gauge.inc(3, channel='a')
+        gauge.dec(channel='a')
+        assert gauge.get(channel='a') == 2
+        gauge.set(7, channel='a')
+        assert gauge.get(channel='a') == 7
+
+    def test_histogram(self):
+        hist = Histogram('test_seconds', 'A histogram', buckets=(0.1, 1, 10))
+        assert hist.quantile(0.5, channel='a') == 0
+        for value in [0.05] * 90 + [0.5] * 9 + [20]:
+            hist.observe(value, channel='a')
+
+        value = hist.get(channel='a')
+        assert value.count == 100
+        assert value.bucket_counts == [90, 9, 0, 1]
+        assert value.sum == pytest.approx(0.05 * 90 + 0.5 * 9 + 20)
+        assert value.max == 20
+        # bucket upper bounds, the max past the last bucket
+        assert hist.quantile(0.5, channel='a') == 0.1
+        assert hist.quantile(0.99, channel='a') == 1
+        assert hist.quantile(1, channel='a') == 20
+
+    def test_render(self):
+        registry = MetricsRegistry()
+        counter = registry.register(Counter('test_total', 'A counter'))
+        hist = registry.register(Histogram('test_seconds', 'A histogram', buckets=(0.1, 1)))
+        counter.inc(2, channel='ch"1')
+        hist.observe(0.5, channel='ch1')
+
+        lines = registry.render().splitlines()
+        assert lines == [
+            '# HELP test_total A counter',
+            '# TYPE test_total counter',
+            'test_total{channel="ch\\"1"} 2',
+            '# HELP test_seconds A histogram',
+            '# TYPE test_seconds histogram',
+            'test_seconds_bucket{channel="ch1",le="0.1"} 0',
+            'test_seconds_bucket{channel="ch1",le="1"} 1',
+            'test_seconds_bucket{channel="ch1",le="+Inf"} 1',
+            'test_seconds_sum{channel="ch1"} 0.5',
+            'test_seconds_count{channel="ch1"} 1',
+        ]
+
+    def test_server(self):
+        metrics = IngestMetrics()
+        metrics.post_seconds.observe(0.2, channel='ch1')
+        server = MetricsServer(metrics.registry, 0)
+        try:
+            resp = requests.get('http://127.0.0.1:{}/metrics'.format(server.port))
+            assert resp.status_code == 200
+            assert resp.headers['Content-Type'].startswith('text/plain')
+            assert 'ndpush_post_seconds_count{channel="ch1"} 1' in resp.text
+
+            resp = requests.get('http://127.0.0.1:{}/other'.format(server.port))
+            assert resp.status_code == 404
+        finally:
+            server.stop()
+
+
+class TestPostCutoutMetrics:
+
+    def setup_method(self):
+        self.msgs = []
+        self.events = []
+        self.ingest_job = Namespace(
+            coll_name='coll', exp_name='exp', ch_name='ch1', res=0, boss_datatype='uint16',
+            num_POST_failures=0, block_tuner=None, metrics=IngestMetrics(), verify_samples=0,
+            send_msg=lambda msg, send_slack=False: self.msgs.append(msg),
+            log_msg=lambda msg: None,
+            record_event=lambda event, *args, **kwargs: self.events.append((event, kwargs)))
+
+    def test_post_cutout_metrics(self, monkeypatch):
+        monkeypatch.setattr('time.sleep', lambda seconds: None)
+        boss_res_params = FakeBossResParams(fail=1)
+        data = np.arange(16 * 64 * 64, dtype='uint16').reshape((16, 64, 64))
+
+        assert post_cutout(boss_res_params, self.ingest_job, [0, 64], [0, 64], [0, 16], data) == 0
+
+        # image blocks go to intern as they are (intern compresses them)
+        assert len(boss_res_params.posted) == 1
+        assert np.array_equal(boss_res_params.posted[0], data)
+
+        metrics = self.ingest_job.metrics
+        assert metrics.compress_seconds.get(channel='ch1') is None
+        assert metrics.post_seconds.get(channel='ch1').count == 1
+        assert metrics.post_retries.get(channel='ch1') == 1
+        assert metrics.post_failures.get(channel='ch1') == 0
+        assert metrics.posts_in_flight.get(channel='ch1') == 0
+        assert metrics.post_bytes.get(channel='ch1') == data.nbytes
+        assert metrics.post_compressed_bytes.get(channel='ch1') == 0
+        assert self.events[0][1]['status'] == 'ok'
+        # no hash without verification
+        assert self.events[0][1]['hash'] is None
+
+        summary = metrics.summary('ch1')
+        assert 'POST' in summary and 'compress' not in summary
+        assert '1 retries' in summary
+
+    def test_post_annotation_metrics(self):
+        self.ingest_job.boss_datatype = 'uint64'
+        boss_res_params = FakeBossResParams()
+        data = np.arange(16 * 64 * 64, dtype='uint32').reshape((16, 64, 64))
+
+        assert post_cutout(boss_res_params, self.ingest_job, [0, 64], [0, 64], [0, 16], data) == 0
+
+        # annotation blocks are compressed by ndpush, as uint64
+        assert blosc.decompress(boss_res_params.posted[0]) == data.astype('uint64').tobytes()
+        metrics = self.ingest_job.metrics
+        assert metrics.compress_seconds.get(channel='ch1').count == 1
+        assert metrics.post_compressed_bytes.get(channel='ch1') == len(boss_res_params.posted[0])
+        assert self.events[0][1]['compressed_bytes'] == len(boss_res_params.posted[0])
+        assert 'compress' in metrics.summary('ch1')
+
+    def test_post_cutout_failure_metrics(self, monkeypatch):
+        monkeypatch.setattr('time.sleep', lambda seconds: None)
+        data = np.ones((16, 64, 64), dtype='uint16')
+
+        assert post_cutout(FakeBossResParams(fail=3), self.ingest_job, [0, 64], [0, 64], [0, 16],
+                           data, attempts=3) == 1
+
+        metrics = self.ingest_job.metrics
+        assert metrics.post_retries.get(channel='ch1') == 2
+        assert metrics.post_failures.get(channel='ch1') == 1
+        assert metrics.posts_in_flight.get(channel='ch1') == 0
+        assert metrics.post_seconds.get(channel='ch1') is None
+        assert self.ingest_job.num_POST_failures == 1
@@ -0,0 +1,71 @@
+import numpy as np
+import pytest
+import requests
+from intern.remote.boss import BossRemote
+from intern.resource.boss.resource import (ChannelResource, CollectionResource,
+                                           CoordinateFrameResource, ExperimentResource)
+from requests import HTTPError
+
+from ndex.benchmarks.mock_boss import MockBoss
+from ndex.ndpull import boss_resources
+
+
+class TestMockBoss:
+
+    def setup_method(self):
+        self.boss = MockBoss().start()
+
+    def teardown_method(self):
+        self.boss.stop()
+
+    def create_channel(self, tmp_path, datatype='uint16'):
+        rmt = BossRemote(self.boss.write_config(str(tmp_path / 'mock.cfg')))
+        rmt.create_project(CollectionResource('coll'))
+        rmt.create_project(CoordinateFrameResource('coll_exp', '', 0, 1100, 0, 600, 0, 20,
+                                                   1, 1, 1, 'nanometers'))
+        rmt.create_project(ExperimentResource('exp', 'coll', 'coll_exp'))
+        ch = rmt.create_project(ChannelResource('ch', 'coll', 'exp', 'image', '', 0, datatype, 0))
+        return rmt, ch
+
+    def test_resources(self, tmp_path):
+        rmt, ch = self.create_channel(tmp_path)
+        assert ch.datatype == 'uint16'
+        assert rmt.get_project(CoordinateFrameResource('coll_exp')).x_stop == 1100
+        assert rmt.get_project(ExperimentResource('exp', 'coll')).coord_frame == 'coll_exp'
+
+        with pytest.raises(HTTPError):
+            rmt.get_project(ChannelResource('missing', 'coll', 'exp'))
+        with pytest.raises(HTTPError):
+            rmt.create_project(CollectionResource('coll'))
+
+        exp = rmt.get_project(ExperimentResource('exp', 'coll'))
+        rmt.create_metadata(exp, {'offsets': [1, 2, 3]})
+        assert rmt.get_metadata(exp, ['offsets']) == {'offsets': '[1, 2, 3]'}
+
+    def test_cutouts(self, tmp_path):
+        rmt, ch = self.create_channel(tmp_path)
+        data = np.random.randint(1, 1000, size=(20, 600, 1100), dtype='uint16')
+        rmt.create_cutout(ch, 0, [0, 1100], [0, 600], [0, 20], data)
+
+        # unaligned cutouts, zero where nothing was written
+        assert np.array_equal(rmt.get_cutout(ch, 0, [100, 1100], [3, 600], [1, 20]),
+                              data[1:, 3:, 100:])
+        assert not self.boss.read('coll', 'exp', 'ch', 0, [0, 1100], [0, 600], [20, 32], 'uint16').any()
+
+        rmt_pull = boss_resources.BossRemote(self.boss.url, self.boss.token,
+                                             boss_resources.BossMeta('coll', 'exp', 'ch'))
+        assert rmt_pull.get_xyz_extents() == ([0, 1100], [0, 600], [0, 20])
+        assert rmt_pull.downsample_status['status'] == 'NOT_DOWNSAMPLED'
+        assert np.array_equal(rmt_pull.cutout([500, 700], [0, 600], [15, 17], 'uint16'),
+                              data[15:17, :, 500:700])
+        assert self.boss.num_requests[('POST', 'cutout')] == 1
+
+    def test_errors(self, tmp_path):
+        self.create_channel(tmp_path)
+        url = self.boss.url + '/v1/cutout/coll/exp/ch/0/0:512/0:512/0:16/'
+        assert requests.get(url, headers={'Authorization': 'Token wrong'}).status_code == 401
+
+        headers = {'Authorization': 'Token {}'.format(self.boss.token)}
+        assert requests.get(url, headers=headers).status_code == 200
+        self.boss.error_rate = 1
+        assert requests.get(url, headers=headers).status_code == 503
@@ -1,3 +1,4 @@
+import io
 import os
 
 import blosc
@@ -304,3 +305,137 @@ class Testndpull():
             assert len(tif.pages) == result.z[1]-result.z[0]
 
         stack_fname.unlink()
+
+
+class TestMetadataCache():
+
+    def setup_method(self):
+        self.boss_url = 'http://localhost:1/'
+        self.token = 'not_a_token'
+        self.meta = BossMeta('coll', 'exp', 'ch')
+
+    def prime_cache(self, cache):
+        # fills the cache for every metadata endpoint BossRemote requests
+        metadata = {
+            'v1/collection/coll': {'name': 'coll'},
+            'v1/collection/coll/experiment/exp/': {'name': 'exp', 'coord_frame': 'coll_exp',
+                                                  'num_hierarchy_levels': 1},
+            'v1/collection/coll/experiment/exp/channel/ch/': {'name': 'ch', 'datatype': 'uint8'},
+            'v1/downsample/coll/exp/ch': {'status': 'DOWNSAMPLED'},
+            'v1/coord/coll_exp': {'x_start': 0, 'x_stop': 1024, 'y_start': 0, 'y_stop': 512,
+                                  'z_start': 0, 'z_stop': 32},
+        }
+        for url, data in metadata.items():
+            cache.set(' '.join((self.boss_url, url, self.token)), data)
+
+    def test_set_get(self, tmp_path):
+        cache = MetadataCache(str(tmp_path))
+        cache.set('key', {'a': 1})
+        assert cache.get('key') == {'a': 1}
+        assert cache.get('other_key') is None
+
+    def test_expired(self, tmp_path):
+        cache = MetadataCache(str(tmp_path), ttl=10)
+        cache.set('key', {'a': 1})
+
+        # age the entry past the ttl
+        fname = cache.get_fname('key')
+        with fname.open() as f:
+            entry = json.load(f)
+        entry['time'] -= 11
+        with fname.open('w') as f:
+            json.dump(entry, f)
+
+        assert cache.get('key') is None
+
+    def test_disabled(self, tmp_path):
+        cache = MetadataCache(str(tmp_path), ttl=0)
+        cache.set('key', {'a': 1})
+        assert cache.get('key') is None
+        assert not cache.cache_path.exists()
+
+    def test_remote_from_cache(self, tmp_path):
+        cache = MetadataCache(str(tmp_path))
+        self.prime_cache(cache)
+
+        # nothing listens on the url, so all metadata has to come from the cache
+        rmt = BossRemote(self.boss_url, self.token,
+                         self.meta, metadata_cache=cache)
+        assert rmt.boss_ch_metadata['datatype'] == 'uint8'
+        assert rmt.downsample_status['status'] == 'DOWNSAMPLED'
+        assert rmt.get_xyz_extents() == ([0, 1024], [0, 512], [0, 32])
+        assert 'Coordinate frame metadata' in str(rmt)
+
+    def test_fetch_cutout_closes_responses(self, tmp_path, monkeypatch):
+        cache = MetadataCache(str(tmp_path))
+        self.prime_cache(cache)
+        rmt = BossRemote(self.boss_url, self.token, self.meta, metadata_cache=cache)
+        monkeypatch.setattr(time, 'sleep', lambda seconds: None)
+
+        data = np.arange(2 * 4 * 8, dtype='uint8').reshape(2, 4, 8)
+        compressed = blosc.compress(data.tobytes(), typesize=1)
+        # a 503 and a truncated body before the data
+        responses = [FakeResponse(b'', {}, status_code=503),
+                     FakeResponse(compressed[:-5], {'Content-Length': str(len(compressed))}),
+                     FakeResponse(compressed, {'Content-Length': str(len(compressed))})]
+        pending = list(responses)
+        monkeypatch.setattr(rmt, 'get', lambda url, headers={}, stream=False: pending.pop(0))
+
+        assert np.array_equal(rmt.fetch_cutout([0, 8], [0, 4], [0, 2], 'uint8'), data)
+        assert all(resp.closed for resp in responses)
+
+        pending = [FakeResponse(b'', {}, status_code=503) for _ in range(2)]
+        with pytest.raises(ConnectionError, match='0:8/0:4/0:2'):
+            rmt.fetch_cutout([0, 8], [0, 4], [0, 2], 'uint8', attempts=2)
+
+
+class FakeResponse:
+    def __init__(self, content, headers, status_code=200):
+        self.raw = io.BytesIO(content)
+        self.headers = headers
+        self.content = content
+        self.status_code = status_code
+        self.reason = 'Service Unavailable' if status_code == 503 else 'OK'
+        self.closed = False
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise requests.HTTPError(self.reason)
+
+    def close(self):
+        self.closed = True
+
+
+class TestDecode():
+
+    def setup_method(self):
+        self.data = np.random.randint(0, 2**16, size=(4, 30, 50), dtype='uint16')
+        self.compressed = blosc.compress(self.data.tobytes(), typesize=2)
+
+    def test_read_response_streamed(self):
+        resp = FakeResponse(self.compressed, {
+            'Content-Length': str(len(self.compressed))})
+        assert bytes(read_response(resp)) == self.compressed
+
+    def test_read_response_truncated(self):
+        resp = FakeResponse(self.compressed[:-10], {
+            'Content-Length': str(len(self.compressed))})
+        with pytest.raises(ConnectionError):
+            read_response(resp)
+
+    def test_decompress_into(self):
+        out = np.empty(self.data.shape, dtype=self.data.dtype)
+        decompress_into(memoryview(bytearray(self.compressed)), out)
+        assert np.array_equal(out, self.data)
+
+    def test_decompress_into_view(self):
+        # non contiguous destinations still receive the data
+        data = np.zeros((4, 30, 100), dtype=self.data.dtype)
+        decompress_into(self.compressed, data[:, :, 25:75])
+        assert np.array_equal(data[:, :, 25:75], self.data)
+        assert not data[:, :, :25].any()
+
+    def test_decompress_into_wrong_size(self):
+        out = np.empty((4, 30, 49), dtype=self.data.dtype)
+        with pytest.raises(ValueError):
+            decompress_into(self.compressed, out)
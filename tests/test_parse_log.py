@@ -3,6 +3,7 @@ import time
 
 import pytest
 
+from ndex.ndpush.event_log import EventLog
 from ndex.ndpush.parse_log import *
 
 
@@ -39,3 +40,70 @@ Create cutout failed on Ch0, got HTTP response: (400) - {"message": "Error durin
         # cleanup
         os.remove(repeatfile)
         os.remove(logfile)
+
+    def test_parse_log_list_ranges(self):
+        # post_cutout logs ranges as lists, failures can be repeated and succeed later
+        log_data = '''2019-01-01 00:00:00 Error: data upload failed after multiple attempts, skipping. Coll: c, Exp: e, Ch: ch, x: [0, 512], y: [0, 512], z: [0, 16]
+2019-01-01 00:00:00 Error: data upload failed after multiple attempts, skipping. Coll: c, Exp: e, Ch: ch, x: [512, 1024], y: [0, 512], z: [0, 16]
+2019-01-01 00:00:00 Block empty for Collection: c, Experiment: e, Channel: ch x/y/z: [0, 512]/[512, 1024]/[0, 16], skipping
+2019-01-01 00:00:00 Error: data upload failed after multiple attempts, skipping. Coll: c, Exp: e, Ch: ch, x: [512, 1024], y: [0, 512], z: [0, 16]
+2019-01-01 00:00:00 POST succeeded in 1.00 sec. Coll: c, Exp: e, Ch: ch, x: (0, 512), y: (0, 512), z: (0, 16)
+'''
+
+        logfile = 'log_test_lists.txt'
+        with open(logfile, 'w') as f:
+            f.write(log_data)
+
+        repeatfile = parse_log(logfile, 'repeat_cutouts_test_lists.txt')
+        with open(repeatfile, 'r') as f:
+            repeatdata = f.readlines()
+
+        assert repeatdata == [
+            'Coll: c, Exp: e, Ch: ch, x: [512, 1024], y: [0, 512], z: [0, 16]\n']
+
+        # cleanup
+        os.remove(repeatfile)
+        os.remove(logfile)
+
+    def test_parse_cutout(self):
+        line = 'POST succeeded in 1.00 sec. Coll: c, Exp: e, Ch: ch, x: (0, 512), y: [512, 1024], z: (16, 32)\n'
+        text, key = parse_cutout(line)
+        assert text == 'Coll: c, Exp: e, Ch: ch, x: (0, 512), y: [512, 1024], z: (16, 32)'
+        assert key == ('c', 'e', 'ch', (0, 512), (512, 1024), (16, 32))
+        assert parse_cutout('no cutout here') is None
+
+    def test_parse_event_log(self, tmp_path):
+        eventfile = str(tmp_path / 'events.jsonl')
+        event_log = EventLog(eventfile)
+        cutout = {'coll': 'c', 'exp': 'e', 'ch': 'ch', 'y': [0, 512], 'z': [0, 16]}
+        event_log.record('post', x=[0, 512], status='failed', **cutout)
+        event_log.record('post', x=[512, 1024], status='failed', **cutout)
+        event_log.record('empty', x=[1024, 1536], **cutout)
+        event_log.record('post', x=[0, 512], status='ok', **cutout)
+        event_log.flush()
+
+        assert get_failed_cutouts(eventfile) == [
+            ('c', 'e', 'ch', (512, 1024), (0, 512), (0, 16))]
+
+        repeatfile = parse_event_log(eventfile, str(tmp_path / 'repeat.txt'))
+        with open(repeatfile) as f:
+            repeatdata = f.readlines()
+        assert repeatdata == [
+            'Coll: c, Exp: e, Ch: ch, x: [512, 1024], y: [0, 512], z: [0, 16]\n']
+        # the repeat file can be read back by the text parser
+        assert parse_cutout(repeatdata[0])[1] == get_failed_cutouts(eventfile)[0]
+
+    def test_failed_verification(self, tmp_path):
+        eventfile = str(tmp_path / 'events.jsonl')
+        event_log = EventLog(eventfile)
+        cutout = {'coll': 'c', 'exp': 'e', 'ch': 'ch', 'y': [0, 512], 'z': [0, 16]}
+        event_log.record('post', x=[0, 512], status='ok', **cutout)
+        event_log.record('post', x=[512, 1024], status='ok', **cutout)
+        event_log.record('verify', x=[0, 512], status='mismatch', **cutout)
+        event_log.record('verify', x=[512, 1024], status='mismatch', **cutout)
+        # re-POSTed after the verification
+        event_log.record('post', x=[512, 1024], status='ok', **cutout)
+        event_log.flush()
+
+        assert get_failed_cutouts(eventfile) == [
+            ('c', 'e', 'ch', (0, 512), (0, 512), (0, 16))]
@@ -0,0 +1,94 @@
+import os
+import pstats
+import time
+from multiprocessing.dummy import Pool as ThreadPool
+
+import numpy as np
+import tifffile
+
+from ndex.benchmarks.mock_boss import MockBoss
+from ndex.ndpull import ndpull
+from ndex.ndpull.boss_resources import BossRemote
+from ndex.ndpush import ingest_large_vol
+from ndex.profiler import Profiler, thread_time
+
+
+class Stages:
+    def decode(self, seconds):
+        # busy: CPU time close to the wall time
+        end_time = thread_time() + seconds
+        while thread_time() < end_time:
+            pass
+
+    def wait(self, seconds):
+        # idle, like waiting on the network
+        time.sleep(seconds)
+
+    def block(self, seconds):
+        self.decode(seconds)
+        self.wait(seconds)
+
+
+class TestProfiler:
+
+    def test_profile_threads(self, tmp_path):
+        prefix = str(tmp_path / 'profile')
+        stages = Stages()
+        decode = Stages.decode
+        targets = [(Stages, 'block'), (Stages, 'decode'), (Stages, 'wait')]
+
+        with Profiler(targets, prefix) as profiler:
+            with ThreadPool(4) as pool:
+                pool.map(stages.block, [0.02] * 8)
+        # the functions are restored
+        assert Stages.decode is decode
+
+        stats = profiler.stats
+        assert stats['Stages.block'].calls == stats['Stages.decode'].calls == 8
+        assert stats['Stages.wait'].wall >= 8 * 0.02
+        assert stats['Stages.wait'].cpu < stats['Stages.wait'].wall / 2
+        # the 4 threads decoding (pure python) share the GIL, so they're partly off the CPU
+        assert 0 < stats['Stages.decode'].cpu <= stats['Stages.decode'].wall
+        # inclusive times
+        assert stats['Stages.block'].wall >= stats['Stages.decode'].wall + stats['Stages.wait'].wall
+
+        with open(prefix + '.txt') as f:
+            report = f.read()
+        assert report.splitlines()[1].startswith('Stages.block')
+        assert 'cores busy' in report
+
+        # the worker threads are in the cProfile stats
+        functions = {func for _, _, func in pstats.Stats(prefix + '.prof').stats}
+        assert 'decode' in functions and 'wait' in functions
+
+    def test_profile_targets(self):
+        for owner, name in ingest_large_vol.get_profile_targets() + ndpull.get_profile_targets():
+            assert callable(getattr(owner, name))
+
+    def test_profile_pull(self, tmp_path):
+        data = np.random.RandomState(0).randint(0, 255, size=(16, 512, 1024), dtype='uint8')
+        with MockBoss() as boss:
+            boss.add_channel('coll', 'exp', 'ch', x_extent=(0, 1024), y_extent=(0, 512))
+            boss.write('coll', 'exp', 'ch', 0, [0, 1024], [0, 512], [0, 16], data)
+            config_file = boss.write_config(str(tmp_path / 'mock.cfg'))
+
+            result = ndpull.collect_input_args('coll', 'exp', 'ch', config_file=config_file,
+                                               outdir=str(tmp_path), full_extent=True,
+                                               cache_dir=str(tmp_path / 'cache'))
+            result, rmt = ndpull.validate_args(result)
+            prefix = str(tmp_path / 'ndpull_profile')
+            with Profiler(ndpull.get_profile_targets(), prefix) as profiler:
+                ndpull.download_slices(result, rmt, threads=2)
+
+        assert BossRemote.cutout.__name__ == 'cutout'
+        assert not hasattr(BossRemote.cutout, '__wrapped__')
+        stats = profiler.stats
+        assert stats['ndpull.save_to_tiffs'].calls == 1
+        assert stats['BossRemote.cutout'].calls == stats['boss_resources.read_response'].calls
+        assert stats['boss_resources.decompress_into'].calls >= 1
+        assert os.path.exists(prefix + '.prof')
+
+        # profiling doesn't change the download
+        fnames = sorted(tmp_path.glob('*.tif'))
+        assert len(fnames) == 16
+        assert np.array_equal(tifffile.imread(str(fnames[3])), data[3])
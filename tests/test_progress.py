@@ -0,0 +1,121 @@
+import os
+import tempfile
+from argparse import Namespace
+from multiprocessing.dummy import Pool as ThreadPool
+
+import numpy as np
+
+from ndex.ndpush.ingest_large_vol import ingest_block, start_progress
+from ndex.ndpush.metrics import IngestMetrics
+from ndex.ndpush.progress import (IngestProgress, format_status, print_status, read_status_file,
+                                  summarize_status)
+
+
+def get_status(total_bytes, done_bytes, blocks, start_time, updated, done=False, empty=0, failed=0):
+    return {'name': 'ch', 'total_bytes': total_bytes, 'done_bytes': done_bytes, 'blocks': blocks,
+            'empty_blocks': empty, 'failed_blocks': failed, 'start_time': start_time,
+            'updated': updated, 'done': done}
+
+
+class TestProgress:
+
+    def setup_method(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.status_file = os.path.join(self.tmpdir.name, 'status.json')
+
+    def teardown_method(self):
+        self.tmpdir.cleanup()
+
+    def test_update_threads(self):
+        progress = IngestProgress('ch1', show_bar=False)
+        progress.add_total(300 * 1024)
+        statuses = ['ok', 'ok', 'empty', 'failed'] * 75
+
+        with ThreadPool(8) as pool:
+            pool.map(lambda status: progress.update(1024, status), statuses)
+        progress.close()
+
+        status = progress.get_status()
+        assert status['total_bytes'] == status['done_bytes'] == 300 * 1024
+        assert status['blocks'] == 300
+        assert status['empty_blocks'] == status['failed_blocks'] == 75
+
+    def test_status_file(self):
+        # two workers (processes) sharing the status file
+        worker1 = IngestProgress('ch1 z 0-16', status_file=self.status_file, show_bar=False,
+                                 key='worker1', status_interval=0)
+        worker2 = IngestProgress('ch1 z 16-32', status_file=self.status_file, show_bar=False,
+                                 key='worker2', status_interval=0)
+        worker1.add_total(1000)
+        worker2.add_total(3000)
+        worker1.update(1000, 'ok')
+        worker1.close()
+        worker2.update(1000, 'empty')
+        worker2.update(500, 'failed')
+
+        statuses = read_status_file(self.status_file)
+        assert set(statuses) == {'worker1', 'worker2'}
+        assert statuses['worker1']['done'] and not statuses['worker2']['done']
+        assert worker2.workers_msg.startswith('62% ETA')
+
+        summary = summarize_status(statuses)
+        assert summary['workers'] == 2 and summary['active'] == 1
+        assert summary['total_bytes'] == 4000 and summary['done_bytes'] == 2500
+        assert summary['blocks'] == 3
+        assert summary['empty_blocks'] == summary['failed_blocks'] == 1
+
+    def test_summarize_status(self):
+        now = 1000
+        statuses = {
+            # 10 bytes/s, 50 s left
+            'a': get_status(1000, 500, 5, now - 50, now),
+            # 20 bytes/s, 25 s left
+            'b': get_status(1000, 500, 10, now - 25, now),
+            'done': get_status(1000, 1000, 10, now - 500, now - 400, done=True),
+            'stalled': get_status(1000, 10, 1, now - 5000, now - 4000),
+        }
+        summary = summarize_status(statuses, now)
+        assert summary['active'] == 2 and summary['stalled'] == 1
+        assert summary['bytes_per_sec'] == 30
+        assert summary['eta_seconds'] == 50
+        assert summary['fraction'] == 2010 / 4000
+
+        assert format_status(statuses['done'], now) == \
+            '100.0% of 0.0 GB, 0.0 MB/s, 0.1 blocks/s, 0% empty, 0 failed'
+
+    def test_print_status(self, capsys):
+        print_status(self.status_file)
+        assert 'No progress' in capsys.readouterr().out
+
+        worker = IngestProgress('ch1 z 0-16', status_file=self.status_file, show_bar=False,
+                                key='worker1')
+        worker.add_total(1024**3)
+        worker.update(1024**3 // 2, 'ok')
+        worker.write_status()
+        print_status(self.status_file)
+        out = capsys.readouterr().out.splitlines()
+        assert out[0].startswith('ch1 z 0-16 (worker1, running): 50.0% of 1.0 GB')
+        assert out[1].startswith('Total (1 of 1 workers running): 50.0% of 1.0 GB')
+
+    def test_ingest_block_progress(self, monkeypatch):
+        ingest_job = Namespace(coll_name='coll', exp_name='exp', ch_name='ch1', boss_datatype='uint16',
+                               x_extent=[0, 1024], y_extent=[0, 512], z_range=[0, 16],
+                               metrics=IngestMetrics(), log_msg=lambda msg: None,
+                               record_event=lambda *args, **kwargs: None)
+        progress = start_progress(Namespace(no_progress=True), [ingest_job])
+        assert progress.total_bytes == 1024 * 512 * 16 * 2
+
+        posted = []
+        monkeypatch.setattr('ndex.ndpush.ingest_large_vol.post_cutout',
+                            lambda *args, **kwargs: posted.append(args))
+        im_array = np.zeros((16, 512, 1024), dtype='uint16')
+        im_array[:, :, 512:] = 1
+        x_buckets = {0: list(range(512)), 1: list(range(512, 1024))}
+        for x_key in x_buckets:
+            ingest_block(x_key, x_buckets, None, ingest_job, [0, 512], [0, 16], im_array)
+
+        # first block is empty, the second is POSTed
+        status = progress.get_status()
+        assert status['done_bytes'] == progress.total_bytes
+        assert status['blocks'] == 2 and status['empty_blocks'] == 1
+        assert status['failed_blocks'] == 0 and len(posted) == 1
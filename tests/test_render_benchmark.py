@@ -0,0 +1,25 @@
+from ndex.benchmarks.mock_render import MockRender
+from ndex.benchmarks.render_benchmark import benchmark_render
+
+
+class TestRenderBenchmark:
+
+    def setup_method(self):
+        self.render = MockRender().start()
+        self.render.add_stack('owner', 'project', 'stack', (0, 2048), (0, 1024), (0, 2))
+
+    def teardown_method(self):
+        self.render.stop()
+
+    def test_benchmark_render(self):
+        results = benchmark_render(self.render.url, 'owner', 'project', 'stack', 'uint8',
+                                   scales=[1, 0.5], tile_sizes=[512, 1024], threads_list=[1, 4],
+                                   num_runs=2)
+
+        assert [(r['scale'], r['tile_size'], r['threads']) for r in results] == [
+            (scale, tile_size, threads) for scale in (1, 0.5) for tile_size in (512, 1024)
+            for threads in (1, 4)]
+        # 2048x1024 slice at scale 1 in 512 tiles, at scale 0.5 (1024x512) in a single 1024 tile
+        assert results[0]['tiles'] == 8
+        assert results[-1]['tiles'] == 1
+        assert all(r['MB/s'] > 0 and r['p99_ms'] >= r['p50_ms'] > 0 for r in results)
@@ -5,7 +5,12 @@ import pytest
 import requests
 from PIL import Image
 
-from ndex.ndpush.render_resource import renderResource
+from ndex.benchmarks.mock_render import MockRender, render_box
+from ndex.ndpush.render_resource import (
+    benchmark_get_img,
+    benchmark_get_tile,
+    renderResource,
+)
 
 try:
     r = requests.get("http://render-dev-eric.neurodata.io")
@@ -285,3 +290,72 @@ class TestRenderResource:
 
         assert data.shape == (y_width * self.scale, x_width * self.scale)
         assert np.array_equal(data, test_data)
+
+
+class TestRenderResourceMock:
+    def setup_method(self):
+        self.render = MockRender().start()
+        self.owner = "mock_owner"
+        self.project = "mock_project"
+        self.stack = "mock_stack"
+        self.x_rng = [-1000, 3000]
+        self.y_rng = [0, 2500]
+        self.z_rng = [0, 4]
+        self.render.add_stack(
+            self.owner,
+            self.project,
+            self.stack,
+            self.x_rng,
+            self.y_rng,
+            self.z_rng,
+            channels=["DAPI1"],
+        )
+        self.stack_bounds = self.render.stacks[(self.owner, self.project, self.stack)]
+
+    def teardown_method(self):
+        self.render.stop()
+
+    def create_render_obj(self, datatype="uint8", **kwargs):
+        return renderResource(
+            self.owner, self.project, self.stack, self.render.url, datatype, **kwargs
+        )
+
+    def test_create_render_resource(self):
+        render_obj = self.create_render_obj(scale=0.5, channel="DAPI1")
+        assert render_obj.x_rng == [-500, 1500]
+        assert render_obj.y_rng == [0, 1250]
+        assert render_obj.z_rng == self.z_rng
+
+        with pytest.raises(AssertionError):
+            self.create_render_obj(channel="notAchannel")
+        with pytest.raises(ConnectionError):
+            renderResource(self.owner, self.project, "DOES_NOT_EXIST", self.render.url, "uint8")
+
+    def test_get_render_tile(self):
+        render_obj = self.create_render_obj()
+        data = render_obj.get_render_tile(2, 100, 200, 512, 256, window=[0, 10000])
+        assert data.shape == (256, 512)
+        assert np.array_equal(
+            data,
+            render_box(self.stack_bounds, 2, 100, 200, 512, 256, 1, "png", [0, 10000]),
+        )
+
+        render_obj = self.create_render_obj("uint16", scale=0.25)
+        data = render_obj.get_render_tile(2, 100, 200, 512, 256)
+        assert data.dtype == np.uint16
+        assert np.array_equal(
+            data, render_box(self.stack_bounds, 2, 100, 200, 512, 256, 0.25, "tiff16")
+        )
+
+    def test_get_render_img(self):
+        # tiles are assembled into the full slice (cropped to the stack bounds)
+        render_obj = self.create_render_obj("uint16")
+        im_array = render_obj.get_render_img(1, threads=4, tile_size=1024)
+        expected = render_box(self.stack_bounds, 1, -1000, 0, 4000, 2500, 1, "tiff16")
+        assert np.array_equal(im_array, expected)
+        assert self.render.num_requests == 1 + 4 * 3
+
+    def test_benchmarks(self):
+        render_obj = self.create_render_obj()
+        assert benchmark_get_tile(render_obj, 512, num_runs=2) > 0
+        assert benchmark_get_img(render_obj, 2, num_runs=2, tile_size=2048) > 0
@@ -1,3 +1,4 @@
+import json
 import os
 from argparse import Namespace
 from datetime import datetime
@@ -8,7 +9,10 @@ import pytest
 from create_images import del_test_images, gen_images
 from ndex.ndpush.boss_resources import BossResParams
 from ndex.ndpush.ingest_job import IngestJob
-from ndex.ndpush.repeat_cutouts import Cutout, ingest_cuts, parse_cut_line
+from ndex.ndpush import repeat_cutouts
+from ndex.ndpush.repeat_cutouts import (Cutout, ImgData, StackCache, get_source_args,
+                                        group_cutouts, ingest_cuts, parse_cut_line,
+                                        plan_retries)
 
 
 class TestRepeatCutouts:
@@ -142,3 +146,140 @@ def create_local_ingest_params():
     z_step = 1
     datatype = 'uint16'
     return source_type, s3_bucket_name, aws_profile, boss_config_file, data_directory, file_name_pattern, img_format, z_step, datatype
+
+
+class FakeIngestJob:
+    # serves a deterministic stack and records the reads
+    def __init__(self):
+        self.coll_name, self.exp_name, self.ch_name = 'coll', 'exp', 'ch'
+        self.x_extent, self.y_extent, self.z_extent = [0, 1024], [0, 512], [0, 48]
+        self.reads = []
+
+    def read_img_stack(self, z_slices, threads=1):
+        self.reads.append(list(z_slices))
+        return fake_stack(z_slices)
+
+
+def fake_stack(z_slices):
+    z, y, x = np.meshgrid(z_slices, np.arange(512), np.arange(1024), indexing='ij')
+    return (x + y + z).astype('uint16')
+
+
+class TestRepeatBatch:
+
+    def setup_method(self):
+        self.cutouts = [Cutout('coll', 'exp', 'ch', [x, x + 512], [0, 512], z)
+                        for z in ([16, 32], [0, 16], [16, 24]) for x in (0, 512)]
+
+    def teardown_method(self):
+        if os.path.isfile(self.cutouts[0].log_fname):
+            os.remove(self.cutouts[0].log_fname)
+
+    def test_group_cutouts(self):
+        groups = group_cutouts(self.cutouts)
+        assert [[cut.z for cut in group] for group in groups] == [
+            [[0, 16], [0, 16]], [[16, 32], [16, 32], [16, 24], [16, 24]]]
+
+    def test_ingest_cuts(self, monkeypatch):
+        posted = []
+
+        def fake_post(boss_res_params, ingest_job, x_rng, y_rng, z_rng, data, attempts=5):
+            posted.append((x_rng, z_rng))
+            expected = fake_stack(range(*z_rng))[:, :, x_rng[0]:x_rng[1]]
+            assert np.array_equal(data, expected)
+            return 0
+
+        monkeypatch.setattr(repeat_cutouts, 'post_cutout', fake_post)
+        ingest_job = FakeIngestJob()
+        ingest_cuts(self.cutouts, ingest_job, None, threads=1)
+
+        # each stack read once
+        assert ingest_job.reads == [list(range(0, 16)), list(range(16, 32))]
+        assert len(posted) == len(self.cutouts)
+
+    def test_retry_from_cache(self, monkeypatch):
+        posted = []
+
+        def fake_post(boss_res_params, ingest_job, x_rng, y_rng, z_rng, data, attempts=5):
+            posted.append((x_rng, z_rng))
+            # the first POST of each cutout fails
+            return 0 if posted.count((x_rng, z_rng)) > 1 else 1
+
+        monkeypatch.setattr(repeat_cutouts, 'post_cutout', fake_post)
+        ingest_job = FakeIngestJob()
+        ingest_cuts(self.cutouts, ingest_job, None, threads=2, passes=3)
+
+        # the second pass is served from the cache, there's no third pass
+        assert ingest_job.reads == [list(range(0, 16)), list(range(16, 32))]
+        assert len(posted) == 2 * len(self.cutouts)
+
+    def test_retry_cached_stacks_first(self, monkeypatch):
+        posted = []
+
+        def fake_post(boss_res_params, ingest_job, x_rng, y_rng, z_rng, data, attempts=5):
+            posted.append(z_rng)
+            # the first POST of each cutout fails
+            return 0 if posted.count(z_rng) > 1 else 1
+
+        monkeypatch.setattr(repeat_cutouts, 'post_cutout', fake_post)
+        cutouts = [Cutout('coll', 'exp', 'ch', [0, 512], [0, 512], [z, z + 16]) for z in (0, 16, 32)]
+        ingest_job = FakeIngestJob()
+        # room for a single stack, the last one read in the first pass
+        cache = StackCache(max_bytes=fake_stack(range(16)).nbytes)
+        ingest_cuts(cutouts, ingest_job, None, threads=1, passes=2, cache=cache)
+
+        # the second pass starts with the cached stack, the others are read again
+        assert ingest_job.reads == [list(range(z, z + 16)) for z in (0, 16, 32, 0, 16)]
+        assert posted[3:] == [[32, 48], [0, 16], [16, 32]]
+
+    def test_plan_retries(self):
+        cutouts = self.cutouts + [Cutout('coll', 'exp', 'ch', [0, 512], [0, 512], [8, 20])]
+        plan = plan_retries(cutouts)
+        assert [(z_rng, len(group)) for z_rng, group in plan] == [([0, 32], 7)]
+
+        plan = plan_retries(self.cutouts[:2] + [Cutout('coll', 'exp', 'ch', [0, 512], [0, 512], [40, 48])])
+        assert [z_rng for z_rng, _ in plan] == [[16, 32], [40, 48]]
+
+    def test_stack_cache(self):
+        stack = np.zeros((16, 8, 8), dtype='uint8')
+        cache = StackCache(max_bytes=2 * stack.nbytes)
+        cache.put(ImgData(stack, [0, 16]))
+        cache.put(ImgData(stack.copy(), [16, 32]))
+
+        assert cache.get([4, 12]).z_rng == [0, 16]
+        assert cache.get([8, 24]) is None
+
+        # [16, 32] is the least recently used
+        cache.put(ImgData(stack.copy(), [32, 48]))
+        assert cache.get([16, 32]) is None
+        assert cache.get([0, 16]) is not None
+        assert cache.nbytes == 2 * stack.nbytes
+        assert cache.contains([32, 40]) and not cache.contains([16, 32])
+
+    def test_source_args(self, tmp_path):
+        manifest = tmp_path / 'manifest.json'
+        manifest.write_text(json.dumps({'datasource': 'local', 'base_path': 'imgs/'}))
+
+        args = Namespace(manifest=str(manifest), datasource=None)
+        assert get_source_args(args, 'coll', 'exp', 'ch').base_path == 'imgs/'
+
+        args = Namespace(manifest=None, datasource='s3', s3_bucket_name='bucket', aws_profile='default',
+                         boss_config_file=None, base_path='imgs/', base_filename='img_<p:4>',
+                         extension='tif', z_step=1)
+        source_args = get_source_args(args, 'coll', 'exp', 'ch')
+        assert source_args.s3_bucket_name == 'bucket'
+        assert source_args.warn_missing_files
+
+    def test_source_args_several_channels(self, tmp_path, monkeypatch):
+        monkeypatch.chdir(tmp_path)
+        manifest = tmp_path / 'manifest.json'
+        manifest.write_text(json.dumps({'datasource': 'local', 'base_path': 'imgs/'}))
+        args = Namespace(manifest=str(manifest), datasource=None)
+
+        # the manifest isn't applied to the other channels, they need one of their own
+        with pytest.raises(ValueError):
+            get_source_args(args, 'coll', 'exp', 'ch1', single_channel=False)
+
+        (tmp_path / 'ingest_manifest_coll_exp_ch1.json').write_text(
+            json.dumps({'datasource': 'local', 'base_path': 'imgs_ch1/'}))
+        assert get_source_args(args, 'coll', 'exp', 'ch1', single_channel=False).base_path == 'imgs_ch1/'
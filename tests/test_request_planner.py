@@ -0,0 +1,109 @@
+import argparse
+
+import numpy as np
+import tifffile as tiff
+
+from ndex.ndpull.boss_resources import BossMeta
+from ndex.ndpull.ndpull import download_slices, gen_tif_fname
+from ndex.request_planner import get_request_shape, plan_cutouts, plan_ranges, plan_strips
+
+
+class FakeRemote:
+    # stands in for BossRemote, serving a deterministic volume
+    def __init__(self, extents, datatype='uint8'):
+        self.meta = BossMeta('coll', 'exp', 'ch')
+        self.boss_ch_metadata = {'datatype': datatype}
+        self.extents = extents
+        self.requests = []
+        # whether each cutout was decoded into a contiguous output buffer
+        self.in_place = []
+
+    def get_xyz_extents(self):
+        return self.extents
+
+    def cutout(self, x_rng, y_rng, z_rng, datatype, out=None):
+        self.requests.append([x_rng, y_rng, z_rng])
+        z, y, x = np.meshgrid(np.arange(*z_rng), np.arange(*y_rng), np.arange(*x_rng),
+                              indexing='ij')
+        data = ((x + 3 * y + 7 * z) % 251).astype(datatype)
+        self.in_place.append(out is not None and out.flags['C_CONTIGUOUS'])
+        if out is not None:
+            out[...] = data
+            return out
+        return data
+
+
+class TestRequestPlanner:
+
+    def test_request_shape(self):
+        assert get_request_shape('uint8') == (2048, 2048, 16)
+        assert get_request_shape('uint16') == (1024, 2048, 16)
+        assert get_request_shape('uint64') == (512, 1024, 16)
+        # never smaller than a cuboid
+        assert get_request_shape('uint64', target_mb=1) == (512, 512, 16)
+
+    def test_plan_ranges(self):
+        assert plan_ranges([100, 1100], 1024, 512) == [[0, 1024], [1024, 1536]]
+        assert plan_ranges([100, 1100], 1024, 512, [50, 1200]) == [
+            [50, 1024], [1024, 1200]]
+        assert plan_ranges([3, 16], 16, 16) == [[0, 16]]
+
+    def test_plan_cutouts_aligned(self):
+        cutouts = plan_cutouts([100, 2100], [600, 700], [3, 10],
+                               (2048, 2048, 16))
+        assert cutouts == [[[0, 2048], [512, 1024], [0, 16]],
+                           [[2048, 2560], [512, 1024], [0, 16]]]
+
+    def test_plan_strips(self):
+        # whole cuboid rows if they fit the target size, full (cuboid aligned) width and depth
+        assert plan_strips([100, 2100], [600, 1700], [3, 10], 'uint8', 32,
+                           extents=[[0, 2200], [0, 2000], [0, 20]]) == [
+            [[0, 2200], [512, 1024], [0, 16]], [[0, 2200], [1024, 1536], [0, 16]],
+            [[0, 2200], [1536, 2000], [0, 16]]]
+        # rows of a power of 2 if a cuboid row is too big, no request crosses a cuboid boundary
+        assert plan_strips([0, 20000], [500, 600], [0, 16], 'uint8') == [
+            [[0, 20480], [384, 512], [0, 16]], [[0, 20480], [512, 640], [0, 16]]]
+
+    def test_download_slices_in_place(self, tmp_path):
+        # a section of several strips, each decoded straight into its buffer
+        rmt = FakeRemote(([0, 3000], [0, 1000], [0, 20]))
+        result = argparse.Namespace(x=[100, 2900], y=[30, 990], z=[3, 10], outdir=str(tmp_path),
+                                    force_datatype=False, request_size_mb=0.5)
+
+        download_slices(result, rmt, threads=2)
+
+        assert len(rmt.requests) > 1 and all(rmt.in_place)
+        for z in (3, 9):
+            data = tiff.imread(str(tmp_path / gen_tif_fname(rmt.meta, result, z, 2)))
+            assert np.array_equal(data, rmt.cutout(result.x, result.y, [z, z + 1], 'uint8')[0])
+
+    def test_download_slices_crops(self, tmp_path):
+        rmt = FakeRemote(([0, 3000], [0, 1000], [0, 20]))
+        result = argparse.Namespace(x=[100, 2100], y=[600, 700], z=[3, 10],
+                                    outdir=str(tmp_path), force_datatype=False)
+
+        download_slices(result, rmt, threads=2)
+
+        # all requests are on cuboid boundaries (or the extent of the data)
+        for x_rng, y_rng, z_rng in rmt.requests:
+            assert x_rng[0] % 512 == 0 and y_rng[0] % 512 == 0 and z_rng[0] % 16 == 0
+
+        for z in range(*result.z):
+            fname = gen_tif_fname(rmt.meta, result, z, 2)
+            data = tiff.imread(str(tmp_path / fname))
+            expected = rmt.cutout(result.x, result.y, [z, z + 1], 'uint8')[0]
+            assert np.array_equal(data, expected)
+
+    def test_download_slices_aligned(self, tmp_path):
+        rmt = FakeRemote(([0, 4096], [0, 1024], [0, 32]))
+        result = argparse.Namespace(x=[0, 4096], y=[0, 512], z=[0, 16],
+                                    outdir=str(tmp_path), force_datatype=False)
+
+        download_slices(result, rmt, threads=2)
+
+        # a single full width strip
+        assert rmt.requests == [[[0, 4096], [0, 512], [0, 16]]]
+        fname = gen_tif_fname(rmt.meta, result, 15, 2)
+        data = tiff.imread(str(tmp_path / fname))
+        expected = rmt.cutout(result.x, result.y, [15, 16], 'uint8')[0]
+        assert np.array_equal(data, expected)
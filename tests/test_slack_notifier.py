@@ -0,0 +1,89 @@
+import gc
+import threading
+import time
+import weakref
+
+from ndex.ndpush.slack_notifier import SlackNotifier
+
+
+class FakeSlack:
+    # records calls like the chat/files parts of a Slacker object
+    def __init__(self, delay=0):
+        self.delay = delay
+        self.messages = []
+        self.uploads = []
+        self.chat = self
+        self.files = self
+
+    def post_message(self, channel, text, username=None):
+        time.sleep(self.delay)
+        self.messages.append(text)
+
+    def upload(self, content=None, channels=None, title=None):
+        self.uploads.append(content)
+
+
+class TestSlackNotifier:
+
+    def create_log(self, tmp_path):
+        logfile = tmp_path / 'log.txt'
+        logfile.write_text(''.join('line {}\n'.format(i) for i in range(20)))
+        return str(logfile)
+
+    def test_send_does_not_block(self, tmp_path):
+        slack = FakeSlack(delay=1)
+        notifier = SlackNotifier(slack, 'usr', self.create_log(tmp_path),
+                                 coalesce_interval=0)
+
+        start = time.time()
+        for idx in range(5):
+            notifier.send('msg {}'.format(idx))
+        assert time.time() - start < 0.5
+
+        notifier.close()
+        assert '\n'.join(slack.messages).count('msg') == 5
+
+    def test_coalesce(self, tmp_path):
+        slack = FakeSlack()
+        notifier = SlackNotifier(slack, 'usr', self.create_log(tmp_path),
+                                 coalesce_interval=0.5)
+        threads = [threading.Thread(target=notifier.send, args=('msg {}'.format(idx),))
+                   for idx in range(10)]
+        [t.start() for t in threads]
+        [t.join() for t in threads]
+        notifier.close()
+
+        assert len(slack.messages) == 1
+        assert slack.messages[0].count('msg') == 10
+        # the log tail is uploaded with the message
+        assert slack.uploads[0].split('\n')[-1] == 'line 19'
+
+    def test_truncate_and_upload_cap(self, tmp_path):
+        slack = FakeSlack()
+        notifier = SlackNotifier(slack, 'usr', self.create_log(tmp_path), coalesce_interval=0,
+                                 min_post_interval=0, max_uploads_per_min=1, max_msgs_per_post=2)
+        notifier.deliver(['a', 'b', 'c', 'd'])
+        notifier.deliver(['e'])
+        notifier.close()
+
+        assert slack.messages == ['a\nb\n... and 2 more messages (see {})'.format(notifier.logfile), 'e']
+        assert len(slack.uploads) == 1
+
+    def test_send_after_close(self, tmp_path, capsys):
+        slack = FakeSlack()
+        notifier = SlackNotifier(slack, 'usr', self.create_log(tmp_path), coalesce_interval=0)
+        notifier.close()
+        notifier.send('late')
+        notifier.close()
+
+        assert slack.messages == []
+        assert 'Slack message not sent, notifier is closed: late' in capsys.readouterr().out
+
+    def test_close_releases_notifier(self, tmp_path):
+        notifier = SlackNotifier(FakeSlack(), 'usr', self.create_log(tmp_path))
+        notifier.close()
+        # no longer referenced by its atexit handler (or its thread)
+        ref = weakref.ref(notifier)
+        del notifier
+        gc.collect()
+        assert ref() is None
@@ -0,0 +1,115 @@
+import hashlib
+from argparse import Namespace
+
+import numpy as np
+import pytest
+
+from ndex.ndpush.event_log import EventLog, read_events
+from ndex.ndpush import verify
+from ndex.ndpush.verify import (HASH_OVERSAMPLE, block_hash, get_hash_name, get_hash_probability,
+                                get_posted_blocks, sample_blocks, verify_blocks, verify_channel,
+                                verify_event_log)
+
+
+class TestVerify:
+
+    def setup_method(self):
+        self.data = np.random.randint(0, 255, size=(16, 64, 64), dtype='uint8')
+
+    def test_block_hash(self):
+        # the hash is of the data as stored in the Boss
+        assert block_hash(self.data, 'uint64') == block_hash(self.data.astype('uint64'), 'uint64')
+        assert block_hash(self.data, 'uint8') != block_hash(self.data, 'uint64')
+        assert block_hash(self.data[:, :32], 'uint8') == block_hash(
+            self.data[:, :32].copy(), 'uint8')
+
+        assert block_hash(self.data, 'uint8', 'blake2b').startswith('blake2b:')
+        assert block_hash(self.data, 'uint8', 'sha256').startswith('sha256:')
+        with pytest.raises(ValueError):
+            block_hash(self.data, 'uint8', 'md4')
+
+    def test_hash_name_fallback(self, monkeypatch):
+        # python 3.5 has no blake2b
+        monkeypatch.setattr(verify, 'xxhash', None)
+        monkeypatch.delattr(hashlib, 'blake2b')
+        assert get_hash_name() == 'sha256'
+        assert block_hash(self.data, 'uint8').startswith('sha256:')
+
+    def test_hash_probability(self):
+        # about HASH_OVERSAMPLE * num_samples blocks of a channel are hashed
+        total_nbytes = 1000 * 512**2 * 16
+        probability = get_hash_probability(512**2 * 16, total_nbytes, 10)
+        assert probability * 1000 == pytest.approx(HASH_OVERSAMPLE * 10)
+        # blocks twice as large are half as many
+        assert get_hash_probability(2 * 512**2 * 16, total_nbytes, 10) == pytest.approx(2 * probability)
+        assert get_hash_probability(512**2 * 16, 512**2 * 16 * 10, 10) == 1
+        assert get_hash_probability(512**2 * 16, total_nbytes, 0) == 0
+
+    def test_verify_event_log_without_hashes(self, tmp_path):
+        eventfile = str(tmp_path / 'events.jsonl')
+        event_log = EventLog(eventfile)
+        event_log.record('post', coll='c', exp='e', ch='ch', x=[0, 512], y=[0, 512], z=[0, 16],
+                         status='ok', hash=None)
+        event_log.flush()
+
+        # nothing to verify isn't a pass
+        with pytest.raises(ValueError):
+            verify_event_log(eventfile)
+
+    def test_posted_blocks(self, tmp_path):
+        eventfile = str(tmp_path / 'events.jsonl')
+        event_log = EventLog(eventfile)
+        cutout = {'coll': 'c', 'exp': 'e', 'ch': 'ch', 'y': [0, 512], 'z': [0, 16]}
+        event_log.record('post', x=[0, 512], status='ok', hash='h0', **cutout)
+        event_log.record('post', x=[512, 1024], status='failed', **cutout)
+        event_log.record('post', x=[0, 512], status='ok', hash='h1', **cutout)
+        event_log.flush()
+
+        blocks = get_posted_blocks(eventfile)
+        assert blocks == {('c', 'e', 'ch', (0, 512), (0, 512), (0, 16)): 'h1'}
+
+    def test_sample_blocks(self):
+        blocks = {('c', 'e', 'ch', (x, x + 512), (0, 512), (0, 16)): str(x)
+                  for x in range(0, 512 * 100, 512)}
+        sample = sample_blocks(blocks, 10, seed=1)
+        assert len(sample) == 10
+        assert sample == sample_blocks(blocks, 10, seed=1)
+        assert all(blocks[key] == hash_value for key, hash_value in sample)
+
+        assert len(sample_blocks(blocks, 1000)) == 100
+
+    def test_verify_blocks(self):
+        boss = {0: self.data, 64: self.data + 1, 128: self.data}
+        blocks = [(('c', 'e', 'ch', (x, x + 64), (0, 64), (0, 16)), block_hash(self.data, 'uint8'))
+                  for x in (0, 64, 128, 192)]
+
+        def fetch(x_rng, y_rng, z_rng):
+            return boss[x_rng[0]]
+
+        results = verify_blocks(blocks, fetch, 'uint8', threads=2)
+        assert [status for _, status in results] == ['ok', 'mismatch', 'ok', 'error']
+
+    def test_verify_channel(self, tmp_path):
+        eventfile = str(tmp_path / 'events.jsonl')
+        event_log = EventLog(eventfile)
+        msgs = []
+        ingest_job = Namespace(
+            event_log=event_log, send_msg=lambda msg, send_slack=False: msgs.append(msg),
+            record_event=lambda event, x_rng, y_rng, z_rng, **fields: event_log.record(
+                event, coll='c', exp='e', ch='ch', x=list(x_rng), y=list(y_rng), z=list(z_rng),
+                **fields),
+            boss_datatype='uint8')
+        for x in (0, 64):
+            ingest_job.record_event('post', [x, x + 64], [0, 64], [0, 16], status='ok',
+                                    hash=block_hash(self.data, 'uint8'))
+
+        def fetch(x_rng, y_rng, z_rng):
+            # read_region raises once the attempts of a request are used up
+            if x_rng[0] == 64:
+                raise ConnectionError('1 of 1 requests failed')
+            return self.data
+
+        assert not verify_channel(ingest_job, fetch, num_samples=10, threads=2)
+        statuses = {tuple(event['x']): event['status'] for event in read_events(eventfile, 'verify')}
+        assert statuses == {(0, 64): 'ok', (64, 128): 'error'}
+        assert verify_channel(ingest_job, lambda x_rng, y_rng, z_rng: self.data, num_samples=10)
@@ -0,0 +1,111 @@
+import numpy as np
+import pytest
+
+from ndex.benchmarks.mock_boss import MockBoss
+from ndex.ndpull.volume import BossVolume, CuboidCache
+
+
+def gen_volume(x_rng, y_rng, z_rng):
+    z, y, x = np.meshgrid(np.arange(*z_rng), np.arange(*y_rng), np.arange(*x_rng),
+                          indexing='ij')
+    return ((x + 3 * y + 7 * z) % 65521).astype('uint16')
+
+
+class TestBossVolume:
+
+    def setup_method(self):
+        # coordinate frame starting at x 512, z 8, not a multiple of the cuboids at the end
+        self.extents = [[512, 1600], [0, 700], [8, 30]]
+        self.data = gen_volume(*self.extents)
+        self.boss = MockBoss().start()
+        self.boss.add_channel('coll', 'exp', 'ch', datatype='uint16', x_extent=self.extents[0],
+                              y_extent=self.extents[1], z_extent=self.extents[2])
+        self.boss.write('coll', 'exp', 'ch', 0, *self.extents, self.data)
+
+    def teardown_method(self):
+        self.boss.stop()
+
+    def get_volume(self, tmp_path, **kwargs):
+        config_file = self.boss.write_config(str(tmp_path / 'mock.cfg'))
+        return BossVolume('coll', 'exp', 'ch', config_file=config_file,
+                          cache_dir=str(tmp_path / 'cache'), **kwargs)
+
+    def num_cutouts(self):
+        return self.boss.num_requests.get(('GET', 'cutout'), 0)
+
+    def test_metadata(self, tmp_path):
+        vol = self.get_volume(tmp_path)
+        assert vol.shape == self.data.shape == (22, 700, 1088)
+        assert vol.dtype == np.uint16
+        assert vol.offset == [512, 0, 8]
+        assert len(vol) == 22 and vol.ndim == 3
+        assert vol.nbytes == self.data.nbytes
+        assert 'coll/exp/ch' in repr(vol)
+
+    def test_slicing(self, tmp_path):
+        vol = self.get_volume(tmp_path, request_size_mb=1)
+        keys = [
+            np.s_[3:20, 100:650, 400:1000],
+            np.s_[:, :, :],
+            np.s_[5],
+            np.s_[-1, 650:, -10:],
+            np.s_[2:22:5, 10, ::-7],
+            np.s_[..., 1000:],
+            np.s_[4, ...],
+            np.s_[10:2, :, :],
+            np.s_[np.int64(3), 5:9],
+        ]
+        for key in keys:
+            assert np.array_equal(vol[key], self.data[key]), key
+
+    def test_cached(self, tmp_path):
+        vol = self.get_volume(tmp_path)
+        # a single cuboid (z 16-32 in the Boss)
+        data = vol[8:22, 0:512, 0:512]
+        assert self.num_cutouts() == 1
+        assert np.array_equal(data, self.data[8:22, 0:512, 0:512])
+
+        # same cuboid
+        assert np.array_equal(vol[10:16, 100:200, 0:100], self.data[10:16, 100:200, 0:100])
+        assert self.num_cutouts() == 1
+
+        # only the missing cuboids are downloaded
+        assert np.array_equal(vol[8:22, 0:700, 0:512], self.data[8:22, 0:700, 0:512])
+        assert self.num_cutouts() == 2
+
+    def test_concurrent_requests(self, tmp_path):
+        vol = self.get_volume(tmp_path, request_size_mb=1, threads=4)
+        assert np.array_equal(vol[...], self.data)
+        # 1 MB requests are single cuboids: 3 in x, 2 in y, 2 in z
+        assert self.num_cutouts() == 3 * 2 * 2
+
+    def test_bad_indices(self, tmp_path):
+        vol = self.get_volume(tmp_path)
+        with pytest.raises(IndexError):
+            vol[22]
+        with pytest.raises(IndexError):
+            vol[0, 0, 0, 0]
+        with pytest.raises(TypeError):
+            vol[[1, 2]]
+        with pytest.raises(ValueError):
+            vol.read([0, 512], [0, 512], [8, 16])
+        assert vol[5:5].shape == (0, 700, 1088)
+        assert self.num_cutouts() == 0
+
+
+class TestCuboidCache:
+
+    def test_lru(self):
+        cache = CuboidCache(max_bytes=300)
+        cache.put('a', np.zeros(100, dtype='uint8'))
+        cache.put('b', np.zeros(100, dtype='uint8'))
+        cache.put('c', np.zeros(100, dtype='uint8'))
+        assert cache.get('a') is not None
+        cache.put('d', np.zeros(100, dtype='uint8'))
+
+        assert cache.get('b') is None
+        assert all(cache.get(key) is not None for key in 'acd')
+        assert cache.nbytes == 300
+        # larger than the cache
+        cache.put('e', np.zeros(400, dtype='uint8'))
+        assert cache.get('e') is None
@@ -0,0 +1,216 @@
+import json
+import os
+
+import numpy as np
+import pytest
+
+from ndex.benchmarks.boss_benchmark import get_ingest_args
+from ndex.benchmarks.mock_boss import MockBoss
+from ndex.ndpull.zarr_writer import ZarrWriter
+from ndex.ndpush.ingest_large_vol import per_channel_ingest, setup_channel_ingest
+from ndex.ndpush import volume_source
+from ndex.ndpush.volume_source import (ChunkedSource, HDF5Source, VolumeSource, ZarrSource,
+                                       get_chunk_ranges, next_prime)
+
+
+def gen_volume(shape):
+    z, y, x = np.meshgrid(*[np.arange(s) for s in shape], indexing='ij')
+    return ((x + 3 * y + 7 * z) % 65521).astype('uint16')
+
+
+def write_zarr(path, data, chunks, compressed=True):
+    writer = ZarrWriter(path, data.shape, data.dtype, chunks=chunks).create()
+    writer.write_region(data, [0, data.shape[2]], [0, data.shape[1]], [0, data.shape[0]])
+    if not compressed:
+        # the chunks written again without a compressor
+        with open(os.path.join(path, '.zarray')) as f:
+            meta = json.load(f)
+        meta['compressor'] = None
+        with open(os.path.join(path, '.zarray'), 'w') as f:
+            json.dump(meta, f)
+        for index in writer.get_chunk_indices([0, data.shape[2]], [0, data.shape[1]],
+                                              [0, data.shape[0]]):
+            chunk = writer.read_chunk(index)
+            with open(writer.get_chunk_fname(index), 'wb') as f:
+                f.write(chunk.tobytes())
+    return writer
+
+
+class TestZarrSource:
+
+    def setup_method(self):
+        self.data = gen_volume((20, 70, 90))
+
+    def test_abstract(self):
+        # sources implement read, chunked sources read_chunk_region
+        with pytest.raises(TypeError):
+            VolumeSource('path')
+        with pytest.raises(TypeError):
+            ChunkedSource('path')
+
+    def test_chunk_ranges(self):
+        assert get_chunk_ranges([5, 40], 16) == [(0, [5, 16]), (1, [16, 32]), (2, [32, 40])]
+        assert get_chunk_ranges([16, 32], 16) == [(1, [16, 32])]
+
+    @pytest.mark.parametrize('compressed', [True, False])
+    def test_read(self, tmp_path, compressed):
+        path = str(tmp_path / 'array')
+        write_zarr(path, self.data, (7, 32, 25), compressed=compressed)
+        source = ZarrSource(path, threads=4)
+        assert source.get_img_info() == (90, 70, np.dtype('uint16'))
+
+        for z_rng, y_rng, x_rng in [([0, 20], [0, 70], [0, 90]), ([3, 16], [10, 65], [24, 51]),
+                                    ([19, 20], [69, 70], [0, 1])]:
+            expected = self.data[z_rng[0]:z_rng[1], y_rng[0]:y_rng[1], x_rng[0]:x_rng[1]]
+            assert np.array_equal(source.read(z_rng, y_rng, x_rng), expected)
+
+    def test_missing_chunk(self, tmp_path):
+        path = str(tmp_path / 'array')
+        write_zarr(path, self.data, (16, 64, 64))
+        os.remove(os.path.join(path, '1.0.1'))
+        data = ZarrSource(path).read([0, 20], [0, 70], [0, 90])
+        assert not data[16:, :64, 64:].any()
+        assert np.array_equal(data[:16], self.data[:16])
+
+    def test_bad_arrays(self, tmp_path):
+        with pytest.raises(ValueError):
+            ZarrSource(str(tmp_path / 'missing'))
+
+        path = str(tmp_path / 'array')
+        write_zarr(path, self.data, (16, 64, 64))
+        source = ZarrSource(path)
+        with pytest.raises(ValueError):
+            source.read([0, 21], [0, 70], [0, 90])
+        with pytest.raises(ValueError):
+            source.read([5, 5], [0, 70], [0, 90])
+
+        with open(os.path.join(path, '.zarray')) as f:
+            meta = json.load(f)
+        meta['shape'] = [20, 70]
+        meta['chunks'] = [16, 64]
+        with open(os.path.join(path, '.zarray'), 'w') as f:
+            json.dump(meta, f)
+        with pytest.raises(ValueError):
+            ZarrSource(path)
+
+    def test_read_with_zarr(self, tmp_path):
+        zarr = pytest.importorskip('zarr')
+        path = str(tmp_path / 'array')
+        array = zarr.open(path, mode='w', shape=self.data.shape, chunks=(5, 40, 40),
+                          dtype='uint16')
+        array[:] = self.data
+        assert np.array_equal(ZarrSource(path).read([2, 19], [5, 70], [0, 80]),
+                              self.data[2:19, 5:70, 0:80])
+
+
+class TestHDF5Source:
+
+    def setup_method(self):
+        self.data = gen_volume((20, 70, 90))
+
+    def write_h5(self, path, chunks):
+        h5py = pytest.importorskip('h5py')
+        with h5py.File(path, 'w') as f:
+            f.create_dataset('volumes/ch1', data=self.data, chunks=chunks, compression='gzip')
+            f.create_dataset('flat', data=self.data[0])
+
+    def test_next_prime(self):
+        assert [next_prime(n) for n in (0, 2, 100, 521, 522)] == [2, 2, 101, 521, 523]
+
+    def test_read(self, tmp_path):
+        path = str(tmp_path / 'vol.h5')
+        self.write_h5(path, (7, 32, 25))
+        source = HDF5Source(path, 'volumes/ch1')
+        assert source.get_img_info() == (90, 70, np.dtype('uint16'))
+        assert source.chunks == [7, 32, 25]
+        # a layer of chunks: 3 x 4 of 7 x 32 x 25 uint16
+        assert source.cache_nbytes == 12 * 7 * 32 * 25 * 2
+        assert source.file.id.get_access_plist().get_cache()[2] == source.cache_nbytes
+
+        for z_rng in ([0, 16], [16, 20], [3, 9]):
+            assert np.array_equal(source.read(z_rng, [0, 70], [0, 90]),
+                                  self.data[z_rng[0]:z_rng[1]])
+        assert np.array_equal(source.read([2, 5], [10, 20], [30, 31]), self.data[2:5, 10:20, 30:31])
+        assert HDF5Source(path, 'volumes/ch1', cache_mb=2).cache_nbytes == 2 * 1024**2
+
+        source.close()
+        assert not source.file
+
+    def test_cache_limits(self, tmp_path, monkeypatch):
+        path = str(tmp_path / 'vol.h5')
+        self.write_h5(path, (7, 32, 25))
+        # the default cache is capped, but still fits a chunk
+        monkeypatch.setattr(volume_source, 'H5_MAX_DEFAULT_CACHE_MB', 0.01)
+        monkeypatch.setattr(volume_source, 'H5_MAX_CACHE_SLOTS', 50)
+        source = HDF5Source(path, 'volumes/ch1')
+        assert source.cache_nbytes == 7 * 32 * 25 * 2
+        assert source.file.id.get_access_plist().get_cache()[1] == 53
+        assert np.array_equal(source.read([0, 20], [0, 70], [0, 90]), self.data)
+
+    def test_bad_datasets(self, tmp_path):
+        path = str(tmp_path / 'vol.h5')
+        self.write_h5(path, (16, 64, 64))
+        with pytest.raises(ValueError, match='volumes/ch1'):
+            HDF5Source(path, 'volumes/ch2')
+        with pytest.raises(ValueError):
+            HDF5Source(path, 'flat')
+        with pytest.raises(ValueError):
+            HDF5Source(str(tmp_path / 'missing.h5'), 'volumes/ch1')
+        with pytest.raises(ValueError):
+            HDF5Source(path, 'volumes/ch1').read([0, 21], [0, 70], [0, 90])
+
+    def test_no_h5py(self, tmp_path, monkeypatch):
+        monkeypatch.setattr(volume_source, 'h5py', None)
+        with pytest.raises(ValueError, match='h5py'):
+            HDF5Source(str(tmp_path / 'vol.h5'), 'volumes/ch1')
+
+
+class TestZarrIngest:
+
+    def setup_method(self):
+        self.boss = MockBoss().start()
+
+    def teardown_method(self):
+        self.boss.stop()
+
+    def test_ingest(self, tmp_path, monkeypatch):
+        # the ingest logs are written to the working directory
+        monkeypatch.chdir(tmp_path)
+        data = gen_volume((40, 600, 700))
+        write_zarr(str(tmp_path / 'ch1.zarr'), data, (10, 256, 256))
+
+        config_file = self.boss.write_config(str(tmp_path / 'mock.cfg'))
+        args = get_ingest_args(config_file, None, 'uint16', (700, 600, 40), 'ch1', (512, 512))
+        args.datasource = 'zarr'
+        args.base_path = str(tmp_path / '<ch>.zarr')
+        args.base_filename = args.extension = None
+        args.create_resources = True
+        setup_channel_ingest(args, 'ch1')
+        args.create_resources = False
+        assert per_channel_ingest(args, 'ch1', threads=4) == 0
+
+        ingested = self.boss.read('ndex_benchmark', args.experiment, 'ch1', 0,
+                                  [0, 700], [0, 600], [0, 40], 'uint16')
+        assert np.array_equal(ingested, data)
+
+    def test_ingest_hdf5(self, tmp_path, monkeypatch):
+        h5py = pytest.importorskip('h5py')
+        monkeypatch.chdir(tmp_path)
+        data = gen_volume((40, 600, 700))
+        with h5py.File(str(tmp_path / 'vol.h5'), 'w') as f:
+            f.create_dataset('ch1', data=data, chunks=(10, 256, 256), compression='gzip')
+
+        config_file = self.boss.write_config(str(tmp_path / 'mock.cfg'))
+        args = get_ingest_args(config_file, None, 'uint16', (700, 600, 40), 'ch1', (512, 512))
+        args.datasource = 'hdf5'
+        args.base_path = str(tmp_path / 'vol.h5')
+        args.h5_dataset = '<ch>'
+        args.base_filename = args.extension = None
+        args.create_resources = True
+        setup_channel_ingest(args, 'ch1')
+        args.create_resources = False
+        assert per_channel_ingest(args, 'ch1', threads=4) == 0
+
+        ingested = self.boss.read('ndex_benchmark', args.experiment, 'ch1', 0,
+                                  [0, 700], [0, 600], [0, 40], 'uint16')
+        assert np.array_equal(ingested, data)
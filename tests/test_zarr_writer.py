@@ -0,0 +1,132 @@
+import json
+import os
+
+import blosc
+import numpy as np
+import pytest
+
+from ndex.benchmarks.mock_boss import MockBoss
+from ndex.ndpull import ndpull
+from ndex.ndpull.zarr_writer import ZarrWriter
+
+
+def gen_volume(x_rng, y_rng, z_rng):
+    z, y, x = np.meshgrid(np.arange(*z_rng), np.arange(*y_rng), np.arange(*x_rng),
+                          indexing='ij')
+    return ((x + 3 * y + 7 * z) % 65521).astype('uint16')
+
+
+def read_zarr(path):
+    # the whole array (zyx) from the chunk files, missing chunks are the fill value
+    with open(os.path.join(path, '.zarray')) as f:
+        meta = json.load(f)
+    shape, chunks = meta['shape'], meta['chunks']
+    data = np.full(shape, meta['fill_value'], dtype=meta['dtype'])
+    for z in range(-(-shape[0] // chunks[0])):
+        for y in range(-(-shape[1] // chunks[1])):
+            for x in range(-(-shape[2] // chunks[2])):
+                fname = os.path.join(path, '{}.{}.{}'.format(z, y, x))
+                if not os.path.exists(fname):
+                    continue
+                with open(fname, 'rb') as f:
+                    chunk = np.frombuffer(blosc.decompress(f.read()), dtype=meta['dtype'])
+                chunk = chunk.reshape(chunks)
+                region = data[z * chunks[0]:(z + 1) * chunks[0], y * chunks[1]:(y + 1) * chunks[1],
+                              x * chunks[2]:(x + 1) * chunks[2]]
+                region[...] = chunk[tuple(slice(0, s) for s in region.shape)]
+    return data
+
+
+class TestZarrWriter:
+
+    def test_write_region(self, tmp_path):
+        # data starts at x 100, z 2, the array ends mid chunk
+        path = str(tmp_path / 'array')
+        writer = ZarrWriter(path, (20, 600, 700), 'uint16', chunks=(16, 512, 512),
+                            data_start=(2, 0, 100), attrs={'name': 'test'}).create()
+        with open(os.path.join(path, '.zarray')) as f:
+            meta = json.load(f)
+        assert meta['dtype'] == '<u2' and meta['chunks'] == [16, 512, 512]
+        assert meta['compressor']['id'] == 'blosc'
+
+        data = gen_volume([100, 700], [0, 600], [2, 20])
+        writer.write_region(data, [100, 700], [0, 600], [2, 20])
+        assert sorted(os.listdir(path)) == ['.zarray', '.zattrs', '0.0.0', '0.0.1', '0.1.0',
+                                            '0.1.1', '1.0.0', '1.0.1', '1.1.0', '1.1.1']
+        assert writer.has_chunks([0, 700], [0, 600], [0, 20])
+
+        expected = np.zeros((20, 600, 700), dtype='uint16')
+        expected[2:, :, 100:] = data
+        assert np.array_equal(read_zarr(path), expected)
+        chunk = writer.read_chunk((1, 1, 1))
+        assert chunk.shape == (16, 512, 512)
+        assert np.array_equal(chunk[:4, :88, :188], expected[16:, 512:, 512:])
+        assert not chunk[4:].any()
+
+        # existing arrays have to match
+        with pytest.raises(ValueError):
+            ZarrWriter(path, (20, 600, 700), 'uint8').create()
+        ZarrWriter(path, (20, 600, 700), 'uint16').create()
+
+    def test_partial_region(self, tmp_path):
+        writer = ZarrWriter(str(tmp_path / 'array'), (32, 1024, 1024), 'uint8').create()
+        with pytest.raises(ValueError):
+            writer.write_region(np.zeros((16, 512, 500), dtype='uint8'), [0, 500], [0, 512], [0, 16])
+        assert not writer.has_chunks([0, 512], [0, 512], [0, 16])
+
+
+class TestDownloadZarr:
+
+    def setup_method(self):
+        self.extents = [[0, 1600], [0, 700], [0, 40]]
+        self.data = gen_volume(*self.extents)
+        self.boss = MockBoss().start()
+        self.boss.add_channel('coll', 'exp', 'ch', datatype='uint16', x_extent=self.extents[0],
+                              y_extent=self.extents[1], z_extent=self.extents[2])
+        self.boss.write('coll', 'exp', 'ch', 0, *self.extents, self.data)
+
+    def teardown_method(self):
+        self.boss.stop()
+
+    def num_cutouts(self):
+        return self.boss.num_requests.get(('GET', 'cutout'), 0)
+
+    def pull(self, tmp_path, x, y, z):
+        args = ndpull.collect_input_args(
+            'coll', 'exp', 'ch', config_file=self.boss.write_config(str(tmp_path / 'mock.cfg')),
+            x=x, y=y, z=z, outdir=str(tmp_path), cache_dir=str(tmp_path / 'cache'),
+            request_size_mb=1)
+        result, rmt = ndpull.validate_args(args)
+        return ndpull.download_zarr(result, rmt, threads=4)
+
+    def test_download_zarr(self, tmp_path):
+        path = self.pull(tmp_path, [100, 700], [0, 600], [3, 20])
+        assert path == str(tmp_path / 'coll_exp_ch.zarr' / '0')
+        assert os.path.exists(str(tmp_path / 'coll_exp_ch.zarr' / '.zgroup'))
+        # expanded to whole cuboids: 2 x 2 x 2 (single cuboid requests)
+        assert self.num_cutouts() == 8
+
+        data = read_zarr(path)
+        assert data.shape == (40, 700, 1600)
+        assert np.array_equal(data[0:32, 0:700, 0:1024], self.data[0:32, 0:700, 0:1024])
+        assert not data[32:].any() and not data[:, :, 1024:].any()
+
+        with open(os.path.join(path, '.zattrs')) as f:
+            attrs = json.load(f)['boss']
+        assert attrs['channel'] == 'ch' and attrs['voxel_size'] == [1, 1, 1]
+
+    def test_resume(self, tmp_path):
+        path = self.pull(tmp_path, [0, 1600], [0, 700], [0, 40])
+        assert self.num_cutouts() == 4 * 2 * 3
+        assert np.array_equal(read_zarr(path), self.data)
+
+        # an interrupted pull: only the cutouts with missing chunks are downloaded again
+        os.remove(os.path.join(path, '1.1.2'))
+        path = self.pull(tmp_path, [0, 1600], [0, 700], [0, 40])
+        assert self.num_cutouts() == 4 * 2 * 3 + 1
+        assert np.array_equal(read_zarr(path), self.data)
+
+    def test_read_with_zarr(self, tmp_path):
+        zarr = pytest.importorskip('zarr')
+        path = self.pull(tmp_path, [0, 1600], [0, 700], [0, 40])
+        assert np.array_equal(zarr.open(path, mode='r')[:], self.data)